@@ -0,0 +1,169 @@
+"""
+Runs the release tasks directly, without Invoke, for projects configured in the `[invoke_release]` section of
+`setup.cfg` (or of `invoke-release.cfg`) instead of in `tasks.py`:
+
+    [invoke_release]
+    module_name = my_project
+    display_name = My Project
+    python_directory = python
+    plugins =
+        invoke_release.plugins:PatternReplaceVersionInFilesPlugin README.md docs/conf.py
+    remotes = origin github
+
+Every argument of `configure_release_parameters` can be set, with `true`/`false` for switches and whitespace-separated
+lists for lists. Each line of `plugins` names a plugin class (`module:Class`) followed by its arguments, either
+positional or `name=value`. Because only the release tasks are imported, instead of Invoke's whole task collection
+and the project's `tasks.py`, the tasks start much faster:
+
+    $ invoke-release version
+    $ invoke-release release --release-version 2.1.0
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+
+import argparse
+import importlib
+import inspect
+import os
+import shlex
+import sys
+
+import six
+from six.moves import configparser
+
+
+CONFIGURATION_FILENAMES = ('invoke-release.cfg', 'setup.cfg')
+CONFIGURATION_SECTION = 'invoke_release'
+
+CLI_TASKS = {
+    'release': 'release',
+    'branch': 'branch',
+    'rollback-release': 'rollback_release',
+    'version': 'version',
+    'verify-tags': 'verify_tags',
+}
+
+BOOLEAN_PARAMETERS = ('use_pull_request', 'use_tag', 'maintain_repository', 'scoped_history', 'fast_commit')
+LIST_PARAMETERS = ('history_paths', 'remotes', 'best_effort_remotes')
+STRING_PARAMETERS = ('module_name', 'display_name', 'python_directory', 'metrics_file', 'index_directory')
+
+
+def find_configuration_file(directory):
+    """
+    Returns the nearest configuration file with an `[invoke_release]` section in the directory or one of its parents
+    (up to the root of the Git working tree), or `None` if there is none.
+    """
+    directory = os.path.abspath(directory)
+    while True:
+        for file_name in CONFIGURATION_FILENAMES:
+            file_name = os.path.join(directory, file_name)
+            if os.path.isfile(file_name) and _read_parser(file_name).has_section(CONFIGURATION_SECTION):
+                return file_name
+        parent = os.path.dirname(directory)
+        if parent == directory or os.path.exists(os.path.join(directory, '.git')):
+            return None
+        directory = parent
+
+
+def _read_parser(file_name):
+    parser = configparser.RawConfigParser()
+    parser.read(file_name)
+    return parser
+
+
+def _load_plugin(specification):
+    words = shlex.split(specification)
+    module_name, _, class_name = words[0].partition(':')
+    if not class_name:
+        raise ValueError('Plugins must be given as "module:Class [arguments]", not "{}".'.format(specification))
+
+    arguments = [word for word in words[1:] if '=' not in word]
+    keyword_arguments = dict(word.split('=', 1) for word in words[1:] if '=' in word)
+    return getattr(importlib.import_module(module_name), class_name)(*arguments, **keyword_arguments)
+
+
+def read_configuration(file_name):
+    """
+    Reads the `[invoke_release]` section of the configuration file and returns the keyword arguments for
+    `configure_release_parameters`.
+    """
+    parser = _read_parser(file_name)
+    parameters = {}
+    for name, value in parser.items(CONFIGURATION_SECTION):
+        if name in BOOLEAN_PARAMETERS:
+            parameters[name] = parser.getboolean(CONFIGURATION_SECTION, name)
+        elif name in LIST_PARAMETERS:
+            parameters[name] = value.split()
+        elif name in STRING_PARAMETERS:
+            parameters[name] = value.strip()
+        elif name == 'plugins':
+            parameters[name] = [_load_plugin(line) for line in value.splitlines() if line.strip()]
+        else:
+            raise ValueError('Unknown option "{}" in the [{}] section.'.format(name, CONFIGURATION_SECTION))
+
+    for name in ('module_name', 'display_name'):
+        if not parameters.get(name):
+            raise ValueError('The [{}] section must set "{}".'.format(CONFIGURATION_SECTION, name))
+    return parameters
+
+
+def _get_task_parameters(task_function):
+    if six.PY2:
+        specification = inspect.getargspec(task_function)
+    else:
+        specification = inspect.getfullargspec(task_function)
+    # The first argument is the Invoke context, which the release tasks do not use
+    return list(zip(specification.args[1:], specification.defaults or ()))
+
+
+def _add_task_parser(commands, command, task):
+    task_parser = commands.add_parser(command, help=' '.join((task.__doc__ or '').split()))
+    for name, default in _get_task_parameters(task.body):
+        option = '--{}'.format(name.replace('_', '-'))
+        help_text = task.help.get(name.replace('_', '-'))
+        if isinstance(default, bool):
+            task_parser.add_argument(option, dest=name, action='store_true', help=help_text)
+        elif isinstance(default, int):
+            task_parser.add_argument(option, dest=name, type=int, default=default, help=help_text)
+        else:
+            task_parser.add_argument(option, dest=name, default=default, help=help_text)
+
+
+def main(argv=None):
+    from invoke_release import tasks
+
+    parser = argparse.ArgumentParser(prog='invoke-release', description=__doc__.strip().split('\n\n')[0])
+    commands = parser.add_subparsers(dest='command')
+    for command, task_name in sorted(CLI_TASKS.items()):
+        _add_task_parser(commands, command, getattr(tasks, task_name))
+
+    arguments = vars(parser.parse_args(argv))
+    command = arguments.pop('command')
+    if not command:
+        parser.print_help()
+        sys.exit(2)
+
+    configuration_file = find_configuration_file(os.getcwd())
+    if not configuration_file:
+        print(
+            'ERROR: No {} with an [{}] section was found in this directory or its parents.'.format(
+                ' or '.join(CONFIGURATION_FILENAMES),
+                CONFIGURATION_SECTION,
+            ),
+            file=sys.stderr,
+        )
+        sys.exit(2)
+
+    # Plugins may be defined in the project itself, as they can be when configured in `tasks.py`
+    sys.path.insert(0, os.path.dirname(configuration_file))
+    try:
+        parameters = read_configuration(configuration_file)
+    except (ImportError, AttributeError, TypeError, ValueError, configparser.Error) as e:
+        print('ERROR: Invalid configuration in {}: {}'.format(configuration_file, e), file=sys.stderr)
+        sys.exit(2)
+
+    tasks.configure_release_parameters(**parameters)
+    getattr(tasks, CLI_TASKS[command]).body(None, **arguments)
+
+
+if __name__ == '__main__':
+    main()
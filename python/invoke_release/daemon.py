@@ -0,0 +1,568 @@
+"""
+A long-running release daemon that keeps one warm worker process per repository.
+
+Each worker imports the repository's `tasks.py` once (so `configure_release_parameters`, root directory discovery, and
+plugin construction happen only once), keeps the repository's tag list and parsed `packed-refs` between requests
+(each is read again only when Git has changed it), shares one SSH connection to the remote across requests, and runs
+the release requests for its repository one at a time, in the order they were received. Requests for different
+repositories run in parallel. A thin client submits a request, streams the task output back, and forwards its standard
+input to the task's prompts, so the daemon can serve both humans and bots:
+
+    $ python -m invoke_release.daemon serve &
+    $ printf '2.1.0\\nn\\nn\\n...' | python -m invoke_release.daemon submit --repository /path/to/repo release
+"""
+from __future__ import absolute_import, unicode_literals
+
+import argparse
+import codecs
+import json
+import os
+import runpy
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import traceback
+
+import six
+from six.moves import queue
+
+from invoke_release.tasks import _get_cache_directory
+
+
+DAEMON_TASKS = {
+    'release': 'release',
+    'branch': 'branch',
+    'rollback-release': 'rollback_release',
+    'rollback_release': 'rollback_release',
+}
+
+EVENT_QUEUED = 'queued'
+EVENT_STARTED = 'started'
+EVENT_OUTPUT = 'output'
+EVENT_DONE = 'done'
+
+RESULT_COMPLETED = 'completed'
+RESULT_EXIT = 'exit'
+RESULT_ERROR = 'error'
+
+BOOLEAN_VALUES = {
+    'true': True, 'yes': True, 'on': True, '1': True,
+    'false': False, 'no': False, 'off': False, '0': False,
+}
+
+# Written by a worker to its own output after each job, so that all of the job's output is forwarded before `done`
+_JOB_END_MARKER = b'\x00invoke-release-job-end\x00'
+
+
+def get_default_socket_path():
+    return os.path.join(os.environ.get('XDG_RUNTIME_DIR') or _get_cache_directory(), 'invoke-release.sock')
+
+
+class MessageChannel(object):
+    """
+    Sends and receives newline-delimited JSON messages over a stream socket. Sending is thread-safe.
+    """
+
+    def __init__(self, sock):
+        self.socket = sock
+        self._buffer = b''
+        self._send_lock = threading.Lock()
+
+    def send(self, **message):
+        data = json.dumps(message, separators=(',', ':')).encode('utf8') + b'\n'
+        with self._send_lock:
+            self.socket.sendall(data)
+
+    def receive(self):
+        """
+        Blocks until a complete message is received and returns it, or returns `None` if the other end closed the
+        connection.
+        """
+        while b'\n' not in self._buffer:
+            try:
+                chunk = self.socket.recv(65536)
+            except socket.error:
+                chunk = b''
+            if not chunk:
+                return None
+            self._buffer += chunk
+        line, self._buffer = self._buffer.split(b'\n', 1)
+        return json.loads(line.decode('utf8'))
+
+    def close(self):
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self.socket.close()
+
+
+class RepositoryWorker(object):
+    """
+    The daemon-side handle of one repository's worker process, with the queue of jobs waiting for it.
+    """
+
+    def __init__(self, daemon, repository):
+        self.daemon = daemon
+        self.repository = repository
+        self.jobs = queue.Queue()
+        self.busy = False
+        self._next_job_id = 0
+        self._start_process()
+
+        self._dispatcher = threading.Thread(target=self._dispatch)
+        self._dispatcher.daemon = True
+        self._dispatcher.start()
+
+    def _start_process(self):
+        daemon_end, worker_end = socket.socketpair()
+        package_directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        environment = dict(
+            os.environ,
+            PYTHONPATH=os.pathsep.join(filter(None, [package_directory, os.environ.get('PYTHONPATH')])),
+        )
+        kwargs = {'pass_fds': (worker_end.fileno(), )} if six.PY3 else {'close_fds': False}
+        self.process = subprocess.Popen(
+            [
+                sys.executable, '-u', '-m', 'invoke_release.daemon', 'worker',
+                '--channel-fd', str(worker_end.fileno()),
+                '--repository', self.repository,
+            ],
+            env=environment,
+            **kwargs
+        )
+        worker_end.close()
+        self.channel = MessageChannel(daemon_end)
+
+    def submit(self, client, request):
+        position = self.jobs.qsize() + (1 if self.busy else 0)
+        self._notify(client, event=EVENT_QUEUED, position=position, repository=self.repository)
+        self.jobs.put((client, request))
+
+    def _dispatch(self):
+        while True:
+            client, request = self.jobs.get()
+            self.busy = True
+            self._next_job_id += 1
+            try:
+                self._run_job(self._next_job_id, client, request)
+            finally:
+                self.busy = False
+                client.close()
+
+    @staticmethod
+    def _notify(client, **message):
+        try:
+            client.send(**message)
+            return True
+        except socket.error:
+            return False  # The client went away; the job's progress is simply not reported anymore
+
+    def _run_job(self, job_id, client, request):
+        if not self._notify(client, event=EVENT_STARTED, repository=self.repository):
+            return
+
+        try:
+            self.channel.send(job=job_id, task=request['task'], arguments=request.get('arguments') or {},
+                              environment=request.get('environment') or {})
+        except socket.error:
+            self.daemon.forget_worker(self)
+            self._notify(client, event=EVENT_DONE, result=RESULT_ERROR, message='The repository worker is not running.')
+            return
+
+        forwarder = threading.Thread(target=self._forward_input, args=(job_id, client))
+        forwarder.daemon = True
+        forwarder.start()
+
+        while True:
+            message = self.channel.receive()
+            if message is None:
+                self.daemon.forget_worker(self)
+                self._notify(client, event=EVENT_DONE, result=RESULT_ERROR,
+                             message='The repository worker exited unexpectedly.')
+                return
+            # Even if the client went away, keep draining until the job is done so the worker stays in sync
+            self._notify(client, **message)
+            if message.get('event') == EVENT_DONE:
+                return
+
+    def _forward_input(self, job_id, client):
+        # The job ID lets the worker discard input that arrives after the job it was meant for has finished
+        while True:
+            message = client.receive()
+            try:
+                if message is None:
+                    self.channel.send(job=job_id, eof=True)
+                    return
+                if 'input' in message:
+                    self.channel.send(job=job_id, input=message['input'])
+            except socket.error:
+                return
+
+    def stop(self):
+        self.channel.close()
+        self.process.wait()
+
+
+class ReleaseDaemon(object):
+    """
+    Listens on a Unix socket and routes each request to the worker for its repository, starting workers on demand.
+    """
+
+    def __init__(self, socket_path):
+        self.socket_path = socket_path
+        self.workers = {}
+        self._workers_lock = threading.Lock()
+
+    def _is_listening(self):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.socket_path)
+            return True
+        except socket.error:
+            return False
+        finally:
+            probe.close()
+
+    def serve_forever(self):
+        if os.path.exists(self.socket_path):
+            if self._is_listening():
+                sys.stderr.write('ERROR: A release daemon is already listening on {}.\n'.format(self.socket_path))
+                sys.exit(1)
+            os.unlink(self.socket_path)  # Left behind by a daemon that did not shut down cleanly
+        if not os.path.isdir(os.path.dirname(self.socket_path)):
+            os.makedirs(os.path.dirname(self.socket_path))
+
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # The socket is created with the umask's permissions, so only its owner can ever connect to it
+        umask = os.umask(0o177)
+        try:
+            listener.bind(self.socket_path)
+        finally:
+            os.umask(umask)
+        listener.listen(64)
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+        sys.stdout.write('Invoke Release daemon listening on {}\n'.format(self.socket_path))
+        sys.stdout.flush()
+
+        try:
+            while True:
+                connection, _ = listener.accept()
+                handler = threading.Thread(target=self._accept_request, args=(MessageChannel(connection), ))
+                handler.daemon = True
+                handler.start()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            listener.close()
+            os.unlink(self.socket_path)
+            for worker in list(self.workers.values()):
+                worker.stop()
+
+    def _accept_request(self, client):
+        request = client.receive()
+        if not request:
+            client.close()
+            return
+
+        try:
+            if request.get('task') not in DAEMON_TASKS:
+                raise ValueError('Unsupported task "{}". Supported tasks are: {}.'.format(
+                    request.get('task'),
+                    ', '.join(sorted(DAEMON_TASKS)),
+                ))
+            repository = subprocess.check_output(
+                ['git', 'rev-parse', '--show-toplevel'],
+                cwd=request.get('repository') or '.',
+            ).decode('utf8').strip()
+        except (ValueError, OSError, subprocess.CalledProcessError) as e:
+            client.send(event=EVENT_DONE, result=RESULT_ERROR, message=six.text_type(e))
+            client.close()
+            return
+
+        self._get_worker(os.path.normpath(repository)).submit(client, request)
+
+    def _get_worker(self, repository):
+        with self._workers_lock:
+            worker = self.workers.get(repository)
+            if not worker:
+                worker = self.workers[repository] = RepositoryWorker(self, repository)
+            return worker
+
+    def forget_worker(self, worker):
+        with self._workers_lock:
+            if self.workers.get(worker.repository) is worker:
+                del self.workers[worker.repository]
+
+
+class _WorkerOutputForwarder(threading.Thread):
+    """
+    Forwards everything written to the worker's standard output and error (by Python code and by subprocesses alike)
+    to the daemon, and sends each job's `done` message once the job's output has been forwarded completely.
+    """
+
+    def __init__(self, channel, read_descriptor):
+        super(_WorkerOutputForwarder, self).__init__()
+        self.daemon = True
+        self.channel = channel
+        self.read_descriptor = read_descriptor
+        self.results = queue.Queue()
+        self.job_id = None
+
+    def run(self):
+        decoder = codecs.getincrementaldecoder('utf8')('replace')
+        pending = b''
+        while True:
+            chunk = os.read(self.read_descriptor, 65536)
+            if not chunk:
+                return
+            pending += chunk
+            while _JOB_END_MARKER in pending:
+                output, pending = pending.split(_JOB_END_MARKER, 1)
+                self._send_output(decoder.decode(output, final=True))
+                self.channel.send(event=EVENT_DONE, job=self.job_id, **self.results.get())
+            # Hold back anything that could be the start of a marker split across reads
+            keep = len(_JOB_END_MARKER) - 1
+            if len(pending) > keep:
+                self._send_output(decoder.decode(pending[:-keep]))
+                pending = pending[-keep:]
+
+    def _send_output(self, text):
+        if text:
+            self.channel.send(event=EVENT_OUTPUT, job=self.job_id, data=text)
+
+
+def _share_ssh_connections():
+    # Remote operations of consecutive requests reuse one SSH connection instead of negotiating a new one every time
+    if 'GIT_SSH_COMMAND' not in os.environ and 'GIT_SSH' not in os.environ:
+        control_directory = tempfile.mkdtemp(prefix='ir-ssh-')
+        os.environ['GIT_SSH_COMMAND'] = (
+            'ssh -o ControlMaster=auto -o ControlPersist=300 -o ControlPath={}/%C'.format(control_directory)
+        )
+
+
+def run_worker(channel_descriptor, repository):
+    channel = MessageChannel(socket.fromfd(channel_descriptor, socket.AF_UNIX, socket.SOCK_STREAM))
+    os.close(channel_descriptor)
+
+    # Everything the tasks and their subprocesses write goes through this pipe to the daemon
+    output_read, output_write = os.pipe()
+    os.dup2(output_write, 1)
+    os.dup2(output_write, 2)
+    os.close(output_write)
+    forwarder = _WorkerOutputForwarder(channel, output_read)
+    forwarder.start()
+
+    os.chdir(repository)
+    _share_ssh_connections()
+    sys.path.insert(0, repository)
+    task_module = runpy.run_path(os.path.join(repository, 'tasks.py'))
+
+    from invoke import Context
+    from invoke_release import tasks
+
+    jobs = queue.Queue()
+    job_input = {}
+    job_input_lock = threading.Lock()
+
+    def read_channel():
+        while True:
+            message = channel.receive()
+            if message is None:
+                jobs.put(None)
+                return
+            with job_input_lock:
+                if 'task' in message:
+                    # Each job gets a fresh standard input, so that the end of one client's input does not affect the
+                    # next job. It is created here, because the input may arrive before the job starts running.
+                    message['input_descriptor'], job_input['descriptor'] = os.pipe()
+                    job_input['job'] = message['job']
+                    jobs.put(message)
+                    continue
+                if message.get('job') != job_input.get('job') or 'descriptor' not in job_input:
+                    continue  # Input for a job that has already finished
+                if 'input' in message:
+                    os.write(job_input['descriptor'], message['input'].encode('utf8'))
+                elif message.get('eof'):
+                    os.close(job_input.pop('descriptor'))
+
+    reader = threading.Thread(target=read_channel)
+    reader.daemon = True
+    reader.start()
+
+    while True:
+        job = jobs.get()
+        if job is None:
+            return
+
+        os.dup2(job['input_descriptor'], 0)
+        os.close(job['input_descriptor'])
+        sys.stdin = os.fdopen(os.dup(0), 'r')
+        forwarder.job_id = job['job']
+
+        original_environment = dict(os.environ)
+        os.environ.update(job['environment'])
+        # The version module must be re-imported, because the previous release changed it
+        sys.modules.pop('{}.version'.format(tasks.MODULE_NAME), None)
+
+        result = {'result': RESULT_COMPLETED}
+        try:
+            task_module[DAEMON_TASKS[job['task']]](Context(), **job['arguments'])
+        except SystemExit as e:
+            result = {'result': RESULT_EXIT, 'code': e.code}
+        except BaseException:
+            result = {'result': RESULT_ERROR, 'message': traceback.format_exc()}
+        finally:
+            os.environ.clear()
+            os.environ.update(original_environment)
+            with job_input_lock:
+                if 'descriptor' in job_input:
+                    os.close(job_input.pop('descriptor'))
+            sys.stdin.close()
+
+        sys.stdout.flush()
+        sys.stderr.flush()
+        forwarder.results.put(result)
+        os.write(1, _JOB_END_MARKER)
+
+
+def submit(socket_path, repository, task_name, arguments=None, environment=None, input_stream=None,
+           output_stream=None):
+    """
+    Submits a request to the daemon, forwards lines from `input_stream` to the task's prompts, and writes the task
+    output to `output_stream` as it arrives. Returns the process exit code for the request.
+    """
+    input_stream = input_stream or sys.stdin
+    output_stream = output_stream or sys.stdout
+
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(socket_path)
+    channel = MessageChannel(client)
+    channel.send(
+        repository=os.path.abspath(repository),
+        task=task_name,
+        arguments=arguments or {},
+        environment=environment or {},
+    )
+
+    def forward_input():
+        for line in iter(input_stream.readline, ''):
+            if not isinstance(line, six.text_type):
+                line = line.decode('utf8')
+            try:
+                channel.send(input=line)
+            except socket.error:
+                return
+        try:
+            channel.send(eof=True)
+        except socket.error:
+            pass
+
+    forwarder = threading.Thread(target=forward_input)
+    forwarder.daemon = True
+
+    while True:
+        message = channel.receive()
+        if message is None:
+            sys.stderr.write('The release daemon closed the connection unexpectedly.\n')
+            return 1
+
+        event = message.get('event')
+        if event == EVENT_QUEUED and message['position']:
+            sys.stderr.write('Waiting for {} earlier request(s) for {}...\n'.format(
+                message['position'],
+                message['repository'],
+            ))
+        elif event == EVENT_STARTED:
+            # Only read input once the task is running, so that queued requests leave the terminal alone
+            forwarder.start()
+        elif event == EVENT_OUTPUT:
+            output_stream.write(message['data'])
+            output_stream.flush()
+        elif event == EVENT_DONE:
+            channel.close()
+            if message['result'] == RESULT_COMPLETED:
+                return 0
+            if message['result'] == RESULT_EXIT:
+                return message['code'] if isinstance(message['code'], int) else 1
+            sys.stderr.write(message.get('message', 'The request failed.') + '\n')
+            return 1
+
+
+def _parse_options(task_name, options):
+    """
+    Parses `NAME[=VALUE]` options into the task's keyword arguments, converting each value to the type of the task
+    parameter's default, as the `invoke-release` command line does. A switch given without a value is turned on.
+    """
+    from invoke_release import tasks
+    from invoke_release.cli import _get_task_parameters
+
+    defaults = dict(_get_task_parameters(getattr(tasks, DAEMON_TASKS[task_name]).body))
+    parsed = {}
+    for option in options or []:
+        name, has_value, value = option.partition('=')
+        name = name.replace('-', '_')
+        if name not in defaults:
+            raise ValueError('Unknown option "{}" for task {}.'.format(option, task_name))
+        default = defaults[name]
+        if isinstance(default, bool):
+            if has_value and value.lower() not in BOOLEAN_VALUES:
+                raise ValueError('Option "{}" must be true or false.'.format(name))
+            value = BOOLEAN_VALUES[value.lower()] if has_value else True
+        elif not has_value:
+            raise ValueError('Option "{}" needs a value.'.format(name))
+        elif isinstance(default, int):
+            try:
+                value = int(value)
+            except ValueError:
+                raise ValueError('Option "{}" must be an integer.'.format(name))
+        parsed[name] = value
+    return parsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m invoke_release.daemon', description=__doc__.split('\n\n')[0])
+    parser.add_argument('--socket', default=get_default_socket_path(), help='The Unix socket path of the daemon.')
+    commands = parser.add_subparsers(dest='command')
+
+    commands.add_parser('serve', help='Run the release daemon in the foreground.')
+
+    submit_parser = commands.add_parser('submit', help='Submit a request to the release daemon.')
+    submit_parser.add_argument('task', choices=sorted(DAEMON_TASKS))
+    submit_parser.add_argument('--repository', default='.', help='The repository to release (default: current).')
+    submit_parser.add_argument('--option', action='append', metavar='NAME[=VALUE]',
+                               help='A task option, such as "verbose" or "no-stash". May be repeated.')
+    submit_parser.add_argument('--env', action='append', metavar='NAME=VALUE',
+                               help='An environment variable for the task, such as INVOKE_RELEASE_EDITOR=true.')
+
+    worker_parser = commands.add_parser('worker')
+    worker_parser.add_argument('--channel-fd', type=int, required=True)
+    worker_parser.add_argument('--repository', required=True)
+
+    arguments = parser.parse_args(argv)
+    if arguments.command == 'serve':
+        ReleaseDaemon(arguments.socket).serve_forever()
+    elif arguments.command == 'submit':
+        try:
+            task_arguments = _parse_options(arguments.task, arguments.option)
+        except ValueError as e:
+            parser.error(six.text_type(e))
+        sys.exit(submit(
+            arguments.socket,
+            arguments.repository,
+            arguments.task,
+            arguments=task_arguments,
+            environment=dict(variable.split('=', 1) for variable in arguments.env or []),
+        ))
+    elif arguments.command == 'worker':
+        run_worker(arguments.channel_fd, arguments.repository)
+    else:
+        parser.print_help()
+        sys.exit(2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,247 @@
+"""
+Releases many repositories at once, each in its own process, from a manifest of repositories and target versions.
+
+The manifest is a JSON list of objects with a `repository` path (relative to the manifest), the `version` to release,
+and an optional `changelog` message (without one, built-up changelog details or recent commit messages are used):
+
+    [
+        {"repository": "service-a", "version": "2.1.0"},
+        {"repository": "service-b", "version": "1.4.0", "changelog": "- Upgraded the client library"}
+    ]
+
+Each release runs non-interactively (as with `invoke release --release-version VERSION --yes`), with its output
+written to its own log file, and a summary table is printed when all releases are done:
+
+    $ python -m invoke_release.fleet manifest.json --jobs 4 --keep-going
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+
+import argparse
+import codecs
+import json
+import multiprocessing
+import os
+import runpy
+import sys
+import time
+import traceback
+
+from six.moves import queue
+
+
+RESULT_SUCCESS = 'success'
+RESULT_FAILURE = 'failure'
+RESULT_SKIPPED = 'skipped'
+
+# How often to check for release processes that died without reporting a result
+RESULT_POLL_SECONDS = 1
+
+
+def read_manifest(manifest_filename):
+    """
+    Reads the manifest and returns its entries, with each repository path made absolute.
+    """
+    with codecs.open(manifest_filename, 'rb', encoding='utf8') as manifest_read:
+        entries = json.load(manifest_read)
+
+    if not isinstance(entries, list):
+        raise ValueError('The manifest must be a JSON list of {"repository": ..., "version": ...} objects.')
+
+    base_directory = os.path.dirname(os.path.abspath(manifest_filename))
+    for entry in entries:
+        if not entry.get('repository') or not entry.get('version'):
+            raise ValueError('Every manifest entry needs a "repository" and a "version": {}'.format(entry))
+        entry['repository'] = os.path.normpath(os.path.join(base_directory, entry['repository']))
+    return entries
+
+
+def _get_log_filename(log_directory, index, entry):
+    name = os.path.basename(entry['repository'].rstrip(os.sep)) or 'repository'
+    # The manifest position keeps the names unique when several repositories have the same directory name
+    return os.path.join(log_directory, '{:03d}-{}-{}.log'.format(index + 1, name, entry['version']))
+
+
+def _release_repository(entry, log_filename):
+    """
+    Runs in a release process (which is used for this one release only, so that no state leaks between repositories):
+    releases the repository with its output redirected to the log file, and returns the result.
+    """
+    started = time.time()
+    result = RESULT_FAILURE
+
+    with open(log_filename, 'ab') as log:
+        os.dup2(log.fileno(), 1)
+        os.dup2(log.fileno(), 2)
+    with open(os.devnull, 'rb') as null:
+        os.dup2(null.fileno(), 0)
+
+    try:
+        os.chdir(entry['repository'])
+        sys.path.insert(0, entry['repository'])
+        task_module = runpy.run_path(os.path.join(entry['repository'], 'tasks.py'))
+
+        from invoke import Context
+        from invoke_release.tasks import METRICS_RESULT_SUCCESS, _get_last_task_result
+
+        task_module['release'](
+            Context(),
+            release_version=entry['version'],
+            changelog=entry.get('changelog'),
+            yes=True,
+            no_stash=entry.get('no_stash', False),
+            verbose=entry.get('verbose', False),
+        )
+        if _get_last_task_result() == METRICS_RESULT_SUCCESS:
+            result = RESULT_SUCCESS
+    except SystemExit:
+        pass
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+    return {
+        'repository': entry['repository'],
+        'version': entry['version'],
+        'result': result,
+        'duration': time.time() - started,
+        'log': log_filename,
+    }
+
+
+def _run_release_process(index, entry, log_filename, completed):
+    completed.put((index, _release_repository(entry, log_filename)))
+
+
+def _get_lost_result(job):
+    """
+    Returns the failure result of a release process that exited without reporting a result (because it was killed or
+    crashed), after noting that in its log.
+    """
+    with open(job['log'], 'a') as log:
+        log.write('\nThe release process exited with code {} without reporting a result.\n'.format(
+            job['process'].exitcode,
+        ))
+    return {
+        'repository': job['entry']['repository'],
+        'version': job['entry']['version'],
+        'result': RESULT_FAILURE,
+        'duration': time.time() - job['started'],
+        'log': job['log'],
+    }
+
+
+def release_fleet(entries, jobs, log_directory, keep_going=False, output_stream=None):
+    """
+    Releases the manifest entries with at most `jobs` (at least one) releases running at a time, each in its own
+    process, reporting each result as it completes. Unless `keep_going` is set, no more releases are started after the
+    first failure (releases already running are allowed to finish, and the rest are reported as skipped). A release
+    process that dies without reporting a result counts as a failure. Returns the results in manifest order.
+    """
+    output_stream = output_stream or sys.stdout
+    jobs = max(1, jobs)
+    if not os.path.isdir(log_directory):
+        os.makedirs(log_directory)
+
+    results = {}
+    completed = multiprocessing.Queue()
+    pending = list(enumerate(entries))
+    running = {}
+    stopping = False
+
+    try:
+        while pending or running:
+            while pending and len(running) < jobs and not stopping:
+                index, entry = pending.pop(0)
+                log_filename = _get_log_filename(log_directory, index, entry)
+                print('Releasing {} version {} (log: {})...'.format(entry['repository'], entry['version'],
+                                                                    log_filename), file=output_stream)
+                process = multiprocessing.Process(
+                    target=_run_release_process,
+                    args=(index, entry, log_filename, completed),
+                )
+                process.start()
+                running[index] = {'process': process, 'entry': entry, 'log': log_filename, 'started': time.time()}
+
+            if not running:
+                break
+
+            try:
+                finished = [completed.get(timeout=RESULT_POLL_SECONDS)]
+            except queue.Empty:
+                dead = [index for index, job in running.items() if not job['process'].is_alive()]
+                if not dead:
+                    continue
+                # A process puts its result before it exits, so first collect the results that are still in transit
+                finished = []
+                try:
+                    while True:
+                        finished.append(completed.get(timeout=RESULT_POLL_SECONDS))
+                except queue.Empty:
+                    pass
+                reported = set(index for index, _ in finished)
+                finished.extend((index, _get_lost_result(running[index])) for index in dead if index not in reported)
+
+            for index, result in finished:
+                running.pop(index)['process'].join()
+                results[index] = result
+                print('{result}: {repository} version {version} ({duration:.1f}s)'.format(**result),
+                      file=output_stream)
+                if result['result'] != RESULT_SUCCESS and not keep_going:
+                    stopping = True
+    finally:
+        for job in running.values():
+            job['process'].join()
+
+    for index, entry in pending:
+        results[index] = {
+            'repository': entry['repository'],
+            'version': entry['version'],
+            'result': RESULT_SKIPPED,
+            'duration': 0.0,
+            'log': '',
+        }
+
+    return [results[index] for index in sorted(results)]
+
+
+def format_summary(results):
+    """
+    Formats the release results as a plain-text table.
+    """
+    rows = [('Repository', 'Version', 'Result', 'Duration', 'Log')]
+    rows.extend(
+        (r['repository'], r['version'], r['result'], '{:.1f}s'.format(r['duration']), r['log']) for r in results
+    )
+    widths = [max(len(row[column]) for row in rows) for column in range(len(rows[0]))]
+    lines = ['  '.join(value.ljust(width) for value, width in zip(row, widths)).rstrip() for row in rows]
+    lines.insert(1, '  '.join('-' * width for width in widths))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m invoke_release.fleet', description=__doc__.split('\n\n')[0])
+    parser.add_argument('manifest', help='The JSON manifest of repositories and versions to release.')
+    parser.add_argument('--jobs', '-j', type=int, default=multiprocessing.cpu_count(),
+                        help='The maximum number of releases to run at once (default: the number of CPUs).')
+    parser.add_argument('--keep-going', action='store_true',
+                        help='Keep releasing the remaining repositories after a release fails.')
+    parser.add_argument('--log-dir', default='invoke-release-logs',
+                        help='The directory for the per-repository log files (default: invoke-release-logs).')
+
+    arguments = parser.parse_args(argv)
+    try:
+        entries = read_manifest(arguments.manifest)
+    except (IOError, OSError, ValueError) as e:
+        print('ERROR: Could not read manifest {}: {}'.format(arguments.manifest, e), file=sys.stderr)
+        sys.exit(2)
+
+    results = release_fleet(entries, arguments.jobs, os.path.abspath(arguments.log_dir), arguments.keep_going)
+    print('', file=sys.stdout)
+    print(format_summary(results), file=sys.stdout)
+    sys.exit(0 if all(r['result'] == RESULT_SUCCESS for r in results) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,10 +2,22 @@ from __future__ import absolute_import, unicode_literals
 
 import codecs
 import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+import six
+from six.moves import queue
 
 from invoke_release.tasks import ReleaseFailure
 
 
+DISCOVER_UPDATE = 'update'
+DISCOVER_REPORT = 'report'
+
+
 class AbstractInvokeReleasePlugin(object):
     def __init__(self, *extra_files_to_commit):
         self.__extra_files_to_commit = extra_files_to_commit or []
@@ -137,8 +149,44 @@ class AbstractInvokeReleasePlugin(object):
 
 
 class PatternReplaceVersionInFilesPlugin(AbstractInvokeReleasePlugin):
-    def __init__(self, *files_to_search):
+    """
+    Replaces the current version with the new version in the given files. With `discover`, it also uses `git grep` to
+    find the other tracked files (in the index) that contain the current version, so that none are forgotten, and
+    either updates them as well (`discover='update'`) or reports them as errors from `version_error_check` (which
+    cancels the release) so that they can be added to the list (`discover='report'`). The version and changelog files
+    are never discovered.
+
+    :param files_to_search: The relative names of the files to update
+    :param discover: `None` (the default), `'update'`, or `'report'`
+    :type discover: str | unicode
+    :param include: If specified, only files matching these glob patterns (relative to the root directory) are
+                    discovered
+    :type include: list
+    :param exclude: Files matching these glob patterns are not discovered
+    :type exclude: list
+    """
+
+    def __init__(self, *files_to_search, **kwargs):
         super(PatternReplaceVersionInFilesPlugin, self).__init__(*files_to_search)
+        self.discover = kwargs.pop('discover', None)
+        self.include = list(kwargs.pop('include', None) or [])
+        self.exclude = list(kwargs.pop('exclude', None) or [])
+        if kwargs:
+            raise TypeError('Unexpected keyword arguments: {}'.format(', '.join(sorted(kwargs))))
+        if self.discover not in (None, DISCOVER_UPDATE, DISCOVER_REPORT):
+            raise ValueError('discover must be None, "update", or "report".')
+        self._discovered_files = {}
+        self._current_version = None
+
+    def get_extra_files_to_commit(self, root_directory):
+        listed = set()
+        for file_name in super(PatternReplaceVersionInFilesPlugin, self).get_extra_files_to_commit(root_directory):
+            listed.add(file_name)
+            yield file_name
+        if self.discover == DISCOVER_UPDATE:
+            for file_name in self._discover_files(root_directory):
+                if file_name not in listed:
+                    yield file_name
 
     def version_error_check(self, root_directory):
         file_errors = []
@@ -150,9 +198,47 @@ class PatternReplaceVersionInFilesPlugin(AbstractInvokeReleasePlugin):
                         plugin_class=self.__class__.__name__,
                     )
                 )
+        if self.discover == DISCOVER_REPORT:
+            listed = set(super(PatternReplaceVersionInFilesPlugin, self).get_extra_files_to_commit(root_directory))
+            for file_name in self._discover_files(root_directory):
+                if file_name not in listed:
+                    file_errors.append(
+                        'The file {file_name} contains the current version but is not updated by {plugin_class}! '
+                        'Add it to the list of files, or exclude it.'.format(
+                            file_name=file_name,
+                            plugin_class=self.__class__.__name__,
+                        )
+                    )
         return file_errors
 
+    def _discover_files(self, root_directory):
+        """
+        Returns the absolute names of the tracked files that contain the current version. The current version is the
+        one the last release or rollback hook received, because the version file may already contain the new version
+        by the time the files are needed. Before any hook runs (as in `invoke version`), it is read from the version
+        file. The result is cached per version.
+        """
+        from invoke_release import tasks
+
+        current_version = self._current_version or tasks._import_version_or_exit()
+        key = (root_directory, current_version)
+        if key not in self._discovered_files:
+            exclude = self.exclude + [
+                os.path.relpath(file_name, root_directory)
+                for file_name in (tasks.VERSION_FILENAME, tasks.CHANGELOG_FILENAME)
+            ]
+            self._discovered_files[key] = [
+                os.path.join(root_directory, file_name)
+                for file_name in _find_tracked_files_containing(root_directory, current_version, self.include, exclude)
+            ]
+        return self._discovered_files[key]
+
+    def pre_release(self, root_directory, old_version):
+        self._current_version = old_version
+        super(PatternReplaceVersionInFilesPlugin, self).pre_release(root_directory, old_version)
+
     def pre_commit(self, root_directory, old_version, new_version):
+        self._current_version = old_version
         for file_name in self.get_extra_files_to_commit(root_directory):
             contents = []
             with codecs.open(file_name, 'rb', encoding='utf8') as file_read:
@@ -162,3 +248,166 @@ class PatternReplaceVersionInFilesPlugin(AbstractInvokeReleasePlugin):
                 for line in contents:
                     file_write.write(line)
                     file_write.write('\n')
+
+    def pre_rollback(self, root_directory, current_version):
+        self._current_version = current_version
+        super(PatternReplaceVersionInFilesPlugin, self).pre_rollback(root_directory, current_version)
+
+
+class ParallelPreReleaseChecksPlugin(AbstractInvokeReleasePlugin):
+    """
+    Runs pre-release checks (tests, type checks, linters, license scans, etc.) as shell commands in the project root
+    directory, several at a time, and fails the release if any of them fails. Each line of output is prefixed with
+    the name of its check. Commands are either shell command strings (which also serve as their names) or
+    `(name, command)` tuples:
+
+        ParallelPreReleaseChecksPlugin(
+            ('tests', 'pytest -q'),
+            ('types', 'mypy python'),
+            'flake8',
+            max_workers=3,
+            timeout=600,
+        )
+
+    :param commands: The checks to run
+    :param max_workers: The maximum number of checks to run at once (default: the number of CPUs)
+    :type max_workers: int
+    :param timeout: The number of seconds after which a check is killed and considered failed (default: no timeout)
+    :type timeout: int | float
+    """
+
+    def __init__(self, *commands, **kwargs):
+        super(ParallelPreReleaseChecksPlugin, self).__init__()
+        self.checks = [command if isinstance(command, tuple) else (command, command) for command in commands]
+        self.max_workers = kwargs.pop('max_workers', None) or _cpu_count()
+        self.timeout = kwargs.pop('timeout', None)
+        if kwargs:
+            raise TypeError('Unexpected keyword arguments: {}'.format(', '.join(sorted(kwargs))))
+        self._output_lock = threading.Lock()
+
+    def pre_release(self, root_directory, old_version):
+        super(ParallelPreReleaseChecksPlugin, self).pre_release(root_directory, old_version)
+
+        pending = queue.Queue()
+        for check in self.checks:
+            pending.put(check)
+        failures = []
+
+        def work():
+            while True:
+                try:
+                    name, command = pending.get_nowait()
+                except queue.Empty:
+                    return
+                failure = self._run_check(root_directory, name, command)
+                if failure:
+                    failures.append(failure)
+
+        workers = [threading.Thread(target=work) for _ in range(min(self.max_workers, len(self.checks)))]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        if failures:
+            raise ReleaseFailure(
+                'The following pre-release checks failed:\n{}'.format(
+                    '\n'.join('  - {}'.format(failure) for failure in sorted(failures)),
+                )
+            )
+
+    def _run_check(self, root_directory, name, command):
+        """
+        Runs one check, streaming its output, and returns a description of its failure, or `None` if it passed.
+        """
+        started = time.time()
+        self._write(name, 'Running `{}`...'.format(command))
+        # Its own session and process group, so that a timeout kills everything the shell started. `preexec_fn` is
+        # not safe to use from a thread, so it is only used on Python 2, which lacks `start_new_session`.
+        if six.PY3:
+            kwargs = {'start_new_session': True}
+        else:
+            kwargs = {'preexec_fn': getattr(os, 'setsid', None)}
+        try:
+            with open(os.devnull, 'rb') as null:
+                process = subprocess.Popen(
+                    command,
+                    shell=True,
+                    cwd=root_directory,
+                    stdin=null,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT,
+                    **kwargs
+                )
+        except OSError as e:
+            return '{}: could not be started: {}'.format(name, e.strerror)
+
+        timed_out = []
+        timer = None
+        if self.timeout:
+            def kill():
+                timed_out.append(True)
+                try:
+                    if hasattr(os, 'killpg'):
+                        os.killpg(process.pid, signal.SIGKILL)
+                    else:
+                        process.kill()
+                except OSError:
+                    pass  # It finished in the meantime
+            timer = threading.Timer(self.timeout, kill)
+            timer.daemon = True
+            timer.start()
+
+        try:
+            for line in iter(process.stdout.readline, b''):
+                self._write(name, line.decode('utf8', 'replace').rstrip())
+            return_code = process.wait()
+        finally:
+            if timer:
+                timer.cancel()
+            process.stdout.close()
+
+        duration = time.time() - started
+        if timed_out:
+            self._write(name, 'Timed out after {:.0f} seconds.'.format(self.timeout))
+            return '{}: timed out after {:.0f} seconds'.format(name, self.timeout)
+        if return_code:
+            self._write(name, 'Failed with exit code {} in {:.1f} seconds.'.format(return_code, duration))
+            return '{}: failed with exit code {}'.format(name, return_code)
+        self._write(name, 'Passed in {:.1f} seconds.'.format(duration))
+        return None
+
+    def _write(self, name, line):
+        with self._output_lock:
+            sys.stdout.write('[{}] {}\n'.format(name, line))
+            sys.stdout.flush()
+
+
+def _find_tracked_files_containing(root_directory, text, include, exclude):
+    """
+    Uses `git grep` (which searches the files in the index, using multiple threads, and never reads untracked or
+    ignored files) to find the tracked files that contain the given text, and returns their names relative to the
+    root directory.
+    """
+    command = [
+        'git', 'grep', '--cached', '-F', '-l', '-z', '-I', '--threads={}'.format(_cpu_count()), '-e', text, '--',
+    ] + [
+        ':(top,glob){}'.format(pattern) for pattern in include or ['**']
+    ] + [
+        ':(top,glob,exclude){}'.format(pattern) for pattern in exclude
+    ]
+    process = subprocess.Popen(command, cwd=root_directory, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    output, error = process.communicate()
+    if process.returncode == 1 and not error:
+        return []  # Nothing matched
+    if process.returncode:
+        raise ReleaseFailure('Failed to search for the version with `git grep`: {}'.format(error.decode('utf8')))
+    return [file_name for file_name in output.decode('utf8').split('\0') if file_name]
+
+
+def _cpu_count():
+    try:
+        import multiprocessing
+        return multiprocessing.cpu_count()
+    except (ImportError, NotImplementedError):
+        return 1
@@ -1,27 +1,50 @@
 from __future__ import absolute_import, unicode_literals
 
+import binascii
 import codecs
+import cProfile
+import contextlib
 import datetime
+import glob
+import hashlib
+import json
+import math
 import os
 import re
+import shutil
 import subprocess
 import sys
 import tempfile
+import threading
+import time
 import shlex
-from distutils.version import LooseVersion
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Not available on Windows, where releases are simply not locked
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None  # Not available before Python 3.4, where only CPU profiles can be recorded
 
 from invoke import task
 import six
 from six import moves
-from wheel import archive
 
 RE_CHANGELOG_FILE_HEADER = re.compile(r'^=+$')
 RE_CHANGELOG_VERSION_HEADER = re.compile(r'^-+$')
 RE_FILE_EXTENSION = re.compile(r'\.\w+$')
-RE_VERSION = re.compile(r'^\d+\.\d+\.\d+([a-zA-Z\d.-]*[a-zA-Z\d]+)?$')
+RE_VERSION = re.compile(r'^(\d+)\.(\d+)\.(\d+)([a-zA-Z\d.-]*[a-zA-Z\d]+)?$')
 RE_VERSION_BRANCH_MAJOR = re.compile(r'^\d+\.x\.x$')
 RE_VERSION_BRANCH_MINOR = re.compile(r'^\d+\.\d+\.x$')
-RE_SPLIT_AFTER_DIGITS = re.compile(r'(\d+)')
+RE_PRE_RELEASE_PARTS = re.compile(r'\d+|[a-zA-Z]+')
+RE_PROJECT_NAME_SEPARATORS = re.compile(r'[-_.]+')
+RE_OBJECT_NAME = re.compile(r'^[0-9a-f]{40}(?:[0-9a-f]{24})?$')
+RE_PUSH_WRITTEN_BYTES = re.compile(r'Writing objects:[^\r\n]*?, ([\d.]+) (bytes|KiB|MiB|GiB)')
+
+PUSH_WRITTEN_BYTES_UNITS = {'bytes': 1, 'KiB': 1024, 'MiB': 1024 ** 2, 'GiB': 1024 ** 3}
 
 VERSION_INFO_VARIABLE_TEMPLATE = '__version_info__ = {}'
 VERSION_VARIABLE_TEMPLATE = (
@@ -45,7 +68,56 @@ CHANGELOG_COMMENT_FIRST_CHAR = '#'
 
 PARAMETERS_CONFIGURED = False
 
+ENVIRONMENT_CACHE_TTL = 24 * 60 * 60
+INDEX_PAGE_HEADER_TEMPLATE = (
+    '<!DOCTYPE html>\n'
+    '<html>\n'
+    '  <head>\n'
+    '    <meta name="pypi:repository-version" content="1.0">\n'
+    '    <title>{title}</title>\n'
+    '  </head>\n'
+    '  <body>\n'
+    '    <h1>{title}</h1>\n'
+)
+INDEX_PAGE_FOOTER = '  </body>\n</html>\n'
+METRICS_FILE_ENVIRONMENT_VARIABLE = 'INVOKE_RELEASE_METRICS_FILE'
+METRICS_FILENAME = None
+OUTPUT_ENVIRONMENT_VARIABLE = 'INVOKE_RELEASE_OUTPUT'
+OUTPUT_HELP = (
+    'Specify "json" to write one JSON event per line (for each message, prompt, command, and phase) to standard output '
+    'instead of colored text (default: $INVOKE_RELEASE_OUTPUT or "text").'
+)
+PROFILE_HELP = (
+    'Profile the task with cProfile and write the statistics to this .pstats file (time spent waiting at prompts and '
+    'in the changelog editor is excluded). View them with `python -m pstats FILE`.'
+)
+PROFILE_MEMORY_HELP = (
+    'With --profile, also trace memory allocations and write the N source lines that allocated the most memory to '
+    'FILE.allocations.txt (requires Python 3.4 or newer).'
+)
+MAINTAIN_REPOSITORY = False
+HISTORY_PATHS = None
+FAST_COMMIT = False
+INDEX_DIRECTORY = None
+REMOTES = ['origin']
+BEST_EFFORT_REMOTES = []
+
 __POST_APPLY = False
+__DIRECTORY_ENTRIES = {}
+__GIT_DIRECTORIES = {}
+__PACKED_REFS = {}
+__TAG_LISTS = {}
+__RELEASE_WORKTREE = {}
+__PREFETCHES = {}
+__METRICS = {}
+__RELEASE_LOCK = {}
+__AUTOMATIC_ANSWERS = {}
+__LAST_TASK_RESULT = {}
+__OUTPUT = {}
+__PROFILE = {}
+__CONFIGURATION = {}
+
+_metrics_lock = threading.Lock()
 
 __all__ = [
     'configure_release_parameters',
@@ -54,6 +126,9 @@ __all__ = [
     'wheel',
     'release',
     'rollback_release',
+    'release_stats',
+    'publish',
+    'verify_tags',
 ]
 
 _output = sys.stdout
@@ -69,6 +144,51 @@ PUSH_RESULT_NO_ACTION = 0
 PUSH_RESULT_PUSHED = 1
 PUSH_RESULT_ROLLBACK = 2
 
+METRICS_RESULT_SUCCESS = 'success'
+METRICS_RESULT_FAILURE = 'failure'
+METRICS_RESULT_ERROR = 'error'
+METRICS_RESULT_CANCELED = 'canceled'
+# Durations are summarized in logarithmic buckets, each 1% wider than the last, so percentiles are within 0.5%
+HISTOGRAM_BUCKET_BASE = 1.01
+HISTOGRAM_MINIMUM_DURATION = 0.0001
+
+OUTPUT_TEXT = 'text'
+OUTPUT_JSON = 'json'
+
+LEVEL_DEBUG = 'debug'
+LEVEL_INFO = 'info'
+LEVEL_WARNING = 'warning'
+LEVEL_ERROR = 'error'
+
+COMMIT_GRAPH_MISSING = 'missing'
+COMMIT_GRAPH_STALE = 'stale'
+COMMIT_GRAPH_CURRENT = 'current'
+LOOSE_REFS_PACK_THRESHOLD = 50
+
+TAG_SIGNATURE_GOOD = 'good'
+TAG_SIGNATURE_UNSIGNED = 'unsigned'
+TAG_SIGNATURE_BAD = 'bad signature'
+TAG_SIGNATURE_UNKNOWN_KEY = 'unknown key'
+# The GnuPG status lines (from `git verify-tag --raw`) that decide the result, in order of precedence
+GPG_STATUS_RESULTS = (
+    ('BADSIG', TAG_SIGNATURE_BAD),
+    ('EXPSIG', TAG_SIGNATURE_BAD),
+    ('EXPKEYSIG', TAG_SIGNATURE_BAD),
+    ('REVKEYSIG', TAG_SIGNATURE_BAD),
+    ('NO_PUBKEY', TAG_SIGNATURE_UNKNOWN_KEY),
+    ('ERRSIG', TAG_SIGNATURE_UNKNOWN_KEY),
+    ('GOODSIG', TAG_SIGNATURE_GOOD),
+)
+
+# Environment variables that change where Git finds the repository, which the in-process ref reader leaves to Git
+GIT_DIRECTORY_ENVIRONMENT_VARIABLES = ('GIT_DIR', 'GIT_COMMON_DIR', 'GIT_WORK_TREE')
+# Refs that each worktree has its own copy of, in its private Git directory (all other refs are shared)
+PER_WORKTREE_REF_PREFIXES = ('refs/bisect/', 'refs/worktree/', 'refs/rewritten/')
+SYMBOLIC_REF_PREFIX = 'ref: '
+SYMBOLIC_REF_MAX_DEPTH = 5
+# Modification times this recent cannot tell apart changes made within the same tick of the file system clock
+RACY_MODIFICATION_SECONDS = 2
+
 BRANCH_MASTER = 'master'
 
 INSTRUCTION_NO = 'n'
@@ -81,15 +201,24 @@ INSTRUCTION_EXIT = 'exit'
 INSTRUCTION_ROLLBACK = 'rollback'
 INSTRUCTION_MAJOR = 'major'
 
+# Pre-release labels in release order; unknown labels sort after these (alphabetically), all before the final release
+PRE_RELEASE_LABEL_RANKS = {'dev': 0, 'a': 1, 'alpha': 1, 'b': 2, 'beta': 2, 'c': 3, 'pre': 3, 'preview': 3, 'rc': 3}
+
 
 class ErrorStreamWrapper(object):
     def __init__(self, wrapped):
         self.wrapped = wrapped
 
     def write(self, err):
-        self.wrapped.write('\x1b[{color}m{err}\x1b[0m'.format(color=COLOR_RED_STANDARD, err=err))
+        if _output_is_json():
+            self.wrapped.write(err)
+        else:
+            self.wrapped.write('\x1b[{color}m{err}\x1b[0m'.format(color=COLOR_RED_STANDARD, err=err))
 
     def writelines(self, lines):
+        if _output_is_json():
+            self.wrapped.writelines(lines)
+            return
         self.wrapped.write('\x1b[{}m'.format(COLOR_RED_STANDARD))
         self.wrapped.writelines(lines)
         self.wrapped.write('\x1b[0m')
@@ -116,6 +245,199 @@ class ReleaseExit(Exception):
     """
 
 
+class Version(object):
+    """
+    An immutable, parsed release version: `major.minor.patch` with an optional pre-release suffix (such as `rc1` or
+    `beta.2`). Versions compare and hash by a sort key that is computed once when parsing, in which any pre-release
+    sorts before its final release (1.2.0-dev < 1.2.0-alpha1 < 1.2.0-beta1 < 1.2.0-rc1 < 1.2.0 < 1.2.1). Use `parse`
+    to create instances; it caches the results, so parsing the same tags repeatedly is cheap.
+    """
+
+    __slots__ = ('major', 'minor', 'patch', 'pre_release', '_key')
+
+    _cache = {}
+
+    def __init__(self, major, minor, patch, pre_release=None):
+        self.major = major
+        self.minor = minor
+        self.patch = patch
+        self.pre_release = pre_release or None
+        if self.pre_release:
+            self._key = (major, minor, patch, 0, tuple(
+                (0, int(part), '') if part.isdigit() else
+                (1, PRE_RELEASE_LABEL_RANKS.get(part.lower(), len(PRE_RELEASE_LABEL_RANKS)), part.lower())
+                for part in RE_PRE_RELEASE_PARTS.findall(self.pre_release)
+            ))
+        else:
+            self._key = (major, minor, patch, 1, ())
+
+    @classmethod
+    def parse(cls, text):
+        """
+        Returns the `Version` for the given version string, or raises `ValueError` if it is not a valid version.
+        """
+        try:
+            version = cls._cache[text]
+        except KeyError:
+            match = RE_VERSION.match(text)
+            version = match and cls(
+                int(match.group(1)),
+                int(match.group(2)),
+                int(match.group(3)),
+                (match.group(4) or '').strip(' .-_'),
+            )
+            cls._cache[text] = version
+        if version is None:
+            raise ValueError('Invalid version: {}'.format(text))
+        return version
+
+    @property
+    def version_info(self):
+        """
+        The version as written to `__version_info__` in the version file.
+        """
+        return [self.major, self.minor, self.patch] + ([self.pre_release] if self.pre_release else [])
+
+    @property
+    def minor_branch(self):
+        return '{}.{}.x'.format(self.major, self.minor)
+
+    @property
+    def major_branch(self):
+        return '{}.x.x'.format(self.major)
+
+    def is_on_branch(self, branch_name):
+        """
+        Returns whether this version belongs on the given version branch (for example, 1.2.3 belongs on both 1.2.x
+        and 1.x.x).
+        """
+        return branch_name in (self.minor_branch, self.major_branch)
+
+    def __str__(self):
+        # This must match the code in VERSION_VARIABLE_TEMPLATE at the top of this file
+        return '-'.join(filter(None, ['{}.{}.{}'.format(self.major, self.minor, self.patch), self.pre_release]))
+
+    def __repr__(self):
+        return 'Version({!r})'.format(str(self))
+
+    def __hash__(self):
+        return hash(self._key)
+
+    def __eq__(self, other):
+        if not isinstance(other, Version):
+            return NotImplemented
+        return self._key == other._key
+
+    def __ne__(self, other):
+        if not isinstance(other, Version):
+            return NotImplemented
+        return self._key != other._key
+
+    def __lt__(self, other):
+        if not isinstance(other, Version):
+            return NotImplemented
+        return self._key < other._key
+
+    def __le__(self, other):
+        if not isinstance(other, Version):
+            return NotImplemented
+        return self._key <= other._key
+
+    def __gt__(self, other):
+        if not isinstance(other, Version):
+            return NotImplemented
+        return self._key > other._key
+
+    def __ge__(self, other):
+        if not isinstance(other, Version):
+            return NotImplemented
+        return self._key >= other._key
+
+
+class LazyText(object):
+    """
+    A message argument that is built only when the message is actually formatted, so that expensive arguments of
+    verbose messages (such as joined commands or whole lists) cost nothing when verbose output is off.
+    """
+
+    __slots__ = ('function', 'args')
+
+    def __init__(self, function, *args):
+        self.function = function
+        self.args = args
+
+    def __format__(self, format_spec):
+        return format(self.function(*self.args), format_spec)
+
+    def __str__(self):
+        return six.text_type(self.function(*self.args))
+
+
+class BackgroundCall(object):
+    """
+    Runs a function on a background daemon thread as soon as it is created: read-only commands prefetched while the
+    user answers the prompts that precede their use, and commands run against several remotes at once. `result` waits
+    for the function to finish and returns its return value or re-raises its exception in the calling thread.
+    """
+
+    def __init__(self, function, *args):
+        self._result = None
+        self._exc_info = None
+        self._thread = threading.Thread(target=self._run, args=(function, args))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self, function, args):
+        try:
+            self._result = function(*args)
+        except BaseException:
+            self._exc_info = sys.exc_info()
+
+    def wait(self):
+        self._thread.join()
+
+    def result(self):
+        self.wait()
+        if self._exc_info:
+            six.reraise(*self._exc_info)
+        return self._result
+
+
+class DurationHistogram(object):
+    """
+    Summarizes durations in a single pass, in memory that does not grow with the number of durations: the count, sum,
+    and maximum exactly, and percentiles to within the width of one bucket (see `HISTOGRAM_BUCKET_BASE`).
+    """
+
+    __slots__ = ('buckets', 'count', 'total', 'maximum')
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+
+    def add(self, duration):
+        self.count += 1
+        self.total += duration
+        self.maximum = max(self.maximum, duration)
+        bucket = int(math.floor(math.log(max(duration, HISTOGRAM_MINIMUM_DURATION), HISTOGRAM_BUCKET_BASE)))
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+    def percentile(self, fraction):
+        """
+        Returns (the middle of the bucket holding) the smallest duration such that at least `fraction` of the durations
+        are less than or equal to it, using the nearest-rank method.
+        """
+        rank = max(int(math.ceil(fraction * self.count)), 1)
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min(HISTOGRAM_BUCKET_BASE ** (bucket + 0.5), self.maximum)
+        return self.maximum
+
+
 def _print_output(color, message, *args, **kwargs):
     if _output_is_tty:
         _output.write(
@@ -129,14 +451,70 @@ def _print_output(color, message, *args, **kwargs):
         print(message.format(*args, **kwargs))
 
 
+def _start_output(output):
+    """
+    Selects the output format for the task: colored text, or (with "json") one JSON event per line on standard output
+    for each message, prompt, command, and phase. In JSON mode, everything else that would be written to standard
+    output (by Git, plugins, and so on) is sent to standard error instead, so that standard output contains only events.
+    """
+    _finish_output()
+
+    output = output or os.environ.get(OUTPUT_ENVIRONMENT_VARIABLE) or OUTPUT_TEXT
+    if output not in (OUTPUT_TEXT, OUTPUT_JSON):
+        _error_output_exit('Unknown output format "{}". Must be "{}" or "{}".', output, OUTPUT_TEXT, OUTPUT_JSON)
+
+    if output == OUTPUT_JSON:
+        sys.stdout.flush()
+        __OUTPUT['descriptor'] = os.dup(1)
+        os.dup2(2, 1)
+
+
+def _output_is_json():
+    # For classes, in which the name `__OUTPUT` would be mangled into a class-private name
+    return bool(__OUTPUT)
+
+
+def _finish_output():
+    if __OUTPUT:
+        sys.stdout.flush()
+        os.dup2(__OUTPUT['descriptor'], 1)
+        os.close(__OUTPUT['descriptor'])
+        __OUTPUT.clear()
+
+
+def _emit_event(event, **fields):
+    if __OUTPUT:
+        fields.update(event=event, time=round(time.time(), 3))
+        # A single write of a whole line, so that events never interleave
+        os.write(__OUTPUT['descriptor'], (json.dumps(fields, sort_keys=True) + '\n').encode('utf8'))
+
+
 def _standard_output(message, *args, **kwargs):
-    _print_output(COLOR_GREEN_BOLD, message + '\n', *args, **kwargs)
+    if __OUTPUT:
+        _emit_event('message', level=LEVEL_INFO, message=message.format(*args, **kwargs))
+    else:
+        _print_output(COLOR_GREEN_BOLD, message + '\n', *args, **kwargs)
 
 
 def _prompt(message, *args, **kwargs):
-    _print_output(COLOR_WHITE, message + ' ', *args, **kwargs)
+    answer_key = kwargs.pop('answer_key', None)
+    if __OUTPUT:
+        _emit_event(
+            'prompt',
+            message=message.format(*args, **kwargs),
+            key=answer_key,
+            answer=__AUTOMATIC_ANSWERS.get(answer_key),
+        )
+    else:
+        _print_output(COLOR_WHITE, message + ' ', *args, **kwargs)
+    if answer_key in __AUTOMATIC_ANSWERS:
+        # The answer was supplied on the command line, so echo it instead of waiting for input
+        if not __OUTPUT:
+            _print_output(COLOR_WHITE, '{}\n' if _output_is_tty else '{}', __AUTOMATIC_ANSWERS[answer_key])
+        return __AUTOMATIC_ANSWERS[answer_key]
     # noinspection PyCompatibility
-    response = moves.input()
+    with _waiting_for_user():
+        response = moves.input()
     if response:
         if not isinstance(response, six.text_type):
             # Input returns a bytestring in Python 2 and a unicode string in Python 3
@@ -145,8 +523,92 @@ def _prompt(message, *args, **kwargs):
     return ''
 
 
+def _start_profile(profile, profile_memory=0):
+    """
+    Starts profiling the task with cProfile (and, if `profile_memory` is set, tracing memory allocations), to be written
+    to the `profile` file when the task finishes.
+    """
+    _finish_profile()
+
+    if not profile:
+        if profile_memory:
+            _error_output_exit('--profile-memory requires --profile.')
+        return
+    if profile_memory and not tracemalloc:
+        _error_output_exit('--profile-memory requires Python 3.4 or newer.')
+
+    # The task may change directories (for example, into a release worktree) before the profile is written
+    __PROFILE.update(filename=os.path.abspath(profile), memory_top=profile_memory, profiler=cProfile.Profile())
+    if profile_memory:
+        tracemalloc.start()
+    __PROFILE['profiler'].enable()
+
+
+def _finish_profile():
+    if not __PROFILE:
+        return
+
+    profile = dict(__PROFILE)
+    __PROFILE.clear()
+    profile['profiler'].disable()
+
+    try:
+        if profile['memory_top']:
+            # Taken before the profile is written, which allocates memory of its own
+            snapshot = tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, cProfile.__file__),
+                tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            ))
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+        profile['profiler'].dump_stats(profile['filename'])
+        _standard_output('Wrote CPU profile to {}.', profile['filename'])
+
+        if profile['memory_top']:
+            filename = '{}.allocations.txt'.format(profile['filename'])
+            with codecs.open(filename, 'wb', encoding='utf8') as allocations_write:
+                allocations_write.write(
+                    'Traced memory: {:.1f} KiB at exit, {:.1f} KiB at peak\n'.format(current / 1024.0, peak / 1024.0),
+                )
+                allocations_write.write('Top {} allocating source lines:\n'.format(profile['memory_top']))
+                for statistic in snapshot.statistics('lineno')[:profile['memory_top']]:
+                    allocations_write.write('{}\n'.format(statistic))
+            _standard_output('Wrote memory allocation report to {}.', filename)
+    except (IOError, OSError) as e:
+        _error_output('Could not write profile to {file}: {error}', file=profile['filename'], error=e)
+
+
+@contextlib.contextmanager
+def _waiting_for_user():
+    """
+    Wraps waiting for the user (at a prompt or in the changelog editor), which is recorded as the "prompt" phase and
+    is left out of the profile.
+    """
+    profiler = __PROFILE.get('profiler')
+    if profiler:
+        profiler.disable()
+    try:
+        with _metrics_timer('phases', 'prompt'):
+            yield
+    finally:
+        if profiler:
+            profiler.enable()
+
+
 def _error_output(message, *args, **kwargs):
-    _print_output(COLOR_RED_BOLD, ''.join(('ERROR: ', message, '\n')), *args, **kwargs)
+    if __OUTPUT:
+        _emit_event('message', level=LEVEL_ERROR, message=message.format(*args, **kwargs))
+    else:
+        _print_output(COLOR_RED_BOLD, ''.join(('ERROR: ', message, '\n')), *args, **kwargs)
+
+
+def _warning_output(message, *args, **kwargs):
+    if __OUTPUT:
+        _emit_event('message', level=LEVEL_WARNING, message=message.format(*args, **kwargs).rstrip())
+    else:
+        _print_output(COLOR_RED_BOLD, message, *args, **kwargs)
 
 
 def _error_output_exit(message, *args, **kwargs):
@@ -155,214 +617,1236 @@ def _error_output_exit(message, *args, **kwargs):
 
 
 def _verbose_output(verbose, message, *args, **kwargs):
-    if verbose:
+    if not verbose:
+        return
+    if __OUTPUT:
+        _emit_event('message', level=LEVEL_DEBUG, message=message.format(*args, **kwargs))
+    else:
         _print_output(COLOR_GRAY_LIGHT, ''.join(('DEBUG: ', message, '\n')), *args, **kwargs)
 
 
-def _case_sensitive_regular_file_exists(filename):
-    if not os.path.isfile(filename):
-        # Short circuit
-        return False
-    directory, filename = os.path.split(filename)
-    return filename in os.listdir(directory)
+def _start_metrics(task_name):
+    __METRICS.clear()
+    __METRICS.update(
+        task=task_name,
+        module=MODULE_NAME,
+        started=time.time(),
+        result=METRICS_RESULT_SUCCESS,
+        phases={},
+        plugins={},
+        subprocesses=0,
+        bytes_pushed=0,
+        mark=(time.time(), 0.0),
+    )
 
 
-def _get_root_directory():
-    root_directory = subprocess.check_output(
-        ['git', 'rev-parse', '--show-toplevel'],
-        stderr=sys.stderr,
-    ).decode('utf8').strip()
+def _set_metrics_result(result):
+    if __METRICS:
+        __METRICS['result'] = result
 
-    if not root_directory:
-        _error_output_exit('Failed to find Git root directory.')
-    return root_directory
 
+def _increment_metric(name, amount=1):
+    if __METRICS:
+        # Commands can run on several threads at once (for example, when pushing to several remotes)
+        with _metrics_lock:
+            __METRICS[name] += amount
 
-def _setup_task(no_stash, verbose):
-    if not no_stash:
-        global __POST_APPLY
-        # stash changes before we execute task
-        _verbose_output(verbose, 'Stashing changes...')
 
-        result = subprocess.check_output(
-            ['git', 'stash'],
-            stderr=sys.stderr,
-        ).decode('utf8')
-        if result.startswith('Saved'):
-            __POST_APPLY = True
+def _add_metric(kind, name, value):
+    if __METRICS:
+        __METRICS[kind][name] = __METRICS[kind].get(name, 0) + value
 
-        _verbose_output(verbose, 'Finished stashing changes.')
 
+@contextlib.contextmanager
+def _metrics_timer(kind, name):
+    start = time.time()
+    try:
+        yield
+    finally:
+        _add_metric(kind, name, time.time() - start)
 
-def _cleanup_task(verbose):
-    if __POST_APPLY:
-        _verbose_output(verbose, 'Un-stashing changes...')
 
-        subprocess.check_output(
-            ['git', 'stash', 'pop'],
-            stderr=sys.stderr,
-        )
+def _end_metrics_phase(name):
+    """
+    Records the time since the end of the previous phase (or the start of the task) as the duration of the named phase.
+    Time spent waiting for the user at prompts during that period is excluded; it is recorded as the "prompt" phase.
+    """
+    if not __METRICS:
+        return
 
-        _verbose_output(verbose, 'Finished un-stashing changes.')
+    now = time.time()
+    prompt_total = __METRICS['phases'].get('prompt', 0.0)
+    mark_time, mark_prompt_total = __METRICS['mark']
+    duration = max(now - mark_time - (prompt_total - mark_prompt_total), 0.0)
+    _add_metric('phases', name, duration)
+    __METRICS['mark'] = (now, prompt_total)
+    _emit_event('phase', phase=name, duration=round(duration, 3))
 
 
-def _write_to_version_file(release_version, version_info, verbose):
-    _verbose_output(verbose, 'Writing version to {}...', VERSION_FILENAME)
+def _get_metrics_filename():
+    filename = os.environ.get(METRICS_FILE_ENVIRONMENT_VARIABLE) or METRICS_FILENAME
+    if filename:
+        return os.path.join(ROOT_DIRECTORY, os.path.expanduser(filename))
+    return None
 
-    if not _case_sensitive_regular_file_exists(VERSION_FILENAME):
-        raise ReleaseFailure(
-            'Failed to find version file: {}. File names are case sensitive!'.format(VERSION_FILENAME),
-        )
 
-    if VERSION_FILE_IS_TXT:
-        with codecs.open(VERSION_FILENAME, 'wb', encoding='utf8') as version_write:
-            version_write.write(release_version)
-    else:
-        with codecs.open(VERSION_FILENAME, 'rb', encoding='utf8') as version_read:
-            output = []
-            version_info_written = False
-            # We replace u' with ' in this, because Py2 projects should use unicode_literals in their version file
-            version_info = VERSION_INFO_VARIABLE_TEMPLATE.format(tuple(version_info)).replace(", u'", ", '")
-            for line in version_read:
-                if line.startswith('__version_info__'):
-                    output.append(version_info)
-                    version_info_written = True
-                elif line.startswith('__version__'):
-                    if not version_info_written:
-                        output.append(version_info)
-                    output.append(VERSION_VARIABLE_TEMPLATE)
-                else:
-                    output.append(line.rstrip())
+def _finish_metrics():
+    if not __METRICS:
+        return
 
-        with codecs.open(VERSION_FILENAME, 'wb', encoding='utf8') as version_write:
-            for line in output:
-                version_write.write(line + '\n')
+    filename = _get_metrics_filename()
+    if filename:
+        record = dict(__METRICS)
+        del record['mark']
+        record['duration'] = time.time() - record['started']
+        try:
+            # A single short write to a file opened for appending is atomic, so concurrent tasks can share the file
+            with codecs.open(filename, 'ab', encoding='utf8') as metrics_write:
+                metrics_write.write(json.dumps(record, sort_keys=True, separators=(',', ':')) + '\n')
+        except (IOError, OSError) as e:
+            _error_output('Could not write release metrics to {file}: {error}', file=filename, error=e)
 
-    _verbose_output(verbose, 'Finished writing to {}.version.', MODULE_NAME)
+    _emit_event('result', task=__METRICS['task'], result=__METRICS['result'])
+    __LAST_TASK_RESULT.clear()
+    __LAST_TASK_RESULT.update(task=__METRICS['task'], result=__METRICS['result'])
+    __METRICS.clear()
 
 
-def _gather_commit_messages(verbose):
-    _verbose_output(verbose, 'Gathering commit messages since last release commit.')
+def _get_last_task_result():
+    """
+    Returns the result (one of the `METRICS_RESULT_*` constants) of the last task that ran to completion in this
+    process, or `None` if no task has completed (for example, because it exited before doing any work).
+    """
+    return __LAST_TASK_RESULT.get('result')
 
-    command = [
-        'git',
-        'log',
-        '-1',
-        '--format=%H',
-        '--grep={}'.format(RELEASE_MESSAGE_TEMPLATE.replace(' {}', '').replace('"', '\\"'))
-    ]
-    _verbose_output(verbose, 'Running command: "{}"', '" "'.join(command))
-    commit_hash = subprocess.check_output(command, stderr=sys.stderr).decode('utf8').strip()
 
-    if not commit_hash:
-        _verbose_output(verbose, 'No previous release commit was found. Not gathering messages.')
-        return []
+@contextlib.contextmanager
+def _running_command(command):
+    """
+    Counts the command in the task metrics and, in JSON output mode, emits an event with its exit code and duration
+    when it finishes. The body may set `state['exit_code']` for commands that do not raise on failure.
+    """
+    _increment_metric('subprocesses')
+    state = {'exit_code': 0}
+    started = time.time()
+    try:
+        yield state
+    except subprocess.CalledProcessError as e:
+        state['exit_code'] = e.returncode
+        raise
+    except OSError:
+        state['exit_code'] = None
+        raise
+    finally:
+        if __OUTPUT:
+            _emit_event(
+                'command',
+                command=list(command),
+                exit_code=state['exit_code'],
+                duration=round(time.time() - started, 3),
+            )
 
-    command = [
-        'git',
-        'log',
-        '--format=%s',
-        '{}..HEAD'.format(commit_hash)
-    ]
-    _verbose_output(verbose, 'Running command: "{}"', '" "'.join(command))
-    output = subprocess.check_output(command, stderr=sys.stderr).decode('utf8')
 
-    messages = []
-    for message in output.splitlines():
-        if not message.strip().startswith('Merge pull request #'):
-            messages.append('- {}'.format(message))
+def _check_output(command, **kwargs):
+    with _running_command(command):
+        return subprocess.check_output(command, **kwargs)
 
-    _verbose_output(
-        verbose,
-        'Returning {number} commit messages gathered since last release commit:\n{messages}',
-        number=len(messages),
-        messages=messages,
-    )
 
-    return messages
+def _check_call(command, **kwargs):
+    with _running_command(command):
+        return subprocess.check_call(command, **kwargs)
 
 
-def _prompt_for_changelog(verbose):
-    built_up_changelog = []
-    changelog_header = []
-    changelog_message = []
-    changelog_footer = []
+def _call(command, **kwargs):
+    with _running_command(command) as state:
+        state['exit_code'] = subprocess.call(command, **kwargs)
+        return state['exit_code']
 
-    _verbose_output(verbose, 'Reading changelog file {} looking for built-up changes...', CHANGELOG_FILENAME)
-    with codecs.open(CHANGELOG_FILENAME, 'rb', encoding='utf8') as changelog_read:
-        previous_line = ''
-        passed_header = passed_changelog = False
-        for line_number, line in enumerate(changelog_read):
-            if not passed_header:
-                changelog_header.append(line)
-                # .txt and .md changelog files start like this:
-                #     Changelog
-                #     =========
-                # .rst changelog files start like this
-                #     =========
-                #     Changelog
-                #     =========
-                if line_number > 0 and RE_CHANGELOG_FILE_HEADER.search(line):
-                    passed_header = True
-                continue
 
-            if not passed_changelog and RE_CHANGELOG_VERSION_HEADER.search(line):
-                changelog_footer.append(previous_line)
-                passed_changelog = True
+def _check_output_with_input(command, data, **kwargs):
+    """
+    Like `_check_output`, but writes `data` (bytes) to the command's standard input.
+    """
+    with _running_command(command):
+        process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, **kwargs)
+        output, _ = process.communicate(data)
+        if process.returncode:
+            raise subprocess.CalledProcessError(process.returncode, command, output=output)
+        return output
 
-            if passed_changelog:
-                changelog_footer.append(line)
-            else:
-                if previous_line.strip():
-                    built_up_changelog.append(previous_line)
 
-                previous_line = line
+def _push(arguments, echo=True):
+    """
+    Runs `git push` with the given arguments, passing its output through to the user (unless `echo` is false, for
+    pushes running side by side) while reading the number of bytes written from its progress output. Progress is only
+    requested when it is not shown, or is shown on a terminal, so that logs do not fill with progress meters (and the
+    bytes written are not measured then).
+    """
+    command = ['git', 'push'] + arguments
+    if not echo or sys.__stderr__.isatty():
+        command.insert(2, '--progress')
+
+    with _running_command(command):
+        if echo:
+            process = subprocess.Popen(command, stdout=sys.stdout, stderr=subprocess.PIPE)
+            stream = process.stderr
+        else:
+            process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            stream = process.stdout
+        error_output = []
+        for chunk in iter(lambda: os.read(stream.fileno(), 4096), b''):
+            error_output.append(chunk)
+            if echo:
+                sys.__stderr__.write(chunk.decode('utf8', 'replace'))
+                sys.__stderr__.flush()
+        stream.close()
+
+        if process.wait():
+            raise subprocess.CalledProcessError(process.returncode, command, output=b''.join(error_output))
+
+    written = RE_PUSH_WRITTEN_BYTES.findall(b''.join(error_output).decode('utf8', 'replace'))
+    if written:
+        amount, unit = written[-1]
+        _increment_metric('bytes_pushed', int(float(amount) * PUSH_WRITTEN_BYTES_UNITS[unit]))
+
+
+def _get_primary_remote():
+    """
+    Returns the first required remote, which is the one queried for remote branches and tags.
+    """
+    return REMOTES[0]
 
-    if len(built_up_changelog) > 0:
-        _verbose_output(verbose, 'Read {} lines of built-up changelog text:', len(built_up_changelog))
-        if verbose:
-            _verbose_output(verbose, six.text_type(built_up_changelog))
-        _standard_output('There are existing changelog details for this release. You can "edit" the changes, '
-                         '"accept" them as-is, delete them and create a "new" changelog message, or "delete" '
-                         'them and enter no changelog.')
-        instruction = _prompt('How would you like to proceed? (EDIT/new/accept/delete/exit):').lower()
 
-        if instruction in (INSTRUCTION_NEW, INSTRUCTION_DELETE):
-            built_up_changelog = []
-        if instruction == INSTRUCTION_ACCEPT:
-            changelog_message = built_up_changelog
-        if not instruction or instruction in (INSTRUCTION_EDIT, INSTRUCTION_NEW):
-            instruction = INSTRUCTION_YES
-    else:
-        _verbose_output(verbose, 'No existing lines of built-up changelog text were read.')
-        instruction = _prompt(
-            'Would you like to enter changelog details for this release? (Y/n/exit):',
-        ).lower() or INSTRUCTION_YES
+def _describe_remotes():
+    names = list(REMOTES) + ['{} (best-effort)'.format(remote) for remote in BEST_EFFORT_REMOTES]
+    return '{} {}'.format('remotes' if len(names) > 1 else 'remote', ', '.join(names))
 
-    if instruction == INSTRUCTION_EXIT:
-        raise ReleaseExit()
 
-    if instruction == INSTRUCTION_YES:
-        gather = _prompt(
-            'Would you like to{also} gather commit messages from recent commits and add them to the '
-            'changelog? ({y_n}/exit):',
-            **({'also': ' also', 'y_n': 'y/N'} if built_up_changelog else {'also': '', 'y_n': 'Y/n'})
-        ).lower() or (INSTRUCTION_NO if built_up_changelog else INSTRUCTION_YES)
+def _get_remotes():
+    """
+    Returns a list of `(remote, required)` for all configured remotes, the required ones first.
+    """
+    return [(remote, True) for remote in REMOTES] + [(remote, False) for remote in BEST_EFFORT_REMOTES]
 
-        commit_messages = []
-        if gather == INSTRUCTION_YES:
-            commit_messages = _gather_commit_messages(verbose)
-        elif gather == INSTRUCTION_EXIT:
-            raise ReleaseExit()
 
-        tf_o = tempfile.NamedTemporaryFile(mode='wb')
-        codec = codecs.lookup('utf8')
-        with codecs.StreamReaderWriter(tf_o, codec.streamreader, codec.streamwriter, 'strict') as tf:
-            _verbose_output(verbose, 'Opened temporary file {} for editing changelog.', tf.name)
-            if commit_messages:
-                tf.write('\n'.join(commit_messages) + '\n')
-            if built_up_changelog:
-                tf.writelines(built_up_changelog)
+def _describe_command_error(error):
+    output = getattr(error, 'output', None)
+    return output.decode('utf8', 'replace').strip() if output else six.text_type(error)
+
+
+def _push_to_remotes(refspecs, verbose, options=None):
+    """
+    Pushes the refspecs to all configured remotes at once, so that pushing takes as long as the slowest remote instead
+    of the sum of all of them, and reports the result for each remote. `refspecs` is either a list of refspecs for
+    every remote or a dict of remotes to their own refspecs, in which case remotes without refspecs are skipped. Raises
+    `ReleaseFailure` if the push to any required remote failed; failed pushes to best-effort remotes are only
+    reported.
+    """
+    options = options or []
+    remotes = _get_remotes()
+    if isinstance(refspecs, dict):
+        remote_refspecs = refspecs
+        remotes = [(remote, required) for remote, required in remotes if remote_refspecs.get(remote)]
+    else:
+        remote_refspecs = dict((remote, refspecs) for remote, _ in remotes)
+
+    if len(remotes) == 1 and remotes[0][1]:
+        # A single push to a required remote can show its progress as it happens, and fails the task if it fails
+        _push(options + [remotes[0][0]] + remote_refspecs[remotes[0][0]])
+        return
+
+    pushes = [
+        (remote, required, BackgroundCall(_push, options + [remote] + remote_refspecs[remote], False))
+        for remote, required in remotes
+    ]
+
+    failed = []
+    for remote, required, push in pushes:
+        try:
+            push.result()
+            _standard_output('Pushed to remote {}.', remote)
+        except (subprocess.CalledProcessError, OSError) as e:
+            if required:
+                failed.append(remote)
+                _error_output('Failed pushing to remote {}:\n{}', remote, _describe_command_error(e))
+            else:
+                _error_output(
+                    'Failed pushing to best-effort remote {} (continuing anyway):\n{}',
+                    remote,
+                    _describe_command_error(e),
+                )
+        else:
+            _verbose_output(verbose, 'Pushed {} to remote {}.', ' '.join(remote_refspecs[remote]), remote)
+
+    if failed:
+        raise ReleaseFailure('Failed pushing to required remote(s) {}.'.format(', '.join(failed)))
+
+
+def _list_regular_files(directory):
+    try:
+        if hasattr(os, 'scandir'):
+            # `DirEntry.is_file` uses the file type returned with the listing, so there is no `stat` per entry
+            entries = os.scandir(directory)
+            if hasattr(entries, '__exit__'):  # Python 3.6+ closes the directory handle as a context manager
+                with entries:
+                    return frozenset(entry.name for entry in entries if entry.is_file())
+            return frozenset(entry.name for entry in entries if entry.is_file())
+        return frozenset(
+            name for name in os.listdir(directory) if os.path.isfile(os.path.join(directory, name))
+        )
+    except OSError:
+        return frozenset()
+
+
+def _get_directory_entries(directory):
+    directory = os.path.abspath(directory)
+    entries = __DIRECTORY_ENTRIES.get(directory)
+    if entries is None:
+        entries = __DIRECTORY_ENTRIES[directory] = _list_regular_files(directory)
+    return entries
+
+
+def _invalidate_directory_entries(filename=None):
+    """
+    Forgets cached directory listings, either for the directory containing `filename` or, if no file name is given,
+    for all directories. Must be called whenever this tool (or Git, on its behalf) writes to the working tree.
+    """
+    if filename:
+        __DIRECTORY_ENTRIES.pop(os.path.dirname(os.path.abspath(filename)), None)
+    else:
+        __DIRECTORY_ENTRIES.clear()
+
+
+def _case_sensitive_regular_file_exists(filename):
+    directory, filename = os.path.split(os.path.abspath(filename))
+    return filename in _get_directory_entries(directory)
+
+
+def _get_cache_directory():
+    return os.path.join(
+        os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'),
+        'invoke-release',
+    )
+
+
+def _which(program):
+    if hasattr(shutil, 'which'):
+        return shutil.which(program)
+    from distutils.spawn import find_executable
+    return find_executable(program)
+
+
+def _write_file_atomically(file_name, contents):
+    # Write to a temporary file and rename it so that concurrent readers never see a partially-written file
+    directory = os.path.dirname(os.path.abspath(file_name))
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    descriptor, temporary_name = tempfile.mkstemp(dir=directory)
+    with codecs.getwriter('utf8')(os.fdopen(descriptor, 'wb')) as file_write:
+        file_write.write(contents)
+    os.chmod(temporary_name, 0o644)  # `mkstemp` creates files readable only by their owner
+    os.rename(temporary_name, file_name)
+
+
+def _read_cache_file(file_name):
+    try:
+        with codecs.open(file_name, 'rb', encoding='utf8') as cache_read:
+            return json.load(cache_read)
+    except (IOError, OSError, ValueError):
+        return None  # A missing or corrupt cache is simply rebuilt
+
+
+def _write_cache_file(file_name, contents):
+    try:
+        _write_file_atomically(file_name, json.dumps(contents))
+    except (IOError, OSError):
+        pass  # The cache is only an optimization
+
+
+def _probe_environment(verbose):
+    """
+    Locates the tools the release needs without spawning any processes. Tool paths are cached for
+    `ENVIRONMENT_CACHE_TTL` seconds in the user cache directory, keyed by `$PATH`, and re-probed early if a cached
+    executable disappears or no GPG was found. The TTY is always resolved fresh, because it differs between terminals.
+    """
+    cache_file = os.path.join(_get_cache_directory(), 'environment.json')
+    search_path = os.environ.get('PATH', '')
+
+    environment = None
+    try:
+        with open(cache_file, 'r') as cache_read:
+            environment = json.load(cache_read)
+        if (
+            environment.get('path') != search_path or
+            environment.get('expires', 0) < time.time() or
+            # GPG not having been found is never trusted, so that installing it takes effect immediately
+            not environment.get('gpg') or
+            not os.access(environment['gpg'], os.X_OK)
+        ):
+            environment = None
+    except (IOError, OSError, ValueError, AttributeError):
+        environment = None
+
+    if environment:
+        _verbose_output(verbose, 'Using cached environment probe from {}.', cache_file)
+    else:
+        environment = {
+            'path': search_path,
+            'expires': time.time() + ENVIRONMENT_CACHE_TTL,
+            'gpg': _which('gpg') or _which('gpg2'),
+        }
+        _write_cache_file(cache_file, environment)
+
+    try:
+        environment['tty'] = os.ttyname(sys.stdin.fileno())
+    except (AttributeError, OSError, ValueError):
+        environment['tty'] = ''
+
+    _verbose_output(
+        verbose,
+        'Found location of `gpg` to be {gpg} and location of `tty` to be {tty}.',
+        gpg=environment['gpg'],
+        tty=environment['tty'],
+    )
+
+    return environment
+
+
+def _get_root_directory():
+    root_directory = _check_output(
+        ['git', 'rev-parse', '--show-toplevel'],
+        stderr=sys.stderr,
+    ).decode('utf8').strip()
+
+    if not root_directory:
+        _error_output_exit('Failed to find Git root directory.')
+    return root_directory
+
+
+def _get_release_files_relative():
+    return [
+        os.path.relpath(file_name, ROOT_DIRECTORY)
+        for file_name in [VERSION_FILENAME, CHANGELOG_FILENAME] + _get_extra_files_to_commit()
+    ]
+
+
+def _create_release_worktree(sparse, verbose):
+    global ROOT_DIRECTORY, VERSION_FILENAME, CHANGELOG_FILENAME
+
+    release_files = _get_release_files_relative()
+    if _call(['git', 'diff', '--quiet', 'HEAD', '--'] + release_files, cwd=ROOT_DIRECTORY):
+        _error_output_exit(
+            'Cannot release from a worktree while the files modified by the release have uncommitted changes: {}',
+            ', '.join(release_files),
+        )
+
+    branch_name = _get_branch_name(verbose)
+    directory = tempfile.mkdtemp(prefix='invoke-release-')
+    _verbose_output(verbose, 'Creating {sparse}release worktree at {directory}...', sparse='sparse ' if sparse else '',
+                    directory=directory)
+
+    # Using --force permits checking out the current branch, which is already checked out in the main worktree, so that
+    # the release commit advances that branch.
+    command = ['git', 'worktree', 'add', '--force']
+    if sparse:
+        command.append('--no-checkout')
+    if branch_name == 'HEAD':
+        command.extend(['--detach', directory, 'HEAD'])
+    else:
+        command.extend([directory, branch_name])
+    _check_output(command, stderr=sys.stderr, cwd=ROOT_DIRECTORY)
+
+    if sparse:
+        # Write the sparse patterns to this worktree's private Git directory and enable them only for this `read-tree`
+        # so that no repository configuration is changed. The resulting skip-worktree bits persist in the index.
+        git_directory = _check_output(
+            ['git', 'rev-parse', '--absolute-git-dir'],
+            stderr=sys.stderr,
+            cwd=directory,
+        ).decode('utf8').strip()
+        if not os.path.isdir(os.path.join(git_directory, 'info')):
+            os.makedirs(os.path.join(git_directory, 'info'))
+        with codecs.open(os.path.join(git_directory, 'info', 'sparse-checkout'), 'wb', encoding='utf8') as patterns:
+            for file_name in release_files:
+                patterns.write('/{}\n'.format(file_name.replace(os.sep, '/')))
+        _check_output(
+            ['git', '-c', 'core.sparseCheckout=true', 'read-tree', '-mu', 'HEAD'],
+            stderr=sys.stderr,
+            cwd=directory,
+        )
+
+    __RELEASE_WORKTREE.update(
+        directory=directory,
+        original_directory=os.getcwd(),
+        original_paths=(ROOT_DIRECTORY, VERSION_FILENAME, CHANGELOG_FILENAME),
+        base_commit=_get_last_commit_hash(verbose),
+        release_files=release_files,
+    )
+
+    VERSION_FILENAME = os.path.join(directory, os.path.relpath(VERSION_FILENAME, ROOT_DIRECTORY))
+    CHANGELOG_FILENAME = os.path.join(directory, os.path.relpath(CHANGELOG_FILENAME, ROOT_DIRECTORY))
+    ROOT_DIRECTORY = directory
+    os.chdir(directory)
+
+    _verbose_output(verbose, 'Finished creating release worktree.')
+
+
+def _remove_release_worktree(verbose):
+    global ROOT_DIRECTORY, VERSION_FILENAME, CHANGELOG_FILENAME
+
+    _verbose_output(verbose, 'Removing release worktree {}...', __RELEASE_WORKTREE['directory'])
+
+    os.chdir(__RELEASE_WORKTREE['original_directory'])
+    ROOT_DIRECTORY, VERSION_FILENAME, CHANGELOG_FILENAME = __RELEASE_WORKTREE['original_paths']
+
+    _check_output(
+        ['git', 'worktree', 'remove', '--force', __RELEASE_WORKTREE['directory']],
+        stderr=sys.stderr,
+        cwd=ROOT_DIRECTORY,
+    )
+    if os.path.isdir(__RELEASE_WORKTREE['directory']):
+        shutil.rmtree(__RELEASE_WORKTREE['directory'])
+
+    if _get_last_commit_hash(verbose) != __RELEASE_WORKTREE['base_commit']:
+        # The release commit advanced the branch checked out here, so bring just the released files up to date. They
+        # were verified to be unmodified before the worktree was created, so this cannot lose any changes.
+        _verbose_output(verbose, 'Updating released files in the main worktree...')
+        release_files = __RELEASE_WORKTREE['release_files']
+        _check_output(['git', 'reset', '-q', 'HEAD', '--'] + release_files, stderr=sys.stderr, cwd=ROOT_DIRECTORY)
+        _check_output(['git', 'checkout', '--'] + release_files, stderr=sys.stderr, cwd=ROOT_DIRECTORY)
+
+    __RELEASE_WORKTREE.clear()
+    _invalidate_directory_entries()
+
+    _verbose_output(verbose, 'Finished removing release worktree.')
+
+
+def _start_prefetch(name, function, *args):
+    __PREFETCHES[name] = BackgroundCall(function, *args)
+
+
+def _get_prefetched(name, function, *args):
+    """
+    Returns the result of the prefetch started with `name`, or, if there is no such prefetch or its command failed,
+    calls the function.
+    """
+    prefetch = __PREFETCHES.get(name)
+    if prefetch:
+        try:
+            return prefetch.result()
+        except (subprocess.CalledProcessError, OSError):
+            pass  # Run it again here, where its errors (and any prompts) reach the user
+    return function(*args)
+
+
+def _finish_prefetches():
+    # Wait for the reads still running in the background, so that none of them overlaps the cleanup or a later task
+    for prefetch in __PREFETCHES.values():
+        prefetch.wait()
+    __PREFETCHES.clear()
+
+
+def _find_git_directories():
+    """
+    Finds the Git directory of the working tree containing the current directory, and the common directory that holds
+    the shared refs (which is different in a linked worktree, whose Git directory has a `commondir` file), by reading
+    the files Git itself reads. Returns a tuple of the two directories, or `None` if refs cannot be read in process
+    here: Git is configured with environment variables, the repository uses the reftable ref format, or the layout is
+    not a regular working tree.
+    """
+    if any(os.environ.get(name) for name in GIT_DIRECTORY_ENVIRONMENT_VARIABLES):
+        return None
+
+    current_directory = os.getcwd()
+    if current_directory in __GIT_DIRECTORIES:
+        return __GIT_DIRECTORIES[current_directory]
+
+    git_directory = None
+    directory = current_directory
+    while True:
+        dot_git = os.path.join(directory, '.git')
+        if os.path.isdir(dot_git):
+            git_directory = dot_git
+            break
+        if os.path.isfile(dot_git):
+            # A linked worktree (or submodule) names its Git directory in a `.git` file
+            content = _read_ref_file(dot_git)
+            if content and content.startswith('gitdir: '):
+                git_directory = os.path.join(directory, content[len('gitdir: '):])
+            break
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            break
+        directory = parent
+
+    directories = None
+    if git_directory and os.path.isfile(os.path.join(git_directory, 'HEAD')):
+        common_directory = _read_ref_file(os.path.join(git_directory, 'commondir'))
+        common_directory = os.path.normpath(os.path.join(git_directory, common_directory or '.'))
+        if not os.path.exists(os.path.join(common_directory, 'reftable')):
+            directories = (os.path.normpath(git_directory), common_directory)
+
+    __GIT_DIRECTORIES[current_directory] = directories
+    return directories
+
+
+def _read_ref_file(file_name):
+    """
+    Returns the stripped content of a small Git file (such as a loose ref), or `None` if it does not exist.
+    """
+    try:
+        with codecs.open(file_name, 'rb', encoding='utf8') as ref_read:
+            return ref_read.read().strip()
+    except (IOError, OSError):
+        return None
+
+
+def _get_packed_refs(common_directory):
+    """
+    Returns a dict of the refs in `packed-refs` and their object names. The parsed file is cached until Git rewrites
+    it (which it always does by renaming a new file into place).
+    """
+    file_name = os.path.join(common_directory, 'packed-refs')
+    try:
+        stat = os.stat(file_name)
+    except OSError:
+        return {}
+
+    key = (stat.st_ino, stat.st_size, stat.st_mtime)
+    cached = __PACKED_REFS.get(file_name)
+    if cached and cached[0] == key:
+        return cached[1]
+
+    refs = {}
+    with codecs.open(file_name, 'rb', encoding='utf8') as packed_refs_read:
+        for line in packed_refs_read:
+            line = line.rstrip('\r\n')
+            # Skip blank lines, the header, and the peeled objects of annotated tags (lines starting with "^")
+            if line and line[0] not in '#^':
+                object_name, _, ref_name = line.partition(' ')
+                if ref_name:
+                    refs[ref_name] = object_name
+    __PACKED_REFS[file_name] = (key, refs)
+    return refs
+
+
+def _read_ref(ref_name, directories):
+    """
+    Reads a ref, as a loose ref file or from `packed-refs`, without following symbolic refs. Returns the object name,
+    `'ref: <target>'` for a symbolic ref, or `None` if the ref does not exist.
+    """
+    git_directory, common_directory = directories
+    if ref_name == 'HEAD' or ref_name.startswith(PER_WORKTREE_REF_PREFIXES):
+        return _read_ref_file(os.path.join(git_directory, ref_name))
+
+    content = None
+    if os.path.isfile(os.path.join(common_directory, ref_name)):
+        content = _read_ref_file(os.path.join(common_directory, ref_name))
+    return content or _get_packed_refs(common_directory).get(ref_name)
+
+
+def _resolve_head():
+    """
+    Reads `HEAD` in process, following symbolic refs, for the fast answers to "what is the current branch" and "what
+    is the last commit." Returns a tuple of the full name of the checked-out ref (`'HEAD'` if detached) and its commit
+    (`None` on a branch with no commits yet), or `None` if the answer must come from Git instead.
+    """
+    directories = _find_git_directories()
+    if not directories:
+        return None
+
+    ref_name = 'HEAD'
+    for _ in range(SYMBOLIC_REF_MAX_DEPTH):
+        content = _read_ref(ref_name, directories)
+        if not content:
+            return (ref_name, None) if ref_name != 'HEAD' else None
+        if not content.startswith(SYMBOLIC_REF_PREFIX):
+            return (ref_name, content) if RE_OBJECT_NAME.match(content) else None
+        ref_name = content[len(SYMBOLIC_REF_PREFIX):].strip()
+    return None
+
+
+def _get_git_common_directory():
+    directories = _find_git_directories()
+    if directories:
+        return directories[1]
+
+    common_directory = _check_output(
+        ['git', 'rev-parse', '--git-common-dir'],
+        stderr=sys.stderr,
+    ).decode('utf8').strip()
+    return os.path.normpath(os.path.join(os.getcwd(), common_directory))
+
+
+def _get_repository_maintenance_status():
+    """
+    Inspects the repository files (without running Git) to find out whether history queries can use a commit-graph
+    file, and how many refs are stored as loose files instead of in `packed-refs`. The commit-graph is stale when
+    objects were added (as loose objects or packs) after it was last written, which means recent commits are not in it.
+
+    :return: A tuple of the commit-graph status (one of the `COMMIT_GRAPH_*` constants) and the number of loose refs.
+    """
+    common_directory = _get_git_common_directory()
+    objects_directory = os.path.join(common_directory, 'objects')
+
+    graph_modified = None
+    for graph_file in (
+        os.path.join(objects_directory, 'info', 'commit-graphs', 'commit-graph-chain'),
+        os.path.join(objects_directory, 'info', 'commit-graph'),
+    ):
+        try:
+            graph_modified = max(graph_modified or 0, os.stat(graph_file).st_mtime)
+        except OSError:
+            pass
+
+    if graph_modified is None:
+        status = COMMIT_GRAPH_MISSING
+    else:
+        status = COMMIT_GRAPH_CURRENT
+        try:
+            entries = os.listdir(objects_directory)
+        except OSError:
+            entries = []
+        for entry in entries:
+            # Loose objects are in the two-hex-digit fan-out directories, which change when objects are added
+            if len(entry) == 2 or entry == 'pack':
+                try:
+                    if os.stat(os.path.join(objects_directory, entry)).st_mtime > graph_modified:
+                        status = COMMIT_GRAPH_STALE
+                        break
+                except OSError:
+                    pass
+
+    loose_refs = 0
+    for _, _, file_names in os.walk(os.path.join(common_directory, 'refs')):
+        loose_refs += len(file_names)
+
+    return status, loose_refs
+
+
+def _maintain_repository(verbose):
+    """
+    Incrementally updates the commit-graph file and packs loose refs, so that the history queries in later tasks stay
+    fast as the repository grows. Failures (for example, with a Git version that does not support split commit-graphs)
+    are reported but never fail the task.
+    """
+    status, loose_refs = _get_repository_maintenance_status()
+    _verbose_output(verbose, 'Commit-graph is {}, and there are {} loose refs.', status, loose_refs)
+
+    commands = []
+    if status != COMMIT_GRAPH_CURRENT:
+        commands.append(
+            ['git', 'commit-graph', 'write', '--reachable', '--split'] +
+            # Changed-path Bloom filters speed up the module-scoped history queries
+            (['--changed-paths'] if HISTORY_PATHS is not None else [])
+        )
+    if loose_refs:
+        commands.append(['git', 'pack-refs', '--all'])
+
+    for command in commands:
+        _verbose_output(verbose, 'Running command: "{}"', LazyText('" "'.join, command))
+        try:
+            _check_output(command, stderr=subprocess.STDOUT)
+        except subprocess.CalledProcessError as e:
+            _error_output(
+                'Repository maintenance command `{command}` failed with error code {code}:\n{output}',
+                command=' '.join(command),
+                code=e.returncode,
+                output=e.output.decode('utf8'),
+            )
+        except OSError as e:
+            _error_output('Repository maintenance command `{}` failed: {}', ' '.join(command), e.strerror)
+
+
+def _describe_release_lock_holder(ticket_name):
+    try:
+        with codecs.open(ticket_name, 'rb', encoding='utf8') as ticket_read:
+            holder = json.loads(ticket_read.read())
+        return '`{task}` by process {pid} on {host}, started {started}'.format(
+            task=holder['task'],
+            pid=holder['pid'],
+            host=holder['host'],
+            started=datetime.datetime.fromtimestamp(holder['started']).strftime('%H:%M:%S'),
+        )
+    except (IOError, OSError, ValueError, KeyError):
+        return 'unknown'
+
+
+def _acquire_release_lock(verbose):
+    """
+    Waits until no other task is working on this repository (in any of its worktrees), serving waiting tasks in the
+    order in which they arrived. Each task takes a numbered ticket file and holds an exclusive `flock` on it until
+    `_release_release_lock`, and waits on the `flock` of the ticket just ahead of its own. Tickets of crashed processes
+    are unlocked by the operating system and so are simply skipped.
+    """
+    if not fcntl:
+        return
+
+    directory = os.path.join(_get_git_common_directory(), 'invoke-release', 'locks')
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            pass  # Created concurrently by another task
+
+    with open(os.path.join(directory, 'counter'), 'a+') as counter:
+        fcntl.flock(counter, fcntl.LOCK_EX)
+        counter.seek(0)
+        ticket = int(counter.read().strip() or 0) + 1
+        counter.seek(0)
+        counter.truncate()
+        counter.write(str(ticket))
+        counter.flush()
+
+        # The ticket is locked before it is renamed into place, so that a visible, unlocked ticket always means a dead
+        # task. This happens before the counter is unlocked, so that every ticket with a lower number is already
+        # visible to the task that takes the next one.
+        ticket_name = os.path.join(directory, 'ticket-{:012d}'.format(ticket))
+        ticket_file = open(ticket_name + '.new', 'w')
+        fcntl.flock(ticket_file, fcntl.LOCK_EX)
+        json.dump(
+            {
+                'pid': os.getpid(),
+                'host': os.uname()[1],
+                'task': __METRICS.get('task', 'unknown'),
+                'started': time.time(),
+            },
+            ticket_file,
+        )
+        ticket_file.flush()
+        os.rename(ticket_name + '.new', ticket_name)
+        __RELEASE_LOCK.update(file=ticket_file, name=ticket_name)
+        fcntl.flock(counter, fcntl.LOCK_UN)
+
+    _verbose_output(verbose, 'Took release lock ticket {}.', ticket_name)
+
+    while True:
+        ahead = sorted(
+            name for name in os.listdir(directory)
+            if name.startswith('ticket-') and not name.endswith('.new') and os.path.join(directory, name) < ticket_name
+        )
+        if not ahead:
+            break
+
+        previous_ticket = os.path.join(directory, ahead[-1])
+        _standard_output(
+            'Waiting for {count} earlier task(s) working on this repository; the current one is {holder}...',
+            count=len(ahead),
+            holder=_describe_release_lock_holder(os.path.join(directory, ahead[0])),
+        )
+        try:
+            with open(previous_ticket, 'r') as previous:
+                fcntl.flock(previous, fcntl.LOCK_EX)
+                # Either that task finished (and already removed its ticket) or it died, so remove its ticket for it
+                try:
+                    os.unlink(previous_ticket)
+                except OSError:
+                    pass
+        except (IOError, OSError):
+            pass  # The ticket was removed before it could be opened
+
+    _verbose_output(verbose, 'Acquired release lock.')
+
+
+def _release_release_lock():
+    if __RELEASE_LOCK:
+        # Remove the ticket before unlocking it, so that the next task never sees a finished task's ticket as its own
+        os.unlink(__RELEASE_LOCK['name'])
+        __RELEASE_LOCK['file'].close()
+        __RELEASE_LOCK.clear()
+
+
+def _get_release_journal_filename():
+    return os.path.join(_get_git_common_directory(), 'invoke-release', 'journal-{}.json'.format(MODULE_NAME))
+
+
+def _read_release_journal():
+    """
+    Returns the journal of this project's interrupted release, or `None` if there is none.
+    """
+    try:
+        with codecs.open(_get_release_journal_filename(), 'rb', encoding='utf8') as journal_read:
+            return json.load(journal_read)
+    except (IOError, OSError):
+        return None
+    except ValueError:
+        raise ReleaseFailure('The release journal {} is corrupt. Delete it to start over.'.format(
+            _get_release_journal_filename(),
+        ))
+
+
+def _record_release_phase(journal, phase, verbose, **outputs):
+    """
+    Records a completed release phase and its outputs in the journal, so that `release --resume` can continue from the
+    next phase if the release is interrupted, along with the branch and commit that the phase left checked out.
+    """
+    journal['phases'].append(phase)
+    journal.update(outputs, branch=_get_branch_name(verbose), head=_get_last_commit_hash(verbose))
+    _write_file_atomically(_get_release_journal_filename(), json.dumps(journal, indent=2, sort_keys=True))
+    _verbose_output(verbose, 'Recorded release phase "{}" in the release journal.', phase)
+
+
+def _delete_release_journal(verbose):
+    try:
+        os.unlink(_get_release_journal_filename())
+        _verbose_output(verbose, 'Deleted the release journal.')
+    except OSError:
+        pass  # There is no journal
+
+
+def _get_local_tag_object(tag_name):
+    """
+    Returns the object name the local tag points to, or `None` if there is no such tag.
+    """
+    directories = _find_git_directories()
+    if directories:
+        return _read_ref('refs/tags/{}'.format(tag_name), directories)
+    try:
+        return _check_output(
+            ['git', 'rev-parse', '--verify', '--quiet', 'refs/tags/{}'.format(tag_name)],
+        ).decode('utf8').strip() or None
+    except subprocess.CalledProcessError:
+        return None
+
+
+def _verify_release_journal(journal, verbose):
+    """
+    Makes sure that the repository is still in the state the interrupted release left it in, so that resuming it
+    cannot release anything other than what the journal describes.
+    """
+    _verbose_output(verbose, 'Verifying the release journal against the repository...')
+
+    phases = journal['phases']
+    resume_command = 'Roll back the release or run `invoke release` without --resume to start over.'
+
+    branch_name = _get_branch_name(verbose)
+    if branch_name != journal['branch']:
+        raise ReleaseFailure(
+            'Cannot resume the release, which was interrupted on branch "{expected}", from branch "{actual}". '
+            'Check out "{expected}" and try again.'.format(expected=journal['branch'], actual=branch_name),
+        )
+
+    if _get_last_commit_hash(verbose) != journal['head']:
+        raise ReleaseFailure(
+            'Cannot resume the release because branch "{branch}" no longer points to {commit}, where the release was '
+            'interrupted. {command}'.format(branch=branch_name, commit=journal['head'], command=resume_command),
+        )
+
+    tag = _get_local_tag_object(journal['release_version'])
+    if 'tag' in phases and tag != journal['tag']:
+        raise ReleaseFailure(
+            'Cannot resume the release because tag {tag} has changed since the release was interrupted. '
+            '{command}'.format(tag=journal['release_version'], command=resume_command),
+        )
+    if 'tag' not in phases and tag:
+        raise ReleaseFailure(
+            'Cannot resume the release because tag {tag} was created after the release was interrupted. '
+            '{command}'.format(tag=journal['release_version'], command=resume_command),
+        )
+
+    _verbose_output(verbose, 'The release journal matches the repository.')
+
+
+def _setup_task(no_stash, verbose, worktree=False, sparse_worktree=False, partial_stash=False):
+    _end_metrics_phase('start')
+    _invalidate_directory_entries()
+
+    _acquire_release_lock(verbose)
+    _end_metrics_phase('lock')
+    try:
+        _setup_working_tree(no_stash, verbose, worktree, sparse_worktree, partial_stash)
+    except BaseException:
+        _release_release_lock()
+        raise
+
+    _end_metrics_phase('setup')
+
+
+def _get_changed_tracked_files(verbose):
+    """
+    Returns a dict of the tracked files with uncommitted changes (relative to the root directory, with "/" separators)
+    to their two-letter staged/unstaged status ("." for unchanged and "U" for both letters when unmerged), using
+    `git status --porcelain=v2`. Untracked files are not inspected, because `git stash` does not stash them; Git uses
+    the file system monitor, when one is configured, to avoid examining every file.
+    """
+    output = _check_output(
+        ['git', 'status', '--porcelain=v2', '-z', '--untracked-files=no'],
+        stderr=sys.stderr,
+        cwd=ROOT_DIRECTORY,
+    ).decode('utf8')
+
+    changed = {}
+    records = iter(output.split('\0'))
+    for record in records:
+        if record.startswith('1 '):
+            fields = record.split(' ', 8)
+            changed[fields[8]] = fields[1]
+        elif record.startswith('2 '):
+            fields = record.split(' ', 9)
+            changed[fields[9]] = fields[1]
+            changed[next(records)] = fields[1]  # The original path of a rename or copy
+        elif record.startswith('u '):
+            changed[record.split(' ', 10)[10]] = 'UU'
+
+    _verbose_output(verbose, 'Tracked files with uncommitted changes: {}', changed)
+    return changed
+
+
+def _setup_working_tree(no_stash, verbose, worktree, sparse_worktree, partial_stash=False):
+    if worktree or sparse_worktree:
+        # The working tree is left alone entirely, so there is nothing to stash
+        _create_release_worktree(sparse_worktree, verbose)
+    elif not no_stash:
+        global __POST_APPLY
+
+        changed = _get_changed_tracked_files(verbose)
+        if not changed:
+            _verbose_output(verbose, 'There are no uncommitted changes to stash.')
+            return
+
+        command = ['git', 'stash']
+        # Other changed files can safely stay in the working tree only when nothing is staged (which the release commit
+        # would include) and nothing is unmerged. Then, only changes to the files that the release modifies are stashed.
+        if partial_stash and all(status[0] == '.' for status in changed.values()):
+            release_files = set(file_name.replace(os.sep, '/') for file_name in _get_release_files_relative())
+            changed_release_files = sorted(file_name for file_name in changed if file_name in release_files)
+            if not changed_release_files:
+                _verbose_output(verbose, 'None of the files modified by the release have changes to stash.')
+                return
+            command = ['git', 'stash', 'push', '--'] + changed_release_files
+
+        # stash changes before we execute task
+        _verbose_output(verbose, 'Stashing changes...')
+
+        result = _check_output(
+            command,
+            stderr=sys.stderr,
+            cwd=ROOT_DIRECTORY,
+        ).decode('utf8')
+        if result.startswith('Saved'):
+            __POST_APPLY = True
+
+        _verbose_output(verbose, 'Finished stashing changes.')
+
+
+def _cleanup_task(verbose):
+    global __POST_APPLY
+
+    _finish_prefetches()
+    __AUTOMATIC_ANSWERS.clear()
+    _end_metrics_phase('interrupted' if __METRICS.get('result') != METRICS_RESULT_SUCCESS else 'finish')
+
+    try:
+        if __RELEASE_WORKTREE:
+            _remove_release_worktree(verbose)
+
+        if __POST_APPLY:
+            _verbose_output(verbose, 'Un-stashing changes...')
+
+            _check_output(
+                ['git', 'stash', 'pop'],
+                stderr=sys.stderr,
+                cwd=ROOT_DIRECTORY,
+            )
+            _invalidate_directory_entries()
+            # Reset, in case another task runs in this same process (as in the release daemon)
+            __POST_APPLY = False
+
+            _verbose_output(verbose, 'Finished un-stashing changes.')
+    finally:
+        _release_release_lock()
+
+    _end_metrics_phase('cleanup')
+
+
+def _write_to_version_file(release_version, version_info, verbose):
+    _verbose_output(verbose, 'Writing version to {}...', VERSION_FILENAME)
+
+    if not _case_sensitive_regular_file_exists(VERSION_FILENAME):
+        raise ReleaseFailure(
+            'Failed to find version file: {}. File names are case sensitive!'.format(VERSION_FILENAME),
+        )
+
+    if VERSION_FILE_IS_TXT:
+        with codecs.open(VERSION_FILENAME, 'wb', encoding='utf8') as version_write:
+            version_write.write(release_version)
+    else:
+        with codecs.open(VERSION_FILENAME, 'rb', encoding='utf8') as version_read:
+            output = []
+            version_info_written = False
+            # We replace u' with ' in this, because Py2 projects should use unicode_literals in their version file
+            version_info = VERSION_INFO_VARIABLE_TEMPLATE.format(tuple(version_info)).replace(", u'", ", '")
+            for line in version_read:
+                if line.startswith('__version_info__'):
+                    output.append(version_info)
+                    version_info_written = True
+                elif line.startswith('__version__'):
+                    if not version_info_written:
+                        output.append(version_info)
+                    output.append(VERSION_VARIABLE_TEMPLATE)
+                else:
+                    output.append(line.rstrip())
+
+        with codecs.open(VERSION_FILENAME, 'wb', encoding='utf8') as version_write:
+            for line in output:
+                version_write.write(line + '\n')
+
+    _invalidate_directory_entries(VERSION_FILENAME)
+
+    _verbose_output(verbose, 'Finished writing to {}.version.', MODULE_NAME)
+
+
+def _get_history_pathspec():
+    """
+    Returns the Git pathspec arguments that limit history queries to this module's paths, or an empty list if history
+    is not scoped. With a pathspec, Git can skip the commits that did not touch those paths using the changed-path
+    Bloom filters in the commit-graph, when it has them, instead of comparing the trees of every commit.
+    """
+    if HISTORY_PATHS is None:
+        return []
+    return ['--'] + [':(top){}'.format(path) for path in HISTORY_PATHS]
+
+
+def _gather_commit_messages(verbose):
+    _verbose_output(verbose, 'Gathering commit messages since last release commit.')
+
+    command = [
+        'git',
+        'log',
+        '-1',
+        '--format=%H',
+        '--grep={}'.format(RELEASE_MESSAGE_TEMPLATE.replace(' {}', '').replace('"', '\\"'))
+    ] + _get_history_pathspec()
+    _verbose_output(verbose, 'Running command: "{}"', LazyText('" "'.join, command))
+    commit_hash = _check_output(command, stderr=sys.stderr).decode('utf8').strip()
+
+    if not commit_hash:
+        _verbose_output(verbose, 'No previous release commit was found. Not gathering messages.')
+        return []
+
+    command = [
+        'git',
+        'log',
+        '--format=%s',
+        '{}..HEAD'.format(commit_hash)
+    ] + _get_history_pathspec()
+    _verbose_output(verbose, 'Running command: "{}"', LazyText('" "'.join, command))
+    output = _check_output(command, stderr=sys.stderr).decode('utf8')
+
+    messages = []
+    for message in output.splitlines():
+        if not message.strip().startswith('Merge pull request #'):
+            messages.append('- {}'.format(message))
+
+    _verbose_output(
+        verbose,
+        'Returning {number} commit messages gathered since last release commit:\n{messages}',
+        number=len(messages),
+        messages=messages,
+    )
+
+    return messages
+
+
+def _prompt_for_changelog(verbose):
+    built_up_changelog = []
+    changelog_header = []
+    changelog_message = []
+    changelog_footer = []
+
+    _verbose_output(verbose, 'Reading changelog file {} looking for built-up changes...', CHANGELOG_FILENAME)
+    with codecs.open(CHANGELOG_FILENAME, 'rb', encoding='utf8') as changelog_read:
+        previous_line = ''
+        passed_header = passed_changelog = False
+        for line_number, line in enumerate(changelog_read):
+            if not passed_header:
+                changelog_header.append(line)
+                # .txt and .md changelog files start like this:
+                #     Changelog
+                #     =========
+                # .rst changelog files start like this
+                #     =========
+                #     Changelog
+                #     =========
+                if line_number > 0 and RE_CHANGELOG_FILE_HEADER.search(line):
+                    passed_header = True
+                continue
+
+            if not passed_changelog and RE_CHANGELOG_VERSION_HEADER.search(line):
+                changelog_footer.append(previous_line)
+                passed_changelog = True
+
+            if passed_changelog:
+                changelog_footer.append(line)
+            else:
+                if previous_line.strip():
+                    built_up_changelog.append(previous_line)
+
+                previous_line = line
+
+    if 'changelog_message' in __AUTOMATIC_ANSWERS:
+        changelog_message = [
+            line + '\n' for line in __AUTOMATIC_ANSWERS['changelog_message'].splitlines() if line.strip()
+        ] + built_up_changelog
+        _verbose_output(verbose, 'Using changelog message from the command line:\n{}', changelog_message)
+        return changelog_header, changelog_message, changelog_footer
+
+    if len(built_up_changelog) > 0:
+        _verbose_output(verbose, 'Read {} lines of built-up changelog text:', len(built_up_changelog))
+        if verbose:
+            _verbose_output(verbose, '{}', LazyText(six.text_type, built_up_changelog))
+        _standard_output('There are existing changelog details for this release. You can "edit" the changes, '
+                         '"accept" them as-is, delete them and create a "new" changelog message, or "delete" '
+                         'them and enter no changelog.')
+        instruction = _prompt(
+            'How would you like to proceed? (EDIT/new/accept/delete/exit):',
+            answer_key='changelog_existing',
+        ).lower()
+
+        if instruction in (INSTRUCTION_NEW, INSTRUCTION_DELETE):
+            built_up_changelog = []
+        if instruction == INSTRUCTION_ACCEPT:
+            changelog_message = built_up_changelog
+        if not instruction or instruction in (INSTRUCTION_EDIT, INSTRUCTION_NEW):
+            instruction = INSTRUCTION_YES
+    else:
+        _verbose_output(verbose, 'No existing lines of built-up changelog text were read.')
+        instruction = _prompt(
+            'Would you like to enter changelog details for this release? (Y/n/exit):',
+            answer_key='changelog_enter',
+        ).lower() or INSTRUCTION_YES
+
+    if instruction == INSTRUCTION_EXIT:
+        raise ReleaseExit()
+
+    if instruction == INSTRUCTION_YES:
+        gather = _prompt(
+            'Would you like to{also} gather commit messages from recent commits and add them to the '
+            'changelog? ({y_n}/exit):',
+            answer_key='changelog_gather',
+            **({'also': ' also', 'y_n': 'y/N'} if built_up_changelog else {'also': '', 'y_n': 'Y/n'})
+        ).lower() or (INSTRUCTION_NO if built_up_changelog else INSTRUCTION_YES)
+
+        commit_messages = []
+        if gather == INSTRUCTION_YES:
+            commit_messages = _get_prefetched('commit_messages', _gather_commit_messages, verbose)
+        elif gather == INSTRUCTION_EXIT:
+            raise ReleaseExit()
+
+        if 'changelog_gather' in __AUTOMATIC_ANSWERS:
+            # Non-interactive release: there is nobody to edit the changelog, so use it as gathered
+            changelog_message = [m + '\n' for m in commit_messages] + built_up_changelog
+            _verbose_output(verbose, 'Using changelog message without editing:\n{}', changelog_message)
+            return changelog_header, changelog_message, changelog_footer
+
+        tf_o = tempfile.NamedTemporaryFile(mode='wb')
+        codec = codecs.lookup('utf8')
+        with codecs.StreamReaderWriter(tf_o, codec.streamreader, codec.streamwriter, 'strict') as tf:
+            _verbose_output(verbose, 'Opened temporary file {} for editing changelog.', tf.name)
+            if commit_messages:
+                tf.write('\n'.join(commit_messages) + '\n')
+            if built_up_changelog:
+                tf.writelines(built_up_changelog)
             tf.writelines([
                 '\n',
                 '# Enter your changelog message above this comment, then save and close editor when finished.\n',
@@ -377,11 +1861,12 @@ def _prompt_for_changelog(verbose):
             editor = os.environ.get('INVOKE_RELEASE_EDITOR', os.environ.get('EDITOR', 'vim'))
             _verbose_output(verbose, 'Opening editor {} to edit changelog.', editor)
             try:
-                subprocess.check_call(
-                    shlex.split(editor) + [tf.name],
-                    stdout=sys.stdout,
-                    stderr=sys.stderr,
-                )
+                with _waiting_for_user():
+                    _check_call(
+                        shlex.split(editor) + [tf.name],
+                        stdout=sys.stdout,
+                        stderr=sys.stderr,
+                    )
             except (subprocess.CalledProcessError, OSError) as e:
                 args = {'editor': editor}
                 if isinstance(e, OSError):
@@ -443,30 +1928,29 @@ def _write_to_changelog_file(release_version, changelog_header, changelog_messag
             changelog_write.writelines(changelog_message + ['\n'])
         changelog_write.writelines(changelog_footer)
 
-    _verbose_output(verbose, 'Finished writing to changelog.')
+    _invalidate_directory_entries(CHANGELOG_FILENAME)
 
+    _verbose_output(verbose, 'Finished writing to changelog.')
 
-def _tag_branch(release_version, changelog_lines, verbose, overwrite=False):
-    _verbose_output(verbose, 'Tagging branch...')
 
+def _is_git_option_enabled(name):
+    """
+    Returns whether the boolean Git configuration option is set to true.
+    """
     try:
-        gpg = subprocess.check_output(['which', 'gpg']).decode('utf8').strip()
-        _verbose_output(verbose, 'Found location of `gpg` to be {}'.format(gpg))
+        return _check_output(['git', 'config', '--bool', name], cwd=ROOT_DIRECTORY).strip() == b'true'
     except subprocess.CalledProcessError:
-        gpg = None
-    if not gpg:
-        try:
-            gpg = subprocess.check_output(['which', 'gpg2']).decode('utf8').strip()
-            _verbose_output(verbose, 'Found location of `gpg2` to be {}'.format(gpg))
-        except subprocess.CalledProcessError:
-            gpg = None
+        return False  # Not configured
 
-    try:
-        tty = subprocess.check_output(['tty']).decode('utf8').strip()
-        _verbose_output(verbose, 'Found location of `tty` to be {}'.format(tty))
-    except subprocess.CalledProcessError:
+
+def _tag_branch(release_version, changelog_lines, verbose, overwrite=False):
+    _verbose_output(verbose, 'Tagging branch...')
+
+    environment = _get_prefetched('environment', _probe_environment, verbose)
+    gpg = environment['gpg']
+    tty = environment['tty']
+    if not tty:
         _verbose_output(verbose, 'Could not get tty path ... Maybe a problem? Maybe not.')
-        tty = ''
 
     release_message = RELEASE_MESSAGE_TEMPLATE.format(release_version)
     if changelog_lines:
@@ -474,15 +1958,20 @@ def _tag_branch(release_version, changelog_lines, verbose, overwrite=False):
         for line in changelog_lines:
             release_message += '\n' + line.strip()
 
-    cmd = ['git', 'tag', '-a', release_version, '-m', release_message]
+    # Configure the GPG program for just the commands that need it instead of changing the user's global Git config
+    git = ['git', '-c', 'gpg.program={}'.format(gpg)] if gpg else ['git']
+
+    cmd = git + ['tag', '-a', release_version, '-m', release_message]
     if overwrite:
         cmd.append('-f')
 
-    signed = False
+    # `git tag -a` signs tags when this is configured, which writing the tag object directly would not
+    signed = _is_git_option_enabled('tag.gpgSign')
     if gpg:
         sign_with_key = _prompt(
             'GPG is installed on your system. Would you like to sign the release tag with your GitHub committer email '
             'GPG key? (y/N/[alternative key ID]):',
+            answer_key='sign',
         ).lower() or INSTRUCTION_NO
 
         if sign_with_key == INSTRUCTION_YES:
@@ -492,22 +1981,17 @@ def _tag_branch(release_version, changelog_lines, verbose, overwrite=False):
 
         if sign_with_key != INSTRUCTION_NO:
             signed = True
-            try:
-                subprocess.check_output(
-                    ['git', 'config', '--global', 'gpg.program', gpg],
-                )
-            except subprocess.CalledProcessError as e:
-                raise ReleaseFailure(
-                    'Failed to configure Git+GPG. Something is not right. Aborting.\n{code}: {output}'.format(
-                        code=e.returncode,
-                        output=e.output.decode('utf8'),
-                    )
-                )
     else:
         _standard_output('GPG is not installed on your system. Will not sign the release tag.')
 
+    if not signed:
+        # Only signing needs `git tag`; an unsigned tag is written directly, like any other bulk-created tag
+        _create_tags([(release_version, 'HEAD', release_message)], verbose, overwrite=overwrite)
+        _verbose_output(verbose, 'Finished tagging branch.')
+        return
+
     try:
-        result = subprocess.check_output(
+        result = _check_output(
             cmd,
             stderr=subprocess.STDOUT,
             env=dict(os.environ, GPG_TTY=tty),
@@ -531,8 +2015,8 @@ def _tag_branch(release_version, changelog_lines, verbose, overwrite=False):
 
     if signed:
         try:
-            subprocess.check_call(
-                ['git', 'tag', '-v', release_version],
+            _check_call(
+                git + ['tag', '-v', release_version],
                 stdout=sys.stdout,
                 stderr=sys.stderr,
             )
@@ -544,14 +2028,150 @@ def _tag_branch(release_version, changelog_lines, verbose, overwrite=False):
     _verbose_output(verbose, 'Finished tagging branch.')
 
 
+def _read_trees(revision, directories):
+    """
+    Reads the trees of the given directories (relative, with "/" separators; "" is the root) at the given revision
+    with one `git cat-file --batch`, and returns a dict of each directory to a dict of its entry names to
+    `(mode, object_hash)` tuples, or to `None` for directories that do not exist at that revision. Entry names are
+    bytes, exactly as Git stores them, because they need not be valid UTF-8.
+    """
+    output = _check_output_with_input(
+        ['git', 'cat-file', '--batch'],
+        ''.join('{}:{}\n'.format(revision, directory) for directory in directories).encode('utf8'),
+        stderr=sys.stderr,
+        cwd=ROOT_DIRECTORY,
+    )
+
+    trees = {}
+    position = 0
+    for directory in directories:
+        header_end = output.index(b'\n', position)
+        header = output[position:header_end].decode('utf8').split(' ')
+        position = header_end + 1
+        if header[-1] == 'missing' or header[1] != 'tree':
+            trees[directory] = None
+            if header[-1] != 'missing':
+                position += int(header[2]) + 1
+            continue
+
+        content = output[position:position + int(header[2])]
+        position += int(header[2]) + 1
+        hash_length = len(header[0]) // 2
+        entries = {}
+        offset = 0
+        while offset < len(content):
+            name_end = content.index(b'\0', offset)
+            mode, name = content[offset:name_end].split(b' ', 1)
+            entries[name] = (
+                mode.decode('ascii'),
+                binascii.hexlify(content[name_end + 1:name_end + 1 + hash_length]).decode('ascii'),
+            )
+            offset = name_end + 1 + hash_length
+        trees[directory] = entries
+    return trees
+
+
+def _commit_files_with_plumbing(files_to_commit, message, verbose):
+    """
+    Commits the given files on top of HEAD without reading or refreshing the whole index, and without running commit
+    hooks, so that the time it takes does not depend on the size of the repository: it hashes only these files, builds
+    new trees for only the directories that contain them (from HEAD's trees), creates the commit with `commit-tree`,
+    moves the branch with `update-ref`, and then updates only these files' index entries.
+    """
+    paths = [os.path.relpath(file_name, ROOT_DIRECTORY).replace(os.sep, '/') for file_name in files_to_commit]
+    _verbose_output(verbose, 'Committing {} with plumbing commands...', paths)
+
+    parent = _check_output(['git', 'rev-parse', 'HEAD'], stderr=sys.stderr, cwd=ROOT_DIRECTORY).decode('utf8').strip()
+    blobs = _check_output_with_input(
+        ['git', 'hash-object', '-w', '--stdin-paths'],
+        ''.join(path + '\n' for path in paths).encode('utf8'),
+        stderr=sys.stderr,
+        cwd=ROOT_DIRECTORY,
+    ).decode('utf8').split()
+
+    # Every directory containing a changed file, deepest first, so that each new tree is built before its parent
+    directories = set([''])
+    for path in paths:
+        parts = path.split('/')[:-1]
+        directories.update('/'.join(parts[:i]) for i in range(1, len(parts) + 1))
+    directories = sorted(directories, key=lambda d: (-d.count('/') if d else 1, d))
+    trees = _read_trees(parent, directories)
+
+    changed = {}
+    for path, blob in zip(paths, blobs):
+        directory, _, name = path.rpartition('/')
+        name = name.encode('utf8')
+        mode = (trees[directory] or {}).get(name, (None,))[0]
+        if mode in ('120000', '160000'):
+            raise ReleaseFailure(
+                'Cannot commit {} with fast_commit, because it is a symbolic link or submodule.'.format(path),
+            )
+        if not mode:
+            mode = '100755' if os.access(os.path.join(ROOT_DIRECTORY, path), os.X_OK) else '100644'
+        changed.setdefault(directory, {})[name] = (mode, blob)
+
+    for directory in directories:
+        entries = dict(trees[directory] or {})
+        entries.update(changed.get(directory, {}))
+        tree = _check_output_with_input(
+            ['git', 'mktree', '-z'],
+            b''.join(
+                '{mode} {type} {hash}\t'.format(
+                    mode=mode,
+                    type='tree' if mode == '40000' else 'commit' if mode == '160000' else 'blob',
+                    hash=object_hash,
+                ).encode('ascii') + name + b'\0'
+                for name, (mode, object_hash) in six.iteritems(entries)
+            ),
+            stderr=sys.stderr,
+            cwd=ROOT_DIRECTORY,
+        ).decode('utf8').strip()
+        if directory:
+            parent_directory, _, name = directory.rpartition('/')
+            changed.setdefault(parent_directory, {})[name.encode('utf8')] = ('40000', tree)
+
+    command = ['git', 'commit-tree', tree, '-p', parent, '-F', '-']
+    # `git commit` signs commits when this is configured, but `commit-tree` must be told explicitly
+    if _is_git_option_enabled('commit.gpgSign'):
+        command.append('-S')
+    commit = _check_output_with_input(
+        command,
+        message.encode('utf8'),
+        stderr=sys.stderr,
+        cwd=ROOT_DIRECTORY,
+    ).decode('utf8').strip()
+
+    # Moving HEAD moves the checked-out branch, and only if it still points at the parent
+    _check_output(
+        ['git', 'update-ref', '-m', 'commit: {}'.format(message.split('\n', 1)[0]), 'HEAD', commit, parent],
+        stderr=sys.stderr,
+        cwd=ROOT_DIRECTORY,
+    )
+    _check_output(['git', 'update-index', '--'] + paths, stderr=sys.stderr, cwd=ROOT_DIRECTORY)
+
+    _standard_output('Created release commit {} ({}).', commit[:10], message.split('\n', 1)[0])
+
+
 def _commit_release_changes(release_version, changelog_lines, verbose):
     _verbose_output(verbose, 'Committing release changes...')
 
     files_to_commit = [VERSION_FILENAME, CHANGELOG_FILENAME] + _get_extra_files_to_commit()
-    _verbose_output(verbose, 'Staging changes for files {}.'.format(files_to_commit))
+
+    release_message = [RELEASE_MESSAGE_TEMPLATE.format(release_version)]
+    if changelog_lines:
+        release_message.append('\nChangelog Details:')
+        for line in changelog_lines:
+            release_message.append(line.strip())
+
+    if FAST_COMMIT:
+        _commit_files_with_plumbing(files_to_commit, '\n'.join(release_message), verbose)
+        _verbose_output(verbose, 'Finished releasing changes.')
+        return
+
+    _verbose_output(verbose, 'Staging changes for files {}.', files_to_commit)
 
     try:
-        result = subprocess.check_output(
+        result = _check_output(
             ['git', 'add'] + files_to_commit,
             stderr=subprocess.STDOUT,
         )
@@ -561,13 +2181,7 @@ def _commit_release_changes(release_version, changelog_lines, verbose):
     if result:
         raise ReleaseFailure('Failed staging release files for commit: {}'.format(result))
 
-    release_message = [RELEASE_MESSAGE_TEMPLATE.format(release_version)]
-    if changelog_lines:
-        release_message.append('\nChangelog Details:')
-        for line in changelog_lines:
-            release_message.append(line.strip())
-
-    subprocess.check_call(
+    _check_call(
         ['git', 'commit', '-m', '\n'.join(release_message)],
         stdout=sys.stdout,
         stderr=sys.stderr,
@@ -579,30 +2193,24 @@ def _commit_release_changes(release_version, changelog_lines, verbose):
 def _push_release_changes(release_version, branch_name, verbose):
     try:
         if USE_TAG:
-            message = 'Push release changes and tag to remote origin (branch "{}")? (y/N/rollback):'
+            message = 'Push release changes and tag to {} (branch "{}")? (y/N/rollback):'
         else:
-            message = 'Push release changes to remote origin (branch "{}")? (y/N/rollback):'
-        push = _prompt(message, branch_name).lower()
+            message = 'Push release changes to {} (branch "{}")? (y/N/rollback):'
+        push = _prompt(message, _describe_remotes(), branch_name, answer_key='push').lower()
     except KeyboardInterrupt:
         push = INSTRUCTION_ROLLBACK
 
     if push == INSTRUCTION_YES:
-        _verbose_output(verbose, 'Pushing changes to remote origin...')
+        _verbose_output(verbose, 'Pushing changes to {}...', _describe_remotes())
 
-        subprocess.check_call(
-            ['git', 'push', 'origin', '{0}:{0}'.format(branch_name)],
-            stdout=sys.stdout,
-            stderr=sys.stderr,
-        )
+        refspecs = ['{0}:{0}'.format(branch_name)]
         if USE_TAG:
-            # push the release tag
-            subprocess.check_call(
-                ['git', 'push', 'origin', release_version],
-                stdout=sys.stdout,
-                stderr=sys.stderr,
-            )
+            # push the release tag along with the branch, so that a remote accepts both or neither
+            _push_tags([release_version], verbose, refspecs=refspecs)
+        else:
+            _push_to_remotes(refspecs, verbose)
 
-        _verbose_output(verbose, 'Finished pushing changes to remote origin.')
+        _verbose_output(verbose, 'Finished pushing changes to {}.', _describe_remotes())
 
         return PUSH_RESULT_PUSHED
     elif push == INSTRUCTION_ROLLBACK:
@@ -621,25 +2229,32 @@ def _push_release_changes(release_version, branch_name, verbose):
 
         return PUSH_RESULT_ROLLBACK
     else:
-        _standard_output('Not pushing changes to remote origin!')
+        _standard_output('Not pushing changes to {}!', _describe_remotes())
         if USE_TAG:
-            _print_output(
-                COLOR_RED_BOLD,
+            _warning_output(
                 'Make sure you remember to explicitly push {branch} and the tag '
                 '(or revert your local changes if you are trying to cancel)! '
                 'You can push with the following commands:\n'
-                '    git push origin {branch}:{branch}\n'
-                '    git push origin "{tag}"\n',
+                '{commands}',
                 branch=branch_name,
-                tag=release_version,
+                commands=''.join(
+                    '    git push {remote} {branch}:{branch}\n    git push {remote} "{tag}"\n'.format(
+                        remote=remote,
+                        branch=branch_name,
+                        tag=release_version,
+                    ) for remote in REMOTES + BEST_EFFORT_REMOTES
+                ),
             )
         else:
-            _print_output(
-                COLOR_RED_BOLD,
+            _warning_output(
                 'Make sure you remember to explicitly push {branch} (or revert your local changes if you are '
                 'trying to cancel)! You can push with the following command:\n'
-                '    git push origin {branch}:{branch}\n',
+                '{commands}',
                 branch=branch_name,
+                commands=''.join(
+                    '    git push {remote} {branch}:{branch}\n'.format(remote=remote, branch=branch_name)
+                    for remote in REMOTES + BEST_EFFORT_REMOTES
+                ),
             )
 
         return PUSH_RESULT_NO_ACTION
@@ -648,10 +2263,14 @@ def _push_release_changes(release_version, branch_name, verbose):
 def _get_last_commit_hash(verbose):
     _verbose_output(verbose, 'Getting last commit hash...')
 
-    commit_hash = subprocess.check_output(
-        ['git', 'log', '-n', '1', '--pretty=format:%H'],
-        stderr=sys.stderr,
-    ).decode('utf8').strip()
+    head = _resolve_head()
+    if head and head[1]:
+        commit_hash = head[1]
+    else:
+        commit_hash = _check_output(
+            ['git', 'log', '-n', '1', '--pretty=format:%H'],
+            stderr=sys.stderr,
+        ).decode('utf8').strip()
 
     _verbose_output(verbose, 'Last commit hash is {}.', commit_hash)
 
@@ -661,7 +2280,7 @@ def _get_last_commit_hash(verbose):
 def _get_commit_subject(commit_hash, verbose):
     _verbose_output(verbose, 'Getting commit message for hash {}...', commit_hash)
 
-    message = subprocess.check_output(
+    message = _check_output(
         ['git', 'log', '-n', '1', '--pretty=format:%s', commit_hash],
         stderr=sys.stderr,
     ).decode('utf8').strip()
@@ -674,10 +2293,14 @@ def _get_commit_subject(commit_hash, verbose):
 def _get_branch_name(verbose):
     _verbose_output(verbose, 'Determining current Git branch name.')
 
-    branch_name = subprocess.check_output(
-        ['git', 'rev-parse', '--abbrev-ref', 'HEAD'],
-        stderr=sys.stderr,
-    ).decode('utf8').strip()
+    head = _resolve_head()
+    if head and (head[0] == 'HEAD' or head[0].startswith('refs/heads/')):
+        branch_name = head[0][len('refs/heads/'):] if head[0] != 'HEAD' else 'HEAD'
+    else:
+        branch_name = _check_output(
+            ['git', 'rev-parse', '--abbrev-ref', 'HEAD'],
+            stderr=sys.stderr,
+        ).decode('utf8').strip()
 
     _verbose_output(verbose, 'Current Git branch name is {}.', branch_name)
 
@@ -687,7 +2310,7 @@ def _get_branch_name(verbose):
 def _create_branch(verbose, branch_name):
     _verbose_output(verbose, 'Creating branch {branch}...', branch=branch_name)
 
-    subprocess.check_call(
+    _check_call(
         ['git', 'checkout', '-b', branch_name],
         stdout=sys.stdout,
         stderr=sys.stderr,
@@ -697,22 +2320,23 @@ def _create_branch(verbose, branch_name):
 
 
 def _create_local_tracking_branch(verbose, branch_name):
-    """Create a local tracking branch of origin/<branch_name>.
+    """Create a local tracking branch of <primary remote>/<branch_name>.
 
     Returns True if successful, False otherwise.
 
     """
     _verbose_output(
         verbose,
-        'Creating local branch {branch} set up to track remote branch {branch} from \'origin\'...',
-        branch=branch_name
+        'Creating local branch {branch} set up to track remote branch {branch} from \'{remote}\'...',
+        branch=branch_name,
+        remote=_get_primary_remote(),
     )
 
     success = True
 
     try:
-        subprocess.check_call(
-            ['git', 'checkout', '--track', 'origin/{}'.format(branch_name)],
+        _check_call(
+            ['git', 'checkout', '--track', '{}/{}'.format(_get_primary_remote(), branch_name)],
             stdout=sys.stdout,
             stderr=sys.stderr,
         )
@@ -727,19 +2351,26 @@ def _create_local_tracking_branch(verbose, branch_name):
 def _checkout_branch(verbose, branch_name):
     _verbose_output(verbose, 'Checking out branch {branch}...', branch=branch_name)
 
-    subprocess.check_call(
-        ['git', 'checkout', branch_name],
+    command = ['git', 'checkout', branch_name]
+    if __RELEASE_WORKTREE:
+        # The branch is probably still checked out in the main worktree
+        command.append('--ignore-other-worktrees')
+
+    _check_call(
+        command,
         stdout=sys.stdout,
         stderr=sys.stderr,
     )
 
+    _invalidate_directory_entries()
+
     _verbose_output(verbose, 'Done checking out branch {}.', branch_name)
 
 
 def _delete_branch(verbose, branch_name):
     _verbose_output(verbose, 'Deleting branch {branch}...', branch=branch_name)
 
-    subprocess.check_call(
+    _check_call(
         ['git', 'branch', '-D', branch_name],
         stdout=sys.stdout,
         stderr=sys.stderr,
@@ -751,8 +2382,8 @@ def _delete_branch(verbose, branch_name):
 def _is_branch_on_remote(verbose, branch_name):
     _verbose_output(verbose, 'Checking if branch {} exists on remote...', branch_name)
 
-    result = subprocess.check_output(
-        ['git', 'ls-remote', '--heads', 'origin', branch_name],
+    result = _check_output(
+        ['git', 'ls-remote', '--heads', _get_primary_remote(), branch_name],
         stderr=sys.stderr,
     ).decode('utf8').strip()
 
@@ -771,23 +2402,20 @@ def _is_branch_on_remote(verbose, branch_name):
 def _create_branch_from_tag(verbose, tag_name, branch_name):
     _verbose_output(verbose, 'Creating branch {branch} from tag {tag}...', branch=branch_name, tag=tag_name)
 
-    subprocess.check_call(
+    _check_call(
         ['git', 'checkout', 'tags/{}'.format(tag_name), '-b', branch_name],
         stdout=sys.stdout,
         stderr=sys.stderr,
     )
+    _invalidate_directory_entries()
 
     _verbose_output(verbose, 'Done creating branch {}.', branch_name)
 
 
 def _push_branch(verbose, branch_name):
-    _verbose_output(verbose, 'Pushing branch {} to remote.', branch_name)
+    _verbose_output(verbose, 'Pushing branch {} to {}.', branch_name, _describe_remotes())
 
-    subprocess.check_call(
-        ['git', 'push', 'origin', '{0}:{0}'.format(branch_name)],
-        stdout=sys.stdout,
-        stderr=sys.stderr,
-    )
+    _push_to_remotes(['{0}:{0}'.format(branch_name)], verbose)
 
     _verbose_output(verbose, 'Done pushing branch {}.', branch_name)
 
@@ -795,7 +2423,7 @@ def _push_branch(verbose, branch_name):
 def _fetch_tags(verbose):
     _verbose_output(verbose, 'Fetching all remote tags...')
 
-    subprocess.check_call(
+    _check_call(
         ['git', 'fetch', '--tags'],
         stdout=sys.stdout,
         stderr=sys.stderr,
@@ -804,66 +2432,173 @@ def _fetch_tags(verbose):
     _verbose_output(verbose, 'Done fetching tags.')
 
 
+def _get_tags_signature(common_directory):
+    """
+    Returns a value that changes whenever a tag is created, deleted, or packed: the identity of `packed-refs` and the
+    modification times of the loose tag directories. Returns `None` if a change could have gone unnoticed, because one
+    of them was modified too recently.
+    """
+    signature = []
+    racy_time = time.time() - RACY_MODIFICATION_SECONDS
+    try:
+        stat = os.stat(os.path.join(common_directory, 'packed-refs'))
+        signature.append((stat.st_ino, stat.st_size, stat.st_mtime))
+        if stat.st_mtime >= racy_time:
+            return None
+    except OSError:
+        signature.append(None)
+
+    for directory, _, _ in os.walk(os.path.join(common_directory, 'refs', 'tags')):
+        try:
+            modified = os.stat(directory).st_mtime
+        except OSError:
+            return None
+        if modified >= racy_time:
+            return None
+        signature.append((directory, modified))
+    return tuple(signature)
+
+
 def _get_tag_list(verbose):
+    """
+    Returns the names of the local tags. The list is kept (for as long as this process runs, as in the release daemon)
+    until a tag is created, deleted, or packed.
+    """
     _verbose_output(verbose, 'Parsing list of local tags...')
 
-    result = subprocess.check_output(
+    directories = _find_git_directories()
+    signature = directories and _get_tags_signature(directories[1])
+    cached = __TAG_LISTS.get(directories[1]) if directories else None
+    if signature and cached and cached[0] == signature:
+        _verbose_output(verbose, 'Using the cached list of {} local tags.', len(cached[1]))
+        return list(cached[1])
+
+    result = _check_output(
         ['git', 'tag', '--list'],
         stderr=sys.stderr,
     ).decode('utf8').strip().split()
+    if signature:
+        # The signature was taken before listing, so a tag created meanwhile only makes the cached list look stale
+        __TAG_LISTS[directories[1]] = (signature, tuple(result))
 
     _verbose_output(verbose, 'Result of tag list parsing is {}.', result)
 
     return result
 
 
+def _get_remote_tag_list(verbose, interactive=True):
+    """
+    Returns the set of tags on the primary remote. Unless `interactive`, which it is not while it runs in the background
+    during a prompt, Git and SSH are not allowed to prompt for credentials, and errors are not printed.
+    """
+    _verbose_output(verbose, 'Listing tags on remote...')
+
+    command = ['git', 'ls-remote', '--tags', _get_primary_remote()]
+    if interactive:
+        result = _check_output(command, stderr=sys.stderr).decode('utf8')
+    else:
+        environment = dict(os.environ, GIT_TERMINAL_PROMPT='0')
+        if not environment.get('GIT_SSH_COMMAND') and not environment.get('GIT_SSH'):
+            environment['GIT_SSH_COMMAND'] = 'ssh -o BatchMode=yes'
+        with open(os.devnull, 'wb') as null:
+            result = _check_output(command, stderr=null, env=environment).decode('utf8')
+
+    tags = set()
+    for line in result.splitlines():
+        ref = line.rsplit('\t', 1)[-1]
+        if ref.startswith('refs/tags/'):
+            tags.add(ref[len('refs/tags/'):].split('^{}', 1)[0])
+
+    _verbose_output(verbose, 'Found {} tags on remote.', len(tags))
+
+    return tags
+
+
 def _does_tag_exist_locally(release_version, verbose):
     _verbose_output(verbose, 'Checking if tag {} exists locally...', release_version)
 
-    result = subprocess.check_output(
-        ['git', 'tag', '--list', release_version],
-        stderr=sys.stderr,
-    ).decode('utf8').strip()
+    directories = _find_git_directories()
+    if directories and not any(character in release_version for character in '*?[\\'):
+        exists = _read_ref('refs/tags/{}'.format(release_version), directories) is not None
+    else:
+        result = _check_output(
+            ['git', 'tag', '--list', release_version],
+            stderr=sys.stderr,
+        ).decode('utf8').strip()
 
-    exists = release_version in result
+        exists = release_version in result
 
     _verbose_output(verbose, 'Result of exists check for tag {tag} is {result}.', tag=release_version, result=exists)
 
     return exists
 
 
-def _is_tag_on_remote(release_version, verbose):
-    _verbose_output(verbose, 'Checking if tag {} was pushed to remote...', release_version)
+def _get_remote_tags(remote, tag_names):
+    """
+    Returns the names of the given tags that exist on the remote.
+    """
+    output = _check_output(
+        ['git', 'ls-remote', '--tags', '--refs', remote] + ['refs/tags/{}'.format(tag_name) for tag_name in tag_names],
+        stderr=subprocess.STDOUT,
+    ).decode('utf8', 'replace')
 
-    result = subprocess.check_output(
-        ['git', 'ls-remote', '--tags', 'origin', release_version],
-        stderr=sys.stderr,
-    ).decode('utf8').strip()
+    found = set()
+    for line in output.splitlines():
+        ref = line.partition('\t')[2]
+        if ref.startswith('refs/tags/'):
+            found.add(ref[len('refs/tags/'):])
+    return [tag_name for tag_name in tag_names if tag_name in found]
 
-    on_remote = release_version in result
 
-    _verbose_output(
-        verbose,
-        'Result of on-remote check for tag {tag} is {result}.',
-        tag=release_version,
-        result=on_remote,
-    )
+def _get_tags_on_remotes(tag_names, verbose):
+    """
+    Returns a dict of each configured remote to those of the given tags that exist on it, querying all remotes at once.
+    Raises `ReleaseFailure` if any required remote could not be queried; best-effort remotes that could not be queried
+    are only reported, and left out.
+    """
+    _verbose_output(verbose, 'Checking which remotes have tags {}...', LazyText(', '.join, tag_names))
 
-    return on_remote
+    queries = [
+        (remote, required, BackgroundCall(_get_remote_tags, remote, tag_names))
+        for remote, required in _get_remotes()
+    ]
+
+    tags_on_remotes = {}
+    failed = []
+    for remote, required, query in queries:
+        try:
+            tags_on_remotes[remote] = query.result()
+        except (subprocess.CalledProcessError, OSError) as e:
+            if required:
+                failed.append(remote)
+                _error_output('Failed checking the tags on remote {}:\n{}', remote, _describe_command_error(e))
+            else:
+                _error_output(
+                    'Failed checking the tags on best-effort remote {} (continuing anyway):\n{}',
+                    remote,
+                    _describe_command_error(e),
+                )
+        else:
+            _verbose_output(verbose, 'Remote {} has tags {}.', remote, tags_on_remotes[remote])
+
+    if failed:
+        raise ReleaseFailure('Failed checking the tags on required remote(s) {}.'.format(', '.join(failed)))
+    return tags_on_remotes
 
 
 def _get_remote_branches_with_commit(commit_hash, verbose):
     _verbose_output(verbose, 'Checking if commit {} was pushed to any remote branches...', commit_hash)
 
-    result = subprocess.check_output(
+    result = _check_output(
         ['git', 'branch', '-r', '--contains', commit_hash],
         stderr=sys.stderr,
     ).decode('utf8').strip()
 
+    remote_prefix = '{}/'.format(_get_primary_remote())
     on_remote = []
     for line in result.splitlines():
         line = line.strip()
-        if line.startswith('origin/') and not line.startswith('origin/HEAD'):
+        if line.startswith(remote_prefix) and not line.startswith('{}HEAD'.format(remote_prefix)):
             on_remote.append(line)
 
     _verbose_output(
@@ -876,26 +2611,128 @@ def _get_remote_branches_with_commit(commit_hash, verbose):
     return on_remote
 
 
-def _delete_local_tag(tag_name, verbose):
-    _verbose_output(verbose, 'Deleting local tag {}...', tag_name)
+def _update_tag_refs(instructions, verbose):
+    """
+    Applies `git update-ref --stdin` instructions (such as "create refs/tags/1.2.3 <object>") in one transaction, so
+    that either all of the tag refs are updated or, if any update fails, none are.
+    """
+    _verbose_output(verbose, 'Updating tag refs in one transaction:\n{}', LazyText('\n'.join, instructions))
+    try:
+        _check_output_with_input(
+            ['git', 'update-ref', '--stdin'],
+            ''.join(instruction + '\n' for instruction in instructions).encode('utf8'),
+            stderr=subprocess.STDOUT,
+        )
+    except subprocess.CalledProcessError as e:
+        raise ReleaseFailure('Failed updating tags (no tags were changed): {}'.format(e.output.decode('utf8')))
 
-    subprocess.check_call(
-        ['git', 'tag', '-d', tag_name],
-        stdout=sys.stdout,
+
+def _create_tags(tags, verbose, overwrite=False):
+    """
+    Creates unsigned annotated tags in bulk, using a constant number of processes however many tags there are: all of
+    the tag objects are written with one `git hash-object`, and all of the tag refs are created in one transaction.
+
+    :param tags: A list of `(tag_name, revision, message)` tuples
+    :param overwrite: Whether to replace existing tags (otherwise, no tags are created if any of them exists)
+    """
+    if not tags:
+        return
+    _verbose_output(verbose, 'Creating {} tags...', len(tags))
+
+    commits = _check_output(
+        ['git', 'rev-parse'] + ['{}^{{commit}}'.format(revision) for _, revision, _ in tags],
         stderr=sys.stderr,
+    ).decode('utf8').split()
+    tagger = _check_output(['git', 'var', 'GIT_COMMITTER_IDENT'], stderr=sys.stderr).decode('utf8').strip()
+
+    directory = tempfile.mkdtemp()
+    try:
+        object_file_names = []
+        for (tag_name, _, message), commit in zip(tags, commits):
+            object_file_name = os.path.join(directory, 'tag-{}'.format(len(object_file_names)))
+            with codecs.open(object_file_name, 'wb', encoding='utf8') as object_write:
+                object_write.write('object {commit}\ntype commit\ntag {tag}\ntagger {tagger}\n\n{message}\n'.format(
+                    commit=commit,
+                    tag=tag_name,
+                    tagger=tagger,
+                    message=message.rstrip('\n'),
+                ))
+            object_file_names.append(object_file_name)
+
+        tag_objects = _check_output_with_input(
+            ['git', 'hash-object', '-t', 'tag', '-w', '--stdin-paths'],
+            ''.join(name + '\n' for name in object_file_names).encode('utf8'),
+            stderr=sys.stderr,
+        ).decode('utf8').split()
+    finally:
+        shutil.rmtree(directory)
+
+    _update_tag_refs(
+        [
+            '{action} refs/tags/{tag} {object}'.format(
+                action='update' if overwrite else 'create',
+                tag=tag_name,
+                object=tag_object,
+            )
+            for (tag_name, _, _), tag_object in zip(tags, tag_objects)
+        ],
+        verbose,
     )
 
+    _verbose_output(verbose, 'Finished creating {} tags.', len(tags))
+
+
+def _delete_local_tags(tag_names, verbose):
+    """
+    Deletes local tags in bulk, in one transaction.
+    """
+    if tag_names:
+        _update_tag_refs(['delete refs/tags/{}'.format(tag_name) for tag_name in tag_names], verbose)
+
+
+def _push_tags(tag_names, verbose, refspecs=None):
+    """
+    Pushes tags, along with any other refspecs (such as the release branch), to the remotes in one atomic push per
+    remote (either a remote accepts all of them or none).
+    """
+    if tag_names:
+        _verbose_output(verbose, 'Pushing {} tags...', len(tag_names))
+        _push_to_remotes(
+            (refspecs or []) + ['refs/tags/{0}:refs/tags/{0}'.format(tag_name) for tag_name in tag_names],
+            verbose,
+            options=['--atomic'],
+        )
+
+
+def _delete_remote_tags(tag_names, verbose):
+    """
+    Deletes tags from the remotes in one atomic push per remote. Only the tags that a remote actually has are deleted
+    from it, because Git may refuse to delete a ref that a remote does not have, which fails the whole atomic push.
+    """
+    if tag_names:
+        _verbose_output(verbose, 'Deleting {} remote tags...', len(tag_names))
+        refspecs = dict(
+            (remote, [':refs/tags/{}'.format(tag_name) for tag_name in remote_tag_names])
+            for remote, remote_tag_names in _get_tags_on_remotes(tag_names, verbose).items()
+        )
+        if any(refspecs.values()):
+            _push_to_remotes(refspecs, verbose, options=['--atomic'])
+        else:
+            _verbose_output(verbose, 'None of the remotes have any of the tags.')
+
+
+def _delete_local_tag(tag_name, verbose):
+    _verbose_output(verbose, 'Deleting local tag {}...', tag_name)
+
+    _delete_local_tags([tag_name], verbose)
+
     _verbose_output(verbose, 'Finished deleting local tag {}.', tag_name)
 
 
 def _delete_remote_tag(tag_name, verbose):
     _verbose_output(verbose, 'Deleting remote tag {}...', tag_name)
 
-    subprocess.check_call(
-        ['git', 'push', 'origin', ':refs/tags/{}'.format(tag_name)],
-        stdout=sys.stdout,
-        stderr=sys.stderr,
-    )
+    _delete_remote_tags([tag_name], verbose)
 
     _verbose_output(verbose, 'Finished deleting remote tag {}.', tag_name)
 
@@ -905,21 +2742,22 @@ def _delete_last_commit(verbose):
 
     extra_files = _get_extra_files_to_commit()
 
-    subprocess.check_call(
+    _check_call(
         ['git', 'reset', '--soft', 'HEAD~1'],
         stdout=sys.stdout,
         stderr=sys.stderr,
     )
-    subprocess.check_call(
+    _check_call(
         ['git', 'reset', 'HEAD', VERSION_FILENAME, CHANGELOG_FILENAME] + extra_files,
         stdout=sys.stdout,
         stderr=sys.stderr,
     )
-    subprocess.check_call(
+    _check_call(
         ['git', 'checkout', '--', VERSION_FILENAME, CHANGELOG_FILENAME] + extra_files,
         stdout=sys.stdout,
         stderr=sys.stderr,
     )
+    _invalidate_directory_entries()
 
     _verbose_output(verbose, 'Finished deleting last commit.')
 
@@ -927,25 +2765,22 @@ def _delete_last_commit(verbose):
 def _revert_remote_commit(release_version, commit_hash, branch_name, verbose):
     _verbose_output(verbose, 'Rolling back release commit on remote branch "{}"...', branch_name)
 
-    subprocess.check_call(
+    _check_call(
         ['git', 'revert', '--no-edit', '--no-commit', commit_hash],
         stdout=sys.stdout,
         stderr=sys.stderr,
     )
+    _invalidate_directory_entries()
 
     release_message = 'REVERT: {}'.format(RELEASE_MESSAGE_TEMPLATE.format(release_version))
-    subprocess.check_call(
+    _check_call(
         ['git', 'commit', '-m', release_message],
         stdout=sys.stdout,
         stderr=sys.stderr,
     )
 
     _verbose_output(verbose, 'Pushing changes to remote branch "{}"...', branch_name)
-    subprocess.check_call(
-        ['git', 'push', 'origin', '{0}:{0}'.format(branch_name)],
-        stdout=sys.stdout,
-        stderr=sys.stderr,
-    )
+    _push_to_remotes(['{0}:{0}'.format(branch_name)], verbose)
 
     _verbose_output(verbose, 'Finished rolling back release commit.')
 
@@ -955,6 +2790,19 @@ def _import_version_or_exit():
         # if there is version.txt, use that
         with codecs.open(VERSION_FILENAME, 'rb', encoding='utf8') as version_txt:
             return version_txt.read()
+    if __RELEASE_WORKTREE:
+        # Run the committed version file in the release worktree directly instead of importing the package, whose
+        # `__init__` in the main checkout may have uncommitted changes (and which a sparse worktree does not contain)
+        import runpy
+        try:
+            return runpy.run_path(VERSION_FILENAME)['__version__']
+        except Exception as e:
+            _error_output_exit(
+                'Could not retrieve `__version__` from {file}. Error was "{type}: {err}."',
+                file=VERSION_FILENAME,
+                type=e.__class__.__name__,
+                err=e,
+            )
     try:
         return __import__('{}.version'.format(MODULE_NAME), fromlist=[str('__version__')]).__version__
     except ImportError as e:
@@ -988,13 +2836,42 @@ def _ensure_files_exist(exit_on_failure):
             sys.exit(1)
 
 
-def _ensure_configured(command):
+def _ensure_configured(command, output=None, profile=None, profile_memory=0):
     if not PARAMETERS_CONFIGURED:
         _error_output_exit('Cannot `invoke {}` before calling `configure_release_parameters`.', command)
+    _resolve_configuration()
+
+    _start_output(output)
+    _start_profile(profile, profile_memory)
+    _start_metrics(command)
 
     _ensure_files_exist(True)
 
 
+@contextlib.contextmanager
+def _finishing_task():
+    """
+    Finishes the task's metrics record, profile, and output however the task ends, including when it returns or exits
+    early. An exit with an error status, an interruption, or an unexpected exception is recorded as the task's result.
+    """
+    try:
+        yield
+    except SystemExit as e:
+        if e.code:
+            _set_metrics_result(METRICS_RESULT_FAILURE)
+        raise
+    except KeyboardInterrupt:
+        _set_metrics_result(METRICS_RESULT_CANCELED)
+        raise
+    except BaseException:
+        _set_metrics_result(METRICS_RESULT_ERROR)
+        raise
+    finally:
+        _finish_metrics()
+        _finish_profile()
+        _finish_output()
+
+
 def _set_map(map_function, iterable):
     ret = set()
     for i in iterable:
@@ -1007,49 +2884,57 @@ def _set_map(map_function, iterable):
     return ret
 
 
+def _call_plugin_hook(plugin, hook, *args):
+    with _metrics_timer('plugins', '{}.{}'.format(plugin.__class__.__name__, hook)):
+        return getattr(plugin, hook)(ROOT_DIRECTORY, *args)
+
+
 def _get_extra_files_to_commit():
-    return list(_set_map(lambda plugin: plugin.get_extra_files_to_commit(ROOT_DIRECTORY), RELEASE_PLUGINS))
+    return list(_set_map(lambda plugin: _call_plugin_hook(plugin, 'get_extra_files_to_commit'), RELEASE_PLUGINS))
 
 
 def _get_version_errors():
-    return _set_map(lambda plugin: plugin.version_error_check(ROOT_DIRECTORY), RELEASE_PLUGINS)
+    return _set_map(lambda plugin: _call_plugin_hook(plugin, 'version_error_check'), RELEASE_PLUGINS)
 
 
 def _pre_release(old_version):
     for plugin in RELEASE_PLUGINS:
-        plugin.pre_release(ROOT_DIRECTORY, old_version)
+        _call_plugin_hook(plugin, 'pre_release', old_version)
 
 
 def _pre_commit(old_version, new_version):
     for plugin in RELEASE_PLUGINS:
-        plugin.pre_commit(ROOT_DIRECTORY, old_version, new_version)
+        _call_plugin_hook(plugin, 'pre_commit', old_version, new_version)
+    _invalidate_directory_entries()
 
 
 def _pre_push(old_version, new_version):
     for plugin in RELEASE_PLUGINS:
-        plugin.pre_push(ROOT_DIRECTORY, old_version, new_version)
+        _call_plugin_hook(plugin, 'pre_push', old_version, new_version)
 
 
 def _post_release(old_version, new_version, pushed):
     for plugin in RELEASE_PLUGINS:
-        plugin.post_release(ROOT_DIRECTORY, old_version, new_version, pushed)
+        _call_plugin_hook(plugin, 'post_release', old_version, new_version, pushed)
 
 
 def _pre_rollback(current_version):
     for plugin in RELEASE_PLUGINS:
-        plugin.pre_rollback(ROOT_DIRECTORY, current_version)
+        _call_plugin_hook(plugin, 'pre_rollback', current_version)
 
 
 def _post_rollback(current_version, rollback_to_version):
     for plugin in RELEASE_PLUGINS:
-        plugin.post_rollback(ROOT_DIRECTORY, current_version, rollback_to_version)
+        _call_plugin_hook(plugin, 'post_rollback', current_version, rollback_to_version)
 
 
 def configure_release_parameters(module_name, display_name, python_directory=None, plugins=None,
-                                 use_pull_request=False, use_tag=True):
-    global MODULE_NAME, MODULE_DISPLAY_NAME, RELEASE_MESSAGE_TEMPLATE, VERSION_FILENAME, CHANGELOG_FILENAME
-    global ROOT_DIRECTORY, RELEASE_PLUGINS, PARAMETERS_CONFIGURED, VERSION_FILE_IS_TXT
-    global USE_PULL_REQUEST, USE_TAG
+                                 use_pull_request=False, use_tag=True, metrics_file=None, maintain_repository=False,
+                                 scoped_history=False, history_paths=None, fast_commit=False, index_directory=None,
+                                 remotes=None, best_effort_remotes=None):
+    global MODULE_NAME, MODULE_DISPLAY_NAME, RELEASE_MESSAGE_TEMPLATE, RELEASE_PLUGINS, PARAMETERS_CONFIGURED
+    global USE_PULL_REQUEST, USE_TAG, METRICS_FILENAME, MAINTAIN_REPOSITORY, FAST_COMMIT
+    global INDEX_DIRECTORY, REMOTES, BEST_EFFORT_REMOTES
 
     if PARAMETERS_CONFIGURED:
         _error_output_exit('Cannot call configure_release_parameters more than once.')
@@ -1063,6 +2948,46 @@ def configure_release_parameters(module_name, display_name, python_directory=Non
     MODULE_DISPLAY_NAME = display_name
     RELEASE_MESSAGE_TEMPLATE = 'Released {} version {{}}'.format(MODULE_DISPLAY_NAME)
 
+    if getattr(plugins, '__iter__', None):
+        RELEASE_PLUGINS = plugins
+
+    USE_PULL_REQUEST = use_pull_request
+    USE_TAG = use_tag
+    METRICS_FILENAME = metrics_file
+    MAINTAIN_REPOSITORY = maintain_repository
+    FAST_COMMIT = fast_commit
+    INDEX_DIRECTORY = index_directory
+    if remotes:
+        REMOTES = list(remotes)
+    BEST_EFFORT_REMOTES = [remote for remote in best_effort_remotes or [] if remote not in REMOTES]
+
+    # This is called when `tasks.py` is imported, which `invoke --list` and shell completion do too, so finding the
+    # project files (which runs Git) is left to `_resolve_configuration`, the first time a task needs them
+    __CONFIGURATION.clear()
+    __CONFIGURATION.update(
+        python_directory=python_directory,
+        scoped_history=scoped_history,
+        history_paths=history_paths,
+        resolved=False,
+    )
+
+    PARAMETERS_CONFIGURED = True
+
+
+def _resolve_configuration():
+    """
+    Finds the Git root directory, version file, and changelog file from the arguments to
+    `configure_release_parameters`, and adds the Python directory to the import path. Only the first call (in each
+    process) does any work.
+    """
+    global ROOT_DIRECTORY, VERSION_FILENAME, CHANGELOG_FILENAME, VERSION_FILE_IS_TXT, HISTORY_PATHS
+
+    if not __CONFIGURATION or __CONFIGURATION['resolved']:
+        return
+
+    python_directory = __CONFIGURATION['python_directory']
+    history_paths = __CONFIGURATION['history_paths']
+
     ROOT_DIRECTORY = os.path.normpath(_get_root_directory())
 
     if python_directory:
@@ -1097,23 +3022,36 @@ def configure_release_parameters(module_name, display_name, python_directory=Non
     if import_directory not in sys.path:
         sys.path.insert(0, import_directory)
 
-    if getattr(plugins, '__iter__', None):
-        RELEASE_PLUGINS = plugins
-
-    USE_PULL_REQUEST = use_pull_request
-    USE_TAG = use_tag
+    if __CONFIGURATION['scoped_history'] or history_paths:
+        # The version file directory is inside the Python directory, when there is one
+        HISTORY_PATHS = [os.path.relpath(os.path.dirname(VERSION_FILENAME), ROOT_DIRECTORY)]
+        if python_directory:
+            HISTORY_PATHS = [os.path.relpath(import_directory, ROOT_DIRECTORY)]
+        HISTORY_PATHS.extend(os.path.normpath(path) for path in history_paths or [])
 
-    PARAMETERS_CONFIGURED = True
+    __CONFIGURATION['resolved'] = True
 
 
-@task
-def version(_):
+@task(help={
+    'profile': PROFILE_HELP,
+    'profile-memory': PROFILE_MEMORY_HELP,
+})
+def version(_, profile=None, profile_memory=0):
     """
     Prints the "Invoke Release" version and the version of the current project.
     """
     if not PARAMETERS_CONFIGURED:
         _error_output_exit('Cannot `invoke version` before calling `configure_release_parameters`.')
+    _resolve_configuration()
+
+    _start_profile(profile, profile_memory)
+    try:
+        _print_version_information()
+    finally:
+        _finish_profile()
 
+
+def _print_version_information():
     _standard_output('Python {}', sys.version.split('\n')[0].strip())
 
     from invoke import __version__ as invoke_version
@@ -1132,130 +3070,143 @@ def version(_):
     _standard_output('Detected version file: {}', VERSION_FILENAME)
     _standard_output('Detected changelog file: {}', CHANGELOG_FILENAME)
 
+    commit_graph, loose_refs = _get_repository_maintenance_status()
+    _standard_output('Detected commit-graph: {}', commit_graph)
+    _standard_output('Detected loose refs: {}', loose_refs)
+    if not MAINTAIN_REPOSITORY and (commit_graph != COMMIT_GRAPH_CURRENT or loose_refs > LOOSE_REFS_PACK_THRESHOLD):
+        _standard_output(
+            'History queries (such as gathering commit messages) would be faster with an up-to-date commit-graph and '
+            'packed refs. Add `maintain_repository=True` to `configure_release_parameters` to update them after each '
+            'release, or run `git commit-graph write --reachable --split` and `git pack-refs --all`.'
+        )
+
 
 @task(help={
     'verbose': 'Specify this switch to include verbose debug information in the command output.',
     'no-stash': 'Specify this switch to disable stashing any uncommitted changes (by default, changes that have '
                 'not been committed are stashed before the branch is created).',
+    'output': OUTPUT_HELP,
+    'profile': PROFILE_HELP,
+    'profile-memory': PROFILE_MEMORY_HELP,
 })
-def branch(_, verbose=False, no_stash=False):
+def branch(_, verbose=False, no_stash=False, output=None, profile=None, profile_memory=0):
     """
     Creates a branch from a release tag for creating a new patch or minor release from that branch.
     """
-    _ensure_configured('release')
+    with _finishing_task():
+        _ensure_configured('branch', output, profile, profile_memory)
 
-    from invoke_release.version import __version__
-    _standard_output('Invoke Release {}', __version__)
+        from invoke_release.version import __version__
+        _standard_output('Invoke Release {}', __version__)
 
-    _setup_task(no_stash, verbose)
-    try:
-        _fetch_tags(verbose)
+        _setup_task(no_stash, verbose)
+        try:
+            _fetch_tags(verbose)
 
-        tags = _get_tag_list(verbose)
+            tags = _get_tag_list(verbose)
+            _end_metrics_phase('fetch')
 
-        branch_version = _prompt('Enter a version tag from which to create a new branch (or "exit"):').lower()
-        if not branch_version or branch_version == INSTRUCTION_EXIT:
-            raise ReleaseExit()
+            branch_version = _prompt('Enter a version tag from which to create a new branch (or "exit"):').lower()
+            if not branch_version or branch_version == INSTRUCTION_EXIT:
+                raise ReleaseExit()
 
-        if branch_version not in tags:
-            raise ReleaseFailure('Version number {} not in the list of available tags.'.format(branch_version))
+            if branch_version not in tags:
+                raise ReleaseFailure('Version number {} not in the list of available tags.'.format(branch_version))
 
-        _v = LooseVersion(branch_version)
-        minor_branch = '.'.join(list(map(six.text_type, _v.version[:2])) + ['x'])
-        major_branch = '.'.join(list(map(six.text_type, _v.version[:1])) + ['x', 'x'])
+            try:
+                _v = Version.parse(branch_version)
+            except ValueError:
+                raise ReleaseFailure('Tag {} is not a release version and cannot be branched.'.format(branch_version))
+            minor_branch = _v.minor_branch
+            major_branch = _v.major_branch
+
+            proceed_instruction = _prompt(
+                'Using tag {tag}, would you like to create a minor branch for patch versions (branch {minor}, '
+                'recommended), or a major branch for minor versions (branch {major})? (MINOR/major/exit):',
+                tag=branch_version,
+                minor=minor_branch,
+                major=major_branch,
+            )
 
-        proceed_instruction = _prompt(
-            'Using tag {tag}, would you like to create a minor branch for patch versions (branch {minor}, '
-            'recommended), or a major branch for minor versions (branch {major})? (MINOR/major/exit):',
-            tag=branch_version,
-            minor=minor_branch,
-            major=major_branch,
-        )
+            if proceed_instruction == INSTRUCTION_EXIT:
+                raise ReleaseExit()
 
-        if proceed_instruction == INSTRUCTION_EXIT:
-            raise ReleaseExit()
+            new_branch = major_branch if proceed_instruction == INSTRUCTION_MAJOR else minor_branch
 
-        new_branch = major_branch if proceed_instruction == INSTRUCTION_MAJOR else minor_branch
+            if USE_PULL_REQUEST:
+                if _is_branch_on_remote(verbose, new_branch):
+                    _standard_output(
+                        'Branch {branch} exists on remote. Creating local tracking branch.',
+                        branch=new_branch,
+                    )
+                    created = _create_local_tracking_branch(verbose, new_branch)
+                    if not created:
+                        raise ReleaseFailure(
+                            'Could not create local tracking branch {branch}.\n'
+                            'Does a local branch named {branch} already exists?\n'
+                            'Delete or rename your local branch {branch} and try again.'.format(branch=new_branch),
+                        )
+                else:
+                    _standard_output(
+                        'Branch {branch} does not exist on remote.\n'
+                        'Creating branch, and pushing to remote.',
+                        branch=new_branch,
+                    )
+                    _create_branch_from_tag(verbose, branch_version, new_branch)
+                    _push_branch(verbose, new_branch)
 
-        if USE_PULL_REQUEST:
-            if _is_branch_on_remote(verbose, new_branch):
-                _standard_output(
-                    'Branch {branch} exists on remote. Creating local tracking branch.',
-                    branch=new_branch,
+                cherry_pick_branch_suffix = _prompt(
+                    'Now we will create the branch where you will apply your fixes. We\n'
+                    'need a name to uniquely idenfity your feature branch. I suggest using\n'
+                    'the JIRA ticket id, e.g. EB-120106, of the issue you are working on:'
                 )
-                created = _create_local_tracking_branch(verbose, new_branch)
-                if not created:
-                    raise ReleaseFailure(
-                        'Could not create local tracking branch {branch}.\n'
-                        'Does a local branch named {branch} already exists?\n'
-                        'Delete or rename your local branch {branch} and try again.'.format(branch=new_branch),
+                if not cherry_pick_branch_suffix:
+                    raise ReleaseFailure('You must enter a name to identify your feature branch.')
+                _create_branch(
+                    verbose,
+                    'cherry-pick-{hotfix_branch_name}-{suffix}'.format(
+                        hotfix_branch_name=new_branch,
+                        suffix=cherry_pick_branch_suffix,
                     )
-            else:
-                _standard_output(
-                    'Branch {branch} does not exist on remote.\n'
-                    'Creating branch, and pushing to remote.',
-                    branch=new_branch,
                 )
+            else:
                 _create_branch_from_tag(verbose, branch_version, new_branch)
-                _push_branch(verbose, new_branch)
 
-            cherry_pick_branch_suffix = _prompt(
-                'Now we will create the branch where you will apply your fixes. We\n'
-                'need a name to uniquely idenfity your feature branch. I suggest using\n'
-                'the JIRA ticket id, e.g. EB-120106, of the issue you are working on:'
-            )
-            if not cherry_pick_branch_suffix:
-                raise ReleaseFailure('You must enter a name to identify your feature branch.')
-            _create_branch(
-                verbose,
-                'cherry-pick-{hotfix_branch_name}-{suffix}'.format(
-                    hotfix_branch_name=new_branch,
-                    suffix=cherry_pick_branch_suffix,
-                )
+                push_instruction = _prompt(
+                    'Branch {} created. Would you like to go ahead and push it to remote? (y/N):',
+                    new_branch,
+                ).lower()
+                if push_instruction and push_instruction == INSTRUCTION_YES:
+                    _push_branch(verbose, new_branch)
+
+            _end_metrics_phase('branch')
+
+            _standard_output('Branch process is complete.')
+        except ReleaseFailure as e:
+            _set_metrics_result(METRICS_RESULT_FAILURE)
+            _error_output(e.args[0])
+        except subprocess.CalledProcessError as e:
+            _set_metrics_result(METRICS_RESULT_ERROR)
+            _error_output(
+                'Command {command} failed with error code {error_code}. Command output:\n{output}',
+                command=e.cmd,
+                error_code=e.returncode,
+                output=e.output.decode('utf8'),
             )
-        else:
-            _create_branch_from_tag(verbose, branch_version, new_branch)
-
-            push_instruction = _prompt(
-                'Branch {} created. Would you like to go ahead and push it to remote? (y/N):',
-                new_branch,
-            ).lower()
-            if push_instruction and push_instruction == INSTRUCTION_YES:
-                _push_branch(verbose, new_branch)
-
-        _standard_output('Branch process is complete.')
-    except ReleaseFailure as e:
-        _error_output(e.args[0])
-    except subprocess.CalledProcessError as e:
-        _error_output(
-            'Command {command} failed with error code {error_code}. Command output:\n{output}',
-            command=e.cmd,
-            error_code=e.returncode,
-            output=e.output.decode('utf8'),
-        )
-    except (ReleaseExit, KeyboardInterrupt):
-        _standard_output('Canceling branch!')
-    finally:
-        _cleanup_task(verbose)
+        except (ReleaseExit, KeyboardInterrupt):
+            _set_metrics_result(METRICS_RESULT_CANCELED)
+            _standard_output('Canceling branch!')
+        finally:
+            _cleanup_task(verbose)
 
 
-@task(help={
-    'verbose': 'Specify this switch to include verbose debug information in the command output.',
-    'no-stash': 'Specify this switch to disable stashing any uncommitted changes (by default, changes that have '
-                'not been committed are stashed before the release is executed).',
-})
-def release(_, verbose=False, no_stash=False):
+def _get_release_branch(verbose):
     """
-    Increases the version, adds a changelog message, and tags a new version of this project.
+    Checks that the current branch is one that releases can be made from, prompting for confirmation on a version
+    branch. Returns a tuple of the current branch name and the version branch being released from (or `None` on
+    master), or `(None, None)` if the release should be canceled.
     """
-    _ensure_configured('release')
-
-    from invoke_release.version import __version__
-    _standard_output('Invoke Release {}', __version__)
-
-    __version__ = _import_version_or_exit()
-
-    version_regular_expression = RE_VERSION
+    release_branch = None
 
     branch_name = _get_branch_name(verbose)
     if branch_name != BRANCH_MASTER:
@@ -1266,240 +3217,838 @@ def release(_, verbose=False, no_stash=False):
                 '\nCanceling release!',
                 branch_name,
             )
-            return
+            return None, None
 
         instruction = _prompt(
             'You are currently on branch "{branch}" instead of "master." Are you sure you want to continue releasing '
             'from "{branch}?" You should only do this from version branches, and only when higher versions have been '
             'released from the parent branch. (y/N):',
             branch=branch_name,
+            answer_key='branch',
         ).lower()
 
         if instruction != INSTRUCTION_YES:
             _standard_output('Canceling release!')
-            return
-
-        version_regular_expression = re.compile(
-            r'^' + branch_name.replace('.x', r'.\d+').replace('.', r'\.') + r'([a-zA-Z\d.-]*[a-zA-Z\d]+)?$',
-        )
+            return None, None
 
-    try:
-        _pre_release(__version__)
-    except ReleaseFailure as e:
-        _error_output_exit(e.args[0])
+        release_branch = branch_name
 
-    _setup_task(no_stash, verbose)
-    try:
-        _standard_output('Releasing {}...', MODULE_DISPLAY_NAME)
-        _standard_output('Current version: {}', __version__)
+    return branch_name, release_branch
 
-        release_version = _prompt('Enter a new version (or "exit"):').lower()
-        if not release_version or release_version == INSTRUCTION_EXIT:
-            raise ReleaseExit()
 
-        if not version_regular_expression.match(release_version):
-            raise ReleaseFailure(
-                'Invalid version specified: {version}. Must match "{regex}".'.format(
-                    version=release_version,
-                    regex=version_regular_expression.pattern,
-                ),
+@task(help={
+    'verbose': 'Specify this switch to include verbose debug information in the command output.',
+    'no-stash': 'Specify this switch to disable stashing any uncommitted changes (by default, changes that have '
+                'not been committed are stashed before the release is executed).',
+    'worktree': 'Specify this switch to perform the release in a temporary Git worktree instead of stashing, so that '
+                'uncommitted changes in your checkout are never touched (implies --no-stash).',
+    'sparse-worktree': 'Same as --worktree, but the temporary worktree contains only the version, changelog, and '
+                       'plugin files.',
+    'partial-stash': 'Specify this switch to stash only the changes to the files the release modifies, leaving other '
+                     'unstaged changes in place (where plugin hooks will see them) while the release runs. Has no '
+                     'effect when anything is staged, or for projects that release with pull requests.',
+    'release-version': 'The new version to release, instead of prompting for it.',
+    'changelog': 'The changelog message for the release, instead of prompting for it (added before any built-up '
+                 'changelog details).',
+    'yes': 'Specify this switch to answer all remaining prompts non-interactively: continue releasing from a version '
+           'branch, accept built-up changelog details (or gather commit messages) without opening an editor, '
+           'commit, do not sign the tag, and push.',
+    'resume': 'Specify this switch to continue an interrupted release (for example, one whose push failed) from the '
+              'last phase it completed, without prompting again for the version and changelog.',
+    'output': OUTPUT_HELP,
+    'profile': PROFILE_HELP,
+    'profile-memory': PROFILE_MEMORY_HELP,
+})
+def release(_, verbose=False, no_stash=False, worktree=False, sparse_worktree=False, partial_stash=False,
+            release_version=None, changelog=None, yes=False, resume=False, output=None, profile=None, profile_memory=0):
+    """
+    Increases the version, adds a changelog message, and tags a new version of this project.
+    """
+    with _finishing_task():
+        _ensure_configured('release', output, profile, profile_memory)
+
+        if resume and (release_version or changelog):
+            _error_output_exit('--resume cannot be combined with --release-version or --changelog.')
+
+        __AUTOMATIC_ANSWERS.clear()
+        if yes:
+            __AUTOMATIC_ANSWERS.update(
+                branch=INSTRUCTION_YES,
+                changelog_existing=INSTRUCTION_ACCEPT,
+                changelog_enter=INSTRUCTION_YES,
+                changelog_gather=INSTRUCTION_YES,
+                commit=INSTRUCTION_YES,
+                sign=INSTRUCTION_NO,
+                push=INSTRUCTION_YES,
             )
+        if release_version:
+            __AUTOMATIC_ANSWERS['version'] = release_version
+        if changelog:
+            __AUTOMATIC_ANSWERS['changelog_message'] = changelog
 
-        # Deconstruct and reconstruct the version, to make sure it is consistent everywhere
-        version_info = release_version.split('.', 2)
-        end_parts = list(filter(None, RE_SPLIT_AFTER_DIGITS.split(version_info[2], 1)))
-        if len(end_parts) > 1:
-            version_info[0] = int(version_info[0])
-            version_info[1] = int(version_info[1])
-            version_info[2] = int(end_parts[0])
-            version_info.append(end_parts[1].strip(' .-_'))
-        else:
-            version_info = list(map(int, version_info))
-        release_version = '-'.join(
-            filter(None, ['.'.join(map(six.text_type, version_info[:3])), (version_info[3:] or [None])[0]])
-        )  # This must match the code in VERSION_VARIABLE_TEMPLATE at the top of this file
+        from invoke_release.version import __version__
+        _standard_output('Invoke Release {}', __version__)
 
-        if not (LooseVersion(release_version) > LooseVersion(__version__)):
-            raise ReleaseFailure(
-                'New version number {new_version} is not greater than current version {old_version}.'.format(
-                    new_version=release_version,
-                    old_version=__version__,
-                ),
-            )
+        # In worktree mode, the version is read, and the pre-release checks are run, in the worktree's committed tree
+        # once it exists, so that uncommitted changes in the checkout cannot affect the release
+        in_worktree = worktree or sparse_worktree
+        if not in_worktree:
+            __version__ = _import_version_or_exit()
 
-        if _does_tag_exist_locally(release_version, verbose) or _is_tag_on_remote(release_version, verbose):
-            raise ReleaseFailure(
-                'Tag {} already exists locally or remotely (or both). Cannot create version.'.format(release_version),
+        try:
+            journal = _read_release_journal()
+        except ReleaseFailure as e:
+            _error_output_exit(e.args[0])
+
+        if resume:
+            if not journal:
+                _error_output_exit('There is no interrupted release of {} to resume.', MODULE_DISPLAY_NAME)
+            # The version file may already contain the new version, so the journal has the version being released from
+            __version__ = journal['previous_version']
+            branch_name = journal['branch_name']
+            release_branch = journal['release_branch']
+            _standard_output(
+                'Resuming the release of {module} version {version} after phase "{phase}"...',
+                module=MODULE_DISPLAY_NAME,
+                version=journal['release_version'],
+                phase=journal['phases'][-1],
             )
+        else:
+            if journal:
+                _standard_output(
+                    'Found the journal of an interrupted release of version {}, which this release will replace. (Use '
+                    '--resume to continue the interrupted release instead.)',
+                    journal['release_version'],
+                )
+            journal = {'module': MODULE_NAME, 'phases': []}
+        phases = journal['phases']
+
+        if not resume:
+            # The interrupted release already passed these checks
+            branch_name, release_branch = _get_release_branch(verbose)
+            if not branch_name:
+                _set_metrics_result(METRICS_RESULT_CANCELED)
+                return
+
+            if not in_worktree:
+                try:
+                    _pre_release(__version__)
+                except ReleaseFailure as e:
+                    _error_output_exit(e.args[0])
+
+        # The release only commits its own files, so when it does not check out other branches, unrelated unstaged
+        # changes can stay in place if asked to
+        _setup_task(no_stash, verbose, worktree, sparse_worktree, partial_stash=partial_stash and not USE_PULL_REQUEST)
+        resumable = not resume
+        try:
+            if resume:
+                _verify_release_journal(journal, verbose)
+                resumable = True
+            elif in_worktree:
+                __version__ = _import_version_or_exit()
+                _pre_release(__version__)
+
+            # Now that the checks have passed and the working tree is set up, start the slow, independent reads, so that
+            # they run while the user answers the prompts (the commit messages are not needed for a given changelog)
+            if 'version' not in phases:
+                _start_prefetch('local_tags', _get_tag_list, False)
+            if 'changelog' not in phases and 'changelog_message' not in __AUTOMATIC_ANSWERS:
+                _start_prefetch('commit_messages', _gather_commit_messages, False)
+            _start_prefetch('environment', _probe_environment, False)
+
+            _standard_output('Releasing {}...', MODULE_DISPLAY_NAME)
+            _standard_output('Current version: {}', __version__)
+
+            if 'version' in phases:
+                release_version = journal['release_version']
+                version_info = Version.parse(release_version).version_info
+            else:
+                if 'version' not in __AUTOMATIC_ANSWERS:
+                    # Contact the remote only once the user is about to be busy typing, and never when nobody is
+                    _start_prefetch('remote_tags', _get_remote_tag_list, False, False)
+                release_version = _prompt('Enter a new version (or "exit"):', answer_key='version').lower()
+                if not release_version or release_version == INSTRUCTION_EXIT:
+                    raise ReleaseExit()
+
+                try:
+                    version = Version.parse(release_version)
+                except ValueError:
+                    raise ReleaseFailure(
+                        'Invalid version specified: {version}. Must match "{regex}".'.format(
+                            version=release_version,
+                            regex=RE_VERSION.pattern,
+                        ),
+                    )
+                if release_branch and not version.is_on_branch(release_branch):
+                    raise ReleaseFailure(
+                        'Invalid version specified: {version}. Versions released from branch "{branch}" must match '
+                        'it.'.format(version=release_version, branch=release_branch),
+                    )
 
-        cl_header, cl_message, cl_footer = _prompt_for_changelog(verbose)
+                # Reconstruct the version, to make sure it is consistent everywhere
+                release_version = six.text_type(version)
+                version_info = version.version_info
 
-        instruction = _prompt('The release has not yet been committed. Are you ready to commit it? (Y/n):').lower()
-        if instruction and instruction != INSTRUCTION_YES:
-            raise ReleaseExit()
+                try:
+                    is_greater = version > Version.parse(__version__)
+                except ValueError:
+                    raise ReleaseFailure('Current version {} is not a valid version.'.format(__version__))
+                if not is_greater:
+                    raise ReleaseFailure(
+                        'New version number {new_version} is not greater than current version {old_version}.'.format(
+                            new_version=release_version,
+                            old_version=__version__,
+                        ),
+                    )
 
-        _standard_output('Releasing {module} version: {version}', module=MODULE_DISPLAY_NAME, version=release_version)
+                if (
+                    release_version in _get_prefetched('local_tags', _get_tag_list, verbose) or
+                    release_version in _get_prefetched('remote_tags', _get_remote_tag_list, verbose)
+                ):
+                    raise ReleaseFailure(
+                        'Tag {} already exists locally or remotely (or both). Cannot create version.'.format(
+                            release_version,
+                        ),
+                    )
 
-        _write_to_version_file(release_version, version_info, verbose)
-        _write_to_changelog_file(release_version, cl_header, cl_message, cl_footer, verbose)
+                _record_release_phase(
+                    journal,
+                    'version',
+                    verbose,
+                    release_version=release_version,
+                    previous_version=__version__,
+                    branch_name=branch_name,
+                    release_branch=release_branch,
+                )
+            _end_metrics_phase('version')
 
-        _pre_commit(__version__, release_version)
+            if 'changelog' in phases:
+                cl_header, cl_message, cl_footer = journal['changelog']
+            else:
+                cl_header, cl_message, cl_footer = _prompt_for_changelog(verbose)
+                _record_release_phase(journal, 'changelog', verbose, changelog=[cl_header, cl_message, cl_footer])
+            _end_metrics_phase('changelog')
 
-        if USE_PULL_REQUEST:
-            current_branch_name = _get_branch_name(verbose)
-            branch_name = 'invoke-release-{}-{}'.format(current_branch_name, release_version)
-            _create_branch(verbose, branch_name)
-        _commit_release_changes(release_version, cl_message, verbose)
+            if 'commit' in phases:
+                branch_name = journal['commit_branch']
+            else:
+                instruction = _prompt(
+                    'The release has not yet been committed. Are you ready to commit it? (Y/n):',
+                    answer_key='commit',
+                ).lower()
+                if instruction and instruction != INSTRUCTION_YES:
+                    raise ReleaseExit()
 
-        _pre_push(__version__, release_version)
+                _standard_output(
+                    'Releasing {module} version: {version}',
+                    module=MODULE_DISPLAY_NAME,
+                    version=release_version,
+                )
 
-        if USE_TAG:
-            _tag_branch(release_version, cl_message, verbose)
-        pushed_or_rolled_back = _push_release_changes(release_version, branch_name, verbose)
+                _write_to_version_file(release_version, version_info, verbose)
+                _write_to_changelog_file(release_version, cl_header, cl_message, cl_footer, verbose)
+
+                _pre_commit(__version__, release_version)
+                _end_metrics_phase('write')
+
+                if USE_PULL_REQUEST:
+                    current_branch_name = _get_branch_name(verbose)
+                    branch_name = 'invoke-release-{}-{}'.format(current_branch_name, release_version)
+                    _create_branch(verbose, branch_name)
+                _commit_release_changes(release_version, cl_message, verbose)
+                _record_release_phase(journal, 'commit', verbose, commit_branch=branch_name)
+            _end_metrics_phase('commit')
+
+            if 'tag' not in phases:
+                _pre_push(__version__, release_version)
+
+                if USE_TAG:
+                    _tag_branch(release_version, cl_message, verbose)
+                _record_release_phase(
+                    journal,
+                    'tag',
+                    verbose,
+                    tag=_get_local_tag_object(release_version) if USE_TAG else None,
+                )
+            _end_metrics_phase('tag')
 
-        if USE_PULL_REQUEST:
-            _checkout_branch(verbose, BRANCH_MASTER)
+            if 'push' in phases:
+                pushed_or_rolled_back = journal['push_result']
+            else:
+                pushed_or_rolled_back = _push_release_changes(release_version, branch_name, verbose)
 
-        _post_release(__version__, release_version, pushed_or_rolled_back)
+                if USE_PULL_REQUEST:
+                    _checkout_branch(verbose, BRANCH_MASTER)
 
-        if USE_PULL_REQUEST:
-            _standard_output("You're almost done! The release process will be complete when you create "
-                             "a pull request and it is merged.")
-        else:
-            _standard_output('Release process is complete.')
-    except ReleaseFailure as e:
-        _error_output(e.args[0])
-    except subprocess.CalledProcessError as e:
-        _error_output(
-            'Command {command} failed with error code {error_code}. Command output:\n{output}',
-            command=e.cmd,
-            error_code=e.returncode,
-            output=e.output.decode('utf8'),
-        )
-    except (ReleaseExit, KeyboardInterrupt):
-        _standard_output('Canceling release!')
-    finally:
-        _cleanup_task(verbose)
+                if pushed_or_rolled_back == PUSH_RESULT_ROLLBACK:
+                    _delete_release_journal(verbose)
+                else:
+                    _record_release_phase(journal, 'push', verbose, push_result=pushed_or_rolled_back)
+            _end_metrics_phase('push')
+
+            _post_release(__version__, release_version, pushed_or_rolled_back)
+            _delete_release_journal(verbose)
+            _end_metrics_phase('post_release')
+
+            if MAINTAIN_REPOSITORY:
+                _maintain_repository(verbose)
+                _end_metrics_phase('maintenance')
+
+            if USE_PULL_REQUEST:
+                _standard_output("You're almost done! The release process will be complete when you create "
+                                 "a pull request and it is merged.")
+            else:
+                _standard_output('Release process is complete.')
+        except ReleaseFailure as e:
+            _set_metrics_result(METRICS_RESULT_FAILURE)
+            _error_output(e.args[0])
+        except subprocess.CalledProcessError as e:
+            _set_metrics_result(METRICS_RESULT_ERROR)
+            _error_output(
+                'Command {command} failed with error code {error_code}. Command output:\n{output}',
+                command=e.cmd,
+                error_code=e.returncode,
+                output=e.output.decode('utf8'),
+            )
+        except (ReleaseExit, KeyboardInterrupt):
+            _set_metrics_result(METRICS_RESULT_CANCELED)
+            _standard_output('Canceling release!')
+        finally:
+            if resumable and phases and os.path.isfile(_get_release_journal_filename()):
+                _standard_output(
+                    'The release stopped after phase "{}". Run `invoke release --resume` to continue it from there.',
+                    phases[-1],
+                )
+            _cleanup_task(verbose)
 
 
 @task(help={
     'verbose': 'Specify this switch to include verbose debug information in the command output.',
     'no-stash': 'Specify this switch to disable stashing any uncommitted changes (by default, changes that have '
                 'not been committed are stashed before the release is rolled back).',
+    'output': OUTPUT_HELP,
+    'profile': PROFILE_HELP,
+    'profile-memory': PROFILE_MEMORY_HELP,
 })
-def rollback_release(_, verbose=False, no_stash=False):
+def rollback_release(_, verbose=False, no_stash=False, output=None, profile=None, profile_memory=0):
     """
     If the last commit is the commit for the current release, this command deletes the release tag and deletes
     (if local only) or reverts (if remote) the last commit. This is fairly safe to do if the release has not
     yet been pushed to remote, but extreme caution should be exercised when invoking this after the release has
     been pushed to remote.
     """
-    _ensure_configured('rollback-release')
+    with _finishing_task():
+        _ensure_configured('rollback-release', output, profile, profile_memory)
 
-    from invoke_release.version import __version__
-    _standard_output('Invoke Release {}', __version__)
+        from invoke_release.version import __version__
+        _standard_output('Invoke Release {}', __version__)
 
-    __version__ = _import_version_or_exit()
+        __version__ = _import_version_or_exit()
 
-    branch_name = _get_branch_name(verbose)
-    if branch_name != BRANCH_MASTER:
-        instruction = _prompt(
-            'You are currently on branch "{branch}" instead of "master." Rolling back on a branch other than master '
-            'can be dangerous.\nAre you sure you want to continue rolling back on "{branch}?" (y/N):',
-            branch=branch_name,
-        ).lower()
+        branch_name = _get_branch_name(verbose)
+        if branch_name != BRANCH_MASTER:
+            instruction = _prompt(
+                'You are currently on branch "{branch}" instead of "master." Rolling back on a branch other than '
+                'master can be dangerous.\nAre you sure you want to continue rolling back on "{branch}?" (y/N):',
+                branch=branch_name,
+            ).lower()
 
-        if instruction != INSTRUCTION_YES:
-            _standard_output('Canceling release rollback!')
-            return
+            if instruction != INSTRUCTION_YES:
+                _set_metrics_result(METRICS_RESULT_CANCELED)
+                _standard_output('Canceling release rollback!')
+                return
 
-    try:
-        _pre_rollback(__version__)
-    except ReleaseFailure as e:
-        _error_output_exit(e.args[0])
+        try:
+            _pre_rollback(__version__)
+        except ReleaseFailure as e:
+            _error_output_exit(e.args[0])
 
-    _setup_task(no_stash, verbose)
-    try:
-        commit_hash = _get_last_commit_hash(verbose)
-        message = _get_commit_subject(commit_hash, verbose)
-        if message.rstrip('.') != RELEASE_MESSAGE_TEMPLATE.format(__version__):
-            raise ReleaseFailure('Cannot roll back because last commit is not the release commit.')
-
-        on_remote = _get_remote_branches_with_commit(commit_hash, verbose)
-        is_on_remote = False
-        if len(on_remote) == 1:
-            is_on_remote = on_remote[0] == 'origin/{}'.format(branch_name)
-        elif len(on_remote) > 1:
-            raise ReleaseFailure(
-                'Cannot roll back because release commit is on multiple remote branches: {}'.format(on_remote),
-            )
+        _setup_task(no_stash, verbose)
+        try:
+            commit_hash = _get_last_commit_hash(verbose)
+            message = _get_commit_subject(commit_hash, verbose)
+            if message.rstrip('.') != RELEASE_MESSAGE_TEMPLATE.format(__version__):
+                raise ReleaseFailure('Cannot roll back because last commit is not the release commit.')
+
+            on_remote = _get_remote_branches_with_commit(commit_hash, verbose)
+            is_on_remote = False
+            if len(on_remote) == 1:
+                is_on_remote = on_remote[0] == '{}/{}'.format(_get_primary_remote(), branch_name)
+            elif len(on_remote) > 1:
+                raise ReleaseFailure(
+                    'Cannot roll back because release commit is on multiple remote branches: {}'.format(on_remote),
+                )
 
-        _standard_output('Release tag {} will be deleted locally and remotely (if applicable).', __version__)
-        delete = _prompt('Do you want to proceed with deleting this tag? (y/N):').lower()
-        if delete == INSTRUCTION_YES:
-            if _does_tag_exist_locally(__version__, verbose):
-                _delete_local_tag(__version__, verbose)
+            _end_metrics_phase('inspect')
 
-            if _is_tag_on_remote(__version__, verbose):
-                _delete_remote_tag(__version__, verbose)
+            _standard_output('Release tag {} will be deleted locally and remotely (if applicable).', __version__)
+            delete = _prompt('Do you want to proceed with deleting this tag? (y/N):').lower()
+            if delete == INSTRUCTION_YES:
+                if _does_tag_exist_locally(__version__, verbose):
+                    _delete_local_tag(__version__, verbose)
 
-            _standard_output('The release tag has been deleted from local and remote (if applicable).')
+                _delete_remote_tag(__version__, verbose)
 
-            if is_on_remote:
-                _standard_output('The release commit is present on the remote origin.')
-                prompt = 'Do you want to revert the commit and immediately push it to the remote origin? (y/N):'
-            else:
-                _standard_output('The release commit is only present locally, not on the remote origin.')
-                prompt = 'Are you ready to delete the commit like it never happened? (y/N):'
+                _standard_output('The release tag has been deleted from local and remote (if applicable).')
 
-            revert = _prompt(prompt).lower()
-            if revert == INSTRUCTION_YES:
                 if is_on_remote:
-                    _revert_remote_commit(__version__, commit_hash, branch_name, verbose)
+                    _standard_output('The release commit is present on the remote {}.', _get_primary_remote())
+                    prompt = 'Do you want to revert the commit and immediately push it to the {}? (y/N):'
                 else:
-                    _delete_last_commit(verbose)
-            else:
-                _standard_output('The commit was not reverted.')
+                    _standard_output(
+                        'The release commit is only present locally, not on the remote {}.',
+                        _get_primary_remote(),
+                    )
+                    prompt = 'Are you ready to delete the commit like it never happened? (y/N):'
+
+                revert = _prompt(prompt, _describe_remotes()).lower()
+                if revert == INSTRUCTION_YES:
+                    if is_on_remote:
+                        _revert_remote_commit(__version__, commit_hash, branch_name, verbose)
+                    else:
+                        _delete_last_commit(verbose)
+                else:
+                    _standard_output('The commit was not reverted.')
 
-            version_module = __import__('{}.version'.format(MODULE_NAME), fromlist=[str('__version__')])
-            # noinspection PyCompatibility
-            moves.reload_module(version_module)
-            _post_rollback(__version__, version_module.__version__)
+                version_module = __import__('{}.version'.format(MODULE_NAME), fromlist=[str('__version__')])
+                # noinspection PyCompatibility
+                moves.reload_module(version_module)
+                _post_rollback(__version__, version_module.__version__)
+                _end_metrics_phase('rollback')
 
-            _standard_output('Release rollback is complete.')
-        else:
-            raise ReleaseExit()
-    except ReleaseFailure as e:
-        _error_output(e.args[0])
-    except subprocess.CalledProcessError as e:
-        _error_output(
-            'Command {command} failed with error code {error_code}. Command output:\n{output}',
-            command=e.cmd,
-            error_code=e.returncode,
-            output=e.output.decode('utf8'),
-        )
-    except (ReleaseExit, KeyboardInterrupt):
-        _standard_output('Canceling release rollback!')
-    finally:
-        _cleanup_task(verbose)
+                _delete_release_journal(verbose)
+                _standard_output('Release rollback is complete.')
+            else:
+                raise ReleaseExit()
+        except ReleaseFailure as e:
+            _set_metrics_result(METRICS_RESULT_FAILURE)
+            _error_output(e.args[0])
+        except subprocess.CalledProcessError as e:
+            _set_metrics_result(METRICS_RESULT_ERROR)
+            _error_output(
+                'Command {command} failed with error code {error_code}. Command output:\n{output}',
+                command=e.cmd,
+                error_code=e.returncode,
+                output=e.output.decode('utf8'),
+            )
+        except (ReleaseExit, KeyboardInterrupt):
+            _set_metrics_result(METRICS_RESULT_CANCELED)
+            _standard_output('Canceling release rollback!')
+        finally:
+            _cleanup_task(verbose)
 
 
-@task
-def wheel(_):
+@task(help={
+    'profile': PROFILE_HELP,
+    'profile-memory': PROFILE_MEMORY_HELP,
+})
+def wheel(_, profile=None, profile_memory=0):
     """
-    Builds a wheel archive of all files in the Git root directory.
-
-    Future possible changes: Upload to the wheel server.
+    Builds a wheel archive of all files in the Git root directory. Use `publish` to add it to a package index.
     """
+    _resolve_configuration()
+    with _finishing_task():
+        _start_profile(profile, profile_memory)
+        _start_metrics('wheel')
+        _build_wheel()
+
+
+def _build_wheel():
     build_instruction = _prompt('Build a wheel archive of {}? (Y/n):'.format(MODULE_DISPLAY_NAME)).lower()
 
     if build_instruction == INSTRUCTION_NO:
+        _set_metrics_result(METRICS_RESULT_CANCELED)
         _standard_output('Aborting!')
         return
 
+    # Importing `wheel` imports `setuptools`, which takes longer than importing everything else here put together
+    from wheel import archive
+
     base_dir = _get_root_directory()
     archive_name = archive.make_wheelfile_inner(MODULE_NAME, _get_root_directory())
+    _end_metrics_phase('build')
+
     _standard_output('Successfully built the wheel archive {archive_name} at {base_dir}'.format(
         archive_name=archive_name,
         base_dir=base_dir
     ))
+
+
+def _get_project_name(artifact_name):
+    """
+    Returns the PEP 503 normalized project name of a wheel or source distribution file name.
+    """
+    if artifact_name.endswith('.whl'):
+        name = artifact_name.split('-', 1)[0]
+    else:
+        name = artifact_name.rsplit('-', 1)[0]
+    return RE_PROJECT_NAME_SEPARATORS.sub('-', name).lower()
+
+
+def _copy_artifact(source_name, destination_name):
+    """
+    Copies the artifact into the index, computing its SHA-256 hash while it is copied so that it is read only once,
+    and returns the hash, or `None` if the destination already exists. The copy is written to a temporary file and
+    then hard-linked into place, so that readers never see a partial file and an existing file is never replaced.
+    """
+    directory = os.path.dirname(destination_name)
+    digest = hashlib.sha256()
+    descriptor, temporary_name = tempfile.mkstemp(prefix='.publish-', dir=directory)
+    try:
+        with open(source_name, 'rb') as source, os.fdopen(descriptor, 'wb') as destination:
+            for chunk in iter(lambda: source.read(1024 * 1024), b''):
+                digest.update(chunk)
+                destination.write(chunk)
+            destination.flush()
+            os.fsync(destination.fileno())
+        os.chmod(temporary_name, 0o644)
+        try:
+            os.link(temporary_name, destination_name)
+        except OSError:
+            if os.path.exists(destination_name):
+                return None
+            raise
+    finally:
+        os.unlink(temporary_name)
+    return digest.hexdigest()
+
+
+def _append_index_link(page_name, title, href, text):
+    """
+    Adds a link to an index page by overwriting just its closing tags with the new link and the closing tags, so that
+    adding a link costs the same however many links the page already has. Creates the page if it does not exist.
+    """
+    line = '    <a href="{href}">{text}</a><br>\n'.format(href=href, text=text)
+    if not os.path.exists(page_name):
+        _write_file_atomically(page_name, INDEX_PAGE_HEADER_TEMPLATE.format(title=title) + line + INDEX_PAGE_FOOTER)
+        return
+
+    footer = INDEX_PAGE_FOOTER.encode('utf8')
+    with open(page_name, 'r+b') as page:
+        page.seek(0, os.SEEK_END)
+        if page.tell() < len(footer):
+            raise ReleaseFailure('Index page {} is not a page written by `invoke publish`.'.format(page_name))
+        page.seek(-len(footer), os.SEEK_END)
+        if page.read() != footer:
+            raise ReleaseFailure('Index page {} is not a page written by `invoke publish`.'.format(page_name))
+        page.seek(-len(footer), os.SEEK_END)
+        page.write(line.encode('utf8') + footer)
+
+
+def _get_file_sha256(file_name):
+    digest = hashlib.sha256()
+    with open(file_name, 'rb') as file_read:
+        for chunk in iter(lambda: file_read.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _index_page_links_to(page_name, href_prefix):
+    """
+    Returns whether the index page exists and has a link whose target starts with the given prefix.
+    """
+    try:
+        with codecs.open(page_name, 'rb', encoding='utf8') as page_read:
+            return '<a href="{}'.format(href_prefix) in page_read.read()
+    except (IOError, OSError):
+        return False
+
+
+def _publish_artifact(index_directory, artifact_name, verbose):
+    """
+    Publishes one artifact to the index directory. Only the artifact's project page is updated (and the root index,
+    if this is the project's first artifact), so the time this takes does not depend on the size of the index. The
+    artifact is copied before it is listed, so a publisher interrupted in between leaves an artifact that is not listed
+    yet; the next publish of that artifact finds it unlisted and lists it.
+
+    :return: Whether the artifact was published (`False` if it had been published before).
+    """
+    file_name = os.path.basename(artifact_name)
+    project = _get_project_name(file_name)
+    project_directory = os.path.join(index_directory, project)
+    page_name = os.path.join(project_directory, 'index.html')
+
+    if not os.path.isdir(project_directory):
+        try:
+            os.mkdir(project_directory)
+        except OSError:
+            if not os.path.isdir(project_directory):
+                raise
+
+    destination_name = os.path.join(project_directory, file_name)
+    with _metrics_timer('phases', 'copy'):
+        sha256 = _copy_artifact(artifact_name, destination_name)
+    if sha256:
+        _verbose_output(verbose, 'Copied {} with SHA-256 {}.', file_name, sha256)
+    elif _index_page_links_to(page_name, '{}#'.format(file_name)):
+        _standard_output('{} was already published. Skipping.', file_name)
+        return False
+    else:
+        # Only reading the page in this case keeps the usual publish independent of the size of the page
+        _standard_output('{} was copied before, but not listed. Listing it now.', file_name)
+        sha256 = _get_file_sha256(destination_name)
+
+    if not os.path.exists(page_name):
+        # The project's first artifact. The project is listed before its page is created, so that whenever the page
+        # exists, the project is listed, and an interrupted publish can be resumed by checking just this.
+        root_page_name = os.path.join(index_directory, 'index.html')
+        if not _index_page_links_to(root_page_name, '{}/"'.format(project)):
+            _append_index_link(root_page_name, 'Simple Index', '{}/'.format(project), project)
+
+    _append_index_link(
+        page_name,
+        'Links for {}'.format(project),
+        '{}#sha256={}'.format(file_name, sha256),
+        file_name,
+    )
+
+    _standard_output('Published {file} to {project}.', file=file_name, project=project_directory)
+    return True
+
+
+@task(help={
+    'verbose': 'Specify this switch to include verbose debug information in the command output.',
+    'index-directory': 'The PEP 503 "simple" index directory to publish to (defaults to the configured '
+                       '`index_directory`).',
+    'artifacts': 'A glob pattern, relative to the project root directory, of the wheels and source distributions to '
+                 'publish (default: dist/*).',
+})
+def publish(_, verbose=False, index_directory=None, artifacts='dist/*'):
+    """
+    Publishes built wheels and source distributions to a local (or network-mounted) PEP 503 package index directory.
+    """
+    with _finishing_task():
+        _ensure_configured('publish')
+
+        index_directory = index_directory or INDEX_DIRECTORY
+        if not index_directory:
+            _error_output_exit('No index directory. Use --index-directory or configure `index_directory`.')
+        index_directory = os.path.join(ROOT_DIRECTORY, index_directory)
+
+        artifact_names = sorted(
+            name for name in glob.glob(os.path.join(ROOT_DIRECTORY, artifacts))
+            if name.endswith(('.whl', '.tar.gz', '.zip'))
+        )
+        if not artifact_names:
+            _error_output_exit('No wheels or source distributions match {}.', artifacts)
+
+        if not os.path.isdir(index_directory):
+            os.makedirs(index_directory)
+
+        # Serialize publishers, because they append to the same pages
+        with open(os.path.join(index_directory, '.publish-lock'), 'a') as lock:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            _end_metrics_phase('lock')
+            try:
+                for artifact_name in artifact_names:
+                    _publish_artifact(index_directory, artifact_name, verbose)
+                _end_metrics_phase('publish')
+            except (ReleaseFailure, IOError, OSError) as e:
+                _set_metrics_result(METRICS_RESULT_FAILURE)
+                _error_output('{}', e.args[0] if isinstance(e, ReleaseFailure) else e)
+
+
+def _get_release_tag_objects():
+    """
+    Returns a list of (tag name, object name, object type) for the local tags named like release versions. The object
+    type is "tag" for annotated tags and "commit" for lightweight tags.
+    """
+    result = _check_output(
+        ['git', 'for-each-ref', '--format=%(refname:strip=2) %(objectname) %(objecttype)', 'refs/tags'],
+        stderr=sys.stderr,
+    ).decode('utf8')
+    return [
+        tuple(line.split(' ')) for line in result.splitlines()
+        if line and RE_VERSION.match(line.split(' ', 1)[0])
+    ]
+
+
+def _verify_tag_signature(git, object_name, object_type):
+    """
+    Verifies the signature of a tag object and returns one of the `TAG_SIGNATURE_*` results.
+    """
+    if object_type != 'tag':
+        return TAG_SIGNATURE_UNSIGNED  # A lightweight tag cannot be signed
+
+    try:
+        _check_output(git + ['verify-tag', '--raw', object_name], stderr=subprocess.STDOUT)
+        return TAG_SIGNATURE_GOOD
+    except subprocess.CalledProcessError as e:
+        output = e.output.decode('utf8', 'replace')
+
+    if 'no signature found' in output:
+        return TAG_SIGNATURE_UNSIGNED
+    statuses = set(line.split()[1] for line in output.splitlines() if line.startswith('[GNUPG:] ') and line.split()[1:])
+    for status, result in GPG_STATUS_RESULTS:
+        if status in statuses:
+            return result if result != TAG_SIGNATURE_GOOD else TAG_SIGNATURE_BAD  # Good signature, but failed anyway
+    return TAG_SIGNATURE_BAD
+
+
+@task(help={
+    'verbose': 'Specify this switch to include verbose debug information in the command output.',
+    'jobs': 'The number of tags to verify at once (default: the number of CPUs).',
+    'no-cache': 'Specify this switch to verify every tag again, instead of skipping tags whose signatures were '
+                'already verified.',
+    'output': OUTPUT_HELP,
+})
+def verify_tags(_, verbose=False, jobs=0, no_cache=False, output=None):
+    """
+    Verifies the signatures of all release tags and reports the unsigned tags, the tags with bad signatures, and the
+    tags signed with unknown keys.
+    """
+    with _finishing_task():
+        _ensure_configured('verify-tags', output)
+
+        environment = _probe_environment(verbose)
+        # Configure the GPG program for just these commands instead of changing the user's global Git config
+        git = ['git', '-c', 'gpg.program={}'.format(environment['gpg'])] if environment['gpg'] else ['git']
+
+        tags = _get_release_tag_objects()
+        _end_metrics_phase('list')
+
+        # Tag objects never change, so a verified result (except an unknown key, which may since have been imported)
+        # stays valid for as long as the tag points to the same object, in whatever repository it is found
+        cache_file = os.path.join(_get_cache_directory(), 'verified-tags.json')
+        cache = {} if no_cache else _read_cache_file(cache_file) or {}
+        pending = [tag for tag in tags if tag[1] not in cache]
+        _verbose_output(verbose, 'Verifying {} of {} release tags ({} cached)...', len(pending), len(tags),
+                        len(tags) - len(pending))
+
+        if pending:
+            import multiprocessing.pool
+            pool = multiprocessing.pool.ThreadPool(jobs or multiprocessing.cpu_count())
+            try:
+                results = pool.map(
+                    lambda tag: _verify_tag_signature(git, tag[1], tag[2]),
+                    pending,
+                )
+            finally:
+                pool.close()
+                pool.join()
+            for (__, object_name, __), result in zip(pending, results):
+                cache[object_name] = result
+            _write_cache_file(
+                cache_file,
+                dict((key, value) for key, value in six.iteritems(cache) if value != TAG_SIGNATURE_UNKNOWN_KEY),
+            )
+        _end_metrics_phase('verify')
+
+        problems = {}
+        for name, object_name, __ in tags:
+            if cache[object_name] != TAG_SIGNATURE_GOOD:
+                problems.setdefault(cache[object_name], []).append(name)
+
+        _standard_output(
+            'Verified {total} release tags: {good} with good signatures.',
+            total=len(tags),
+            good=len(tags) - sum(len(names) for names in problems.values()),
+        )
+        for result in (TAG_SIGNATURE_UNSIGNED, TAG_SIGNATURE_BAD, TAG_SIGNATURE_UNKNOWN_KEY):
+            if result in problems:
+                names = sorted(problems[result], key=Version.parse)
+                _error_output('{result} ({count}): {names}', result=result.capitalize(), count=len(names),
+                              names=', '.join(names))
+        if problems:
+            sys.exit(1)  # Recorded as a failure
+
+
+def _read_metrics_durations(filename):
+    """
+    Reads the metrics file one record at a time and returns a dict mapping (module, task, phase) to a
+    `DurationHistogram` of its durations. Plugin hook timings are included as phases named "plugin:<Class>.<hook>" and
+    total task durations as the phase "total".
+    """
+    durations = {}
+
+    def add(key, duration):
+        if key not in durations:
+            durations[key] = DurationHistogram()
+        durations[key].add(duration)
+
+    with codecs.open(filename, 'rb', encoding='utf8') as metrics_read:
+        for line in metrics_read:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # Tolerate a truncated last line from a run that was killed while writing
+            key = (record.get('module', 'unknown'), record.get('task', 'unknown'))
+            add(key + ('total', ), record.get('duration', 0.0))
+            for phase, duration in six.iteritems(record.get('phases', {})):
+                add(key + (phase, ), duration)
+            for hook, duration in six.iteritems(record.get('plugins', {})):
+                add(key + ('plugin:{}'.format(hook), ), duration)
+    return durations
+
+
+def _format_prometheus_metrics(statistics):
+    lines = [
+        '# HELP invoke_release_phase_duration_seconds Duration of each Invoke Release task phase.',
+        '# TYPE invoke_release_phase_duration_seconds summary',
+    ]
+    maximum_lines = [
+        '# HELP invoke_release_phase_duration_seconds_max Longest recorded duration of each Invoke Release task phase.',
+        '# TYPE invoke_release_phase_duration_seconds_max gauge',
+    ]
+    for (module, task_name, phase), histogram in statistics:
+        labels = 'module="{}",task="{}",phase="{}"'.format(
+            *(label.replace('\\', '\\\\').replace('"', '\\"') for label in (module, task_name, phase))
+        )
+        for quantile in ('0.5', '0.95'):
+            lines.append('invoke_release_phase_duration_seconds{{{labels},quantile="{quantile}"}} {value}'.format(
+                labels=labels,
+                quantile=quantile,
+                value=histogram.percentile(float(quantile)),
+            ))
+        lines.append('invoke_release_phase_duration_seconds_sum{{{}}} {}'.format(labels, histogram.total))
+        lines.append('invoke_release_phase_duration_seconds_count{{{}}} {}'.format(labels, histogram.count))
+        maximum_lines.append('invoke_release_phase_duration_seconds_max{{{}}} {}'.format(labels, histogram.maximum))
+    return '\n'.join(lines + maximum_lines) + '\n'
+
+
+@task(help={
+    'metrics-file': 'The metrics file to read (defaults to $INVOKE_RELEASE_METRICS_FILE or the configured metrics '
+                    'file).',
+    'prometheus-file': 'Instead of printing a table, write the statistics to this file in the Prometheus textfile '
+                       'collector format.',
+})
+def release_stats(_, metrics_file=None, prometheus_file=None):
+    """
+    Summarizes the release metrics log into p50, p95, and max durations per module, task, and phase.
+    """
+    _resolve_configuration()
+    filename = metrics_file or _get_metrics_filename()
+    if not filename:
+        _error_output_exit(
+            'No metrics file is configured. Pass `metrics_file` to `configure_release_parameters`, set ${}, or use '
+            '--metrics-file.',
+            METRICS_FILE_ENVIRONMENT_VARIABLE,
+        )
+    if not os.path.isfile(filename):
+        _error_output_exit('Metrics file {} does not exist.', filename)
+
+    statistics = sorted(six.iteritems(_read_metrics_durations(filename)))
+
+    if prometheus_file:
+        _write_file_atomically(prometheus_file, _format_prometheus_metrics(statistics))
+        _standard_output('Wrote Prometheus metrics for {} phases to {}.', len(statistics), prometheus_file)
+        return
+
+    row = '{{:<{module}}}  {{:<{task}}}  {{:<{phase}}}  {{:>6}} {{:>10}} {{:>10}} {{:>10}}'.format(
+        module=max([len('Module')] + [len(key[0]) for key, histogram in statistics]),
+        task=max([len('Task')] + [len(key[1]) for key, histogram in statistics]),
+        phase=max([len('Phase')] + [len(key[2]) for key, histogram in statistics]),
+    )
+    _standard_output(row, 'Module', 'Task', 'Phase', 'Runs', 'p50', 'p95', 'Max')
+    for (module, task_name, phase), histogram in statistics:
+        _standard_output(
+            row,
+            module,
+            task_name,
+            phase,
+            histogram.count,
+            '{:.3f}s'.format(histogram.percentile(0.5)),
+            '{:.3f}s'.format(histogram.percentile(0.95)),
+            '{:.3f}s'.format(histogram.maximum),
+        )
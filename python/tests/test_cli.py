@@ -0,0 +1,131 @@
+from __future__ import absolute_import, unicode_literals
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from unittest import TestCase
+
+from invoke_release import cli
+from invoke_release.plugins import PatternReplaceVersionInFilesPlugin
+
+
+class TestCli(TestCase):
+    def setUp(self):
+        self.directory = os.path.realpath(tempfile.mkdtemp())
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _write(self, file_name, contents):
+        file_name = os.path.join(self.directory, file_name)
+        if not os.path.isdir(os.path.dirname(file_name)):
+            os.makedirs(os.path.dirname(file_name))
+        with open(file_name, 'w') as file_write:
+            file_write.write(contents)
+        return file_name
+
+    def test_read_configuration(self):
+        file_name = self._write('setup.cfg', (
+            '[metadata]\n'
+            'name = demo\n'
+            '\n'
+            '[invoke_release]\n'
+            'module_name = demo\n'
+            'display_name = Demo Project\n'
+            'python_directory = python\n'
+            'use_tag = false\n'
+            'fast_commit = yes\n'
+            'remotes = origin github\n'
+            'plugins =\n'
+            '    invoke_release.plugins:PatternReplaceVersionInFilesPlugin README.md "docs/a conf.py" discover=report\n'
+        ))
+
+        parameters = cli.read_configuration(file_name)
+
+        plugins = parameters.pop('plugins')
+        self.assertEqual(
+            {
+                'module_name': 'demo',
+                'display_name': 'Demo Project',
+                'python_directory': 'python',
+                'use_tag': False,
+                'fast_commit': True,
+                'remotes': ['origin', 'github'],
+            },
+            parameters,
+        )
+        self.assertEqual(1, len(plugins))
+        self.assertIsInstance(plugins[0], PatternReplaceVersionInFilesPlugin)
+        self.assertEqual('report', plugins[0].discover)
+        self.assertEqual(
+            [os.path.join('/root', 'README.md'), os.path.join('/root', 'docs/a conf.py')],
+            list(plugins[0].get_extra_files_to_commit('/root')),
+        )
+
+    def test_read_configuration_invalid(self):
+        for section, message in (
+            ('module_name = demo\ndisplay_name = Demo\nunknown = 1\n', 'Unknown option "unknown"'),
+            ('module_name = demo\n', 'must set "display_name"'),
+            ('module_name = demo\ndisplay_name = Demo\nuse_tag = maybe\n', 'Not a boolean'),
+        ):
+            file_name = self._write('invoke-release.cfg', '[invoke_release]\n' + section)
+            with self.assertRaises(ValueError) as context:
+                cli.read_configuration(file_name)
+            self.assertIn(message, str(context.exception))
+
+    def test_load_plugin(self):
+        plugin = cli._load_plugin('invoke_release.plugins:PatternReplaceVersionInFilesPlugin a.txt b.txt')
+        self.assertEqual(['/a.txt', '/b.txt'], list(plugin.get_extra_files_to_commit('/')))
+
+        with self.assertRaises(ValueError):
+            cli._load_plugin('invoke_release.plugins.PatternReplaceVersionInFilesPlugin')
+        with self.assertRaises(AttributeError):
+            cli._load_plugin('invoke_release.plugins:MissingPlugin')
+        with self.assertRaises(ImportError):
+            cli._load_plugin('invoke_release.missing:MissingPlugin')
+        with self.assertRaises(TypeError):
+            cli._load_plugin('invoke_release.plugins:PatternReplaceVersionInFilesPlugin unexpected=1')
+
+    def test_find_configuration_file(self):
+        os.makedirs(os.path.join(self.directory, 'project', '.git'))
+        os.makedirs(os.path.join(self.directory, 'project', 'python', 'demo'))
+        self._write('setup.cfg', '[invoke_release]\nmodule_name = outside\n')
+        setup_name = self._write('project/setup.cfg', '[metadata]\nname = demo\n')
+        self._write('project/python/setup.cfg', '[metadata]\nname = demo\n')
+
+        # Configuration files without the section are skipped, and the search stops at the Git working tree root
+        self.assertIsNone(cli.find_configuration_file(os.path.join(self.directory, 'project', 'python', 'demo')))
+
+        with open(setup_name, 'a') as setup_append:
+            setup_append.write('\n[invoke_release]\nmodule_name = demo\n')
+        self.assertEqual(setup_name, cli.find_configuration_file(os.path.join(self.directory, 'project', 'python')))
+
+        # A dedicated configuration file takes precedence over setup.cfg in the same directory
+        dedicated_name = self._write('project/invoke-release.cfg', '[invoke_release]\nmodule_name = demo\n')
+        self.assertEqual(dedicated_name, cli.find_configuration_file(os.path.join(self.directory, 'project')))
+
+    def test_main_invalid_configuration(self):
+        os.makedirs(os.path.join(self.directory, '.git'))
+        self._write('invoke-release.cfg', (
+            '[invoke_release]\n'
+            'module_name = demo\n'
+            'display_name = Demo\n'
+            'plugins =\n'
+            '    invoke_release.plugins:MissingPlugin\n'
+        ))
+
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'invoke_release.cli', 'version'],
+            cwd=self.directory,
+            env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path)),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        _, error = process.communicate()
+
+        self.assertEqual(2, process.returncode)
+        self.assertIn('ERROR: Invalid configuration in {}'.format(os.path.join(self.directory, 'invoke-release.cfg')),
+                      error.decode('utf8'))
+        self.assertIn('MissingPlugin', error.decode('utf8'))
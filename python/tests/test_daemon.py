@@ -0,0 +1,162 @@
+from __future__ import absolute_import, unicode_literals
+
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+from unittest import TestCase
+
+from invoke_release import daemon
+
+
+class TestDaemon(TestCase):
+    def setUp(self):
+        self.directory = os.path.realpath(tempfile.mkdtemp())
+        self.origin = os.path.join(self.directory, 'origin.git')
+        self.project = os.path.join(self.directory, 'project')
+        self.socket_path = os.path.join(self.directory, 'run', 'daemon.sock')
+        self.environment = dict(
+            os.environ,
+            PYTHONPATH=os.pathsep.join(sys.path),
+            XDG_CACHE_HOME=os.path.join(self.directory, 'cache'),
+            GIT_CONFIG_NOSYSTEM='1',
+        )
+        self.environment.pop('INVOKE_RELEASE_OUTPUT', None)
+        self.server = None
+
+    def tearDown(self):
+        if self.server:
+            self.server.terminate()
+            self.server.wait()
+            self.server.stdout.close()
+        shutil.rmtree(self.directory)
+
+    def _git(self, *args):
+        return subprocess.check_output(('git',) + args, cwd=self.project).decode('utf8').strip()
+
+    def _create_project(self):
+        files = {
+            'python/demo/__init__.py': '',
+            'python/demo/version.py': "__version_info__ = (1, 0, 0)\n__version__ = '1.0.0'\n",
+            'CHANGELOG.txt': 'Changelog\n=========\n\n1.0.0 (2018-01-01)\n------------------\n- Initial\n',
+            'tasks.py': (
+                'from invoke_release.tasks import *  # noqa\n'
+                'configure_release_parameters(\n'
+                '    module_name=\'demo\', display_name=\'Demo\', python_directory=\'python\',\n'
+                ')\n'
+            ),
+        }
+        for file_name, contents in files.items():
+            file_name = os.path.join(self.project, file_name)
+            if not os.path.isdir(os.path.dirname(file_name)):
+                os.makedirs(os.path.dirname(file_name))
+            with open(file_name, 'w') as file_write:
+                file_write.write(contents)
+
+        subprocess.check_call(['git', 'init', '-q', '--bare', self.origin])
+        subprocess.check_call(['git', 'init', '-q', self.project])
+        self._git('config', 'user.name', 'Release Tester')
+        self._git('config', 'user.email', 'release@example.com')
+        self._git('checkout', '-q', '-b', 'master')
+        self._git('add', '.')
+        self._git('commit', '-q', '-m', 'Initial commit')
+        self._git('remote', 'add', 'origin', self.origin)
+        self._git('push', '-q', 'origin', 'master')
+
+    def _serve(self):
+        self.server = subprocess.Popen(
+            [sys.executable, '-m', 'invoke_release.daemon', '--socket', self.socket_path, 'serve'],
+            env=self.environment,
+            stdout=subprocess.PIPE,
+        )
+        self.assertIn('listening on', self.server.stdout.readline().decode('utf8'))
+
+    def _connect(self, **request):
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect(self.socket_path)
+        channel = daemon.MessageChannel(client)
+        channel.send(repository=self.project, environment={}, **request)
+        return channel
+
+    @staticmethod
+    def _finish(channel):
+        """
+        Receives the rest of a request's messages, and returns its output and its `done` message.
+        """
+        output = []
+        while True:
+            message = channel.receive()
+            if message['event'] == daemon.EVENT_DONE:
+                channel.close()
+                return ''.join(output), message
+            if message['event'] == daemon.EVENT_OUTPUT:
+                output.append(message['data'])
+
+    def test_serve_queued_releases(self):
+        self._create_project()
+        self._serve()
+
+        # The first release waits for its version at the prompt, so the second is queued behind it
+        first = self._connect(task='release', arguments={'changelog': '- First', 'yes': True})
+        self.assertEqual(
+            {'event': daemon.EVENT_QUEUED, 'position': 0, 'repository': self.project},
+            first.receive(),
+        )
+        self.assertEqual(daemon.EVENT_STARTED, first.receive()['event'])
+        second = self._connect(
+            task='release',
+            arguments={'release_version': '1.2.0', 'changelog': '- Second', 'yes': True},
+        )
+        self.assertEqual(
+            {'event': daemon.EVENT_QUEUED, 'position': 1, 'repository': self.project},
+            second.receive(),
+        )
+
+        first.send(input='1.1.0\n')
+        first.send(eof=True)
+        first_output, first_done = self._finish(first)
+        self.assertEqual(daemon.EVENT_STARTED, second.receive()['event'])
+        second.send(eof=True)
+        second_output, second_done = self._finish(second)
+
+        self.assertEqual(daemon.RESULT_COMPLETED, first_done['result'], first_output)
+        self.assertIn('Release process is complete.', first_output)
+        self.assertEqual(daemon.RESULT_COMPLETED, second_done['result'], second_output)
+        self.assertIn('Current version: 1.1.0', second_output)
+        self.assertIn('Release process is complete.', second_output)
+        self.assertEqual(['1.1.0', '1.2.0'], self._git('tag', '--list').splitlines())
+        self.assertEqual(self._git('rev-parse', 'master'), self._git('--git-dir', self.origin, 'rev-parse', 'master'))
+
+        rejected = self._connect(task='wheel', arguments={})
+        done = rejected.receive()
+        rejected.close()
+        self.assertEqual(daemon.RESULT_ERROR, done['result'])
+        self.assertIn('Unsupported task "wheel"', done['message'])
+
+    def test_serve_refuses_second_daemon(self):
+        self._serve()
+
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'invoke_release.daemon', '--socket', self.socket_path, 'serve'],
+            env=self.environment,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        _, error = process.communicate()
+
+        self.assertEqual(1, process.returncode)
+        self.assertIn('already listening', error.decode('utf8'))
+
+    def test_parse_options(self):
+        self.assertEqual(
+            {'verbose': True, 'no_stash': False, 'profile_memory': 5, 'release_version': '1.2.0'},
+            daemon._parse_options(
+                'release',
+                ['verbose', 'no-stash=false', 'profile-memory=5', 'release-version=1.2.0'],
+            ),
+        )
+        for options in (['unknown'], ['verbose=maybe'], ['profile-memory=many'], ['release-version']):
+            with self.assertRaises(ValueError):
+                daemon._parse_options('release', options)
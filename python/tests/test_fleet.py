@@ -0,0 +1,112 @@
+from __future__ import absolute_import, unicode_literals
+
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+from unittest import TestCase
+
+from six import StringIO
+
+from invoke_release import fleet
+
+
+class TestFleet(TestCase):
+    def setUp(self):
+        self.directory = os.path.realpath(tempfile.mkdtemp())
+        self.original_cache_home = os.environ.get('XDG_CACHE_HOME')
+        os.environ['XDG_CACHE_HOME'] = os.path.join(self.directory, 'cache')
+
+    def tearDown(self):
+        if self.original_cache_home is None:
+            del os.environ['XDG_CACHE_HOME']
+        else:
+            os.environ['XDG_CACHE_HOME'] = self.original_cache_home
+        shutil.rmtree(self.directory)
+
+    def _create_project(self, name, tasks_source=None):
+        origin = os.path.join(self.directory, '{}.git'.format(name))
+        project = os.path.join(self.directory, name)
+        files = {
+            'python/{}/__init__.py'.format(name): '',
+            'python/{}/version.py'.format(name): "__version_info__ = (1, 0, 0)\n__version__ = '1.0.0'\n",
+            'CHANGELOG.txt': 'Changelog\n=========\n\n1.0.0 (2018-01-01)\n------------------\n- Initial\n',
+            'tasks.py': tasks_source or (
+                'from invoke_release.tasks import *  # noqa\n'
+                'configure_release_parameters(module_name={0!r}, display_name={0!r}, python_directory="python")\n'
+            ).format(str(name)),
+        }
+        for file_name, contents in files.items():
+            file_name = os.path.join(project, file_name)
+            if not os.path.isdir(os.path.dirname(file_name)):
+                os.makedirs(os.path.dirname(file_name))
+            with open(file_name, 'w') as file_write:
+                file_write.write(contents)
+
+        def git(*args):
+            subprocess.check_output(('git', '-c', 'user.name=Tester', '-c', 'user.email=t@example.com') + args,
+                                    cwd=project, stderr=subprocess.STDOUT)
+
+        subprocess.check_output(['git', 'init', '-q', '--bare', origin])
+        git('init', '-q')
+        git('config', 'user.name', 'Tester')
+        git('config', 'user.email', 't@example.com')
+        git('checkout', '-q', '-b', 'master')
+        git('add', '.')
+        git('commit', '-q', '-m', 'Initial commit')
+        git('remote', 'add', 'origin', origin)
+        git('push', '-q', 'origin', 'master')
+        return project
+
+    def test_read_manifest(self):
+        manifest_name = os.path.join(self.directory, 'manifest.json')
+        with open(manifest_name, 'w') as manifest_write:
+            json.dump([{'repository': 'a', 'version': '1.1.0'}], manifest_write)
+        self.assertEqual(
+            [{'repository': os.path.join(self.directory, 'a'), 'version': '1.1.0'}],
+            fleet.read_manifest(manifest_name),
+        )
+
+        with open(manifest_name, 'w') as manifest_write:
+            json.dump([{'repository': 'a'}], manifest_write)
+        with self.assertRaises(ValueError):
+            fleet.read_manifest(manifest_name)
+
+    def test_release_fleet(self):
+        entries = [
+            {'repository': self._create_project('alpha'), 'version': '1.1.0', 'changelog': '- Alpha'},
+            # Dies without reporting a result, as a crashed interpreter would
+            {'repository': self._create_project('crash', 'import os\nos._exit(3)\n'), 'version': '1.1.0'},
+            {'repository': self._create_project('beta'), 'version': '1.2.0', 'changelog': '- Beta'},
+        ]
+        output = StringIO()
+
+        # Zero jobs still runs one release at a time
+        results = fleet.release_fleet(entries, 0, os.path.join(self.directory, 'logs'), keep_going=True,
+                                      output_stream=output)
+
+        self.assertEqual(
+            [fleet.RESULT_SUCCESS, fleet.RESULT_FAILURE, fleet.RESULT_SUCCESS],
+            [result['result'] for result in results],
+        )
+        with open(results[1]['log']) as log:
+            self.assertIn('exited with code 3 without reporting a result', log.read())
+        self.assertEqual('1.2.0', subprocess.check_output(
+            ['git', 'describe', '--tags'],
+            cwd=entries[2]['repository'],
+        ).decode('utf8').strip())
+
+    def test_release_fleet_stops_after_failure(self):
+        entries = [
+            {'repository': self._create_project('crash', 'import os\nos._exit(3)\n'), 'version': '1.1.0'},
+            {'repository': self._create_project('alpha'), 'version': '1.1.0'},
+        ]
+
+        results = fleet.release_fleet(entries, 1, os.path.join(self.directory, 'logs'), output_stream=StringIO())
+
+        self.assertEqual([fleet.RESULT_FAILURE, fleet.RESULT_SKIPPED], [result['result'] for result in results])
+        summary = fleet.format_summary(results).splitlines()
+        self.assertEqual(4, len(summary))
+        self.assertTrue(summary[0].startswith('Repository'))
+        self.assertIn('skipped', summary[3])
@@ -0,0 +1,36 @@
+from __future__ import absolute_import, unicode_literals
+
+import shutil
+import tempfile
+import time
+from unittest import TestCase
+
+from invoke_release.plugins import ParallelPreReleaseChecksPlugin
+from invoke_release.tasks import ReleaseFailure
+
+
+class TestParallelPreReleaseChecksPlugin(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_pre_release(self):
+        ParallelPreReleaseChecksPlugin('true', ('listing', 'ls')).pre_release(self.directory, '1.0.0')
+
+        with self.assertRaises(ReleaseFailure) as context:
+            ParallelPreReleaseChecksPlugin('true', ('broken', 'exit 4')).pre_release(self.directory, '1.0.0')
+        self.assertIn('broken: failed with exit code 4', str(context.exception))
+
+    def test_pre_release_timeout_kills_the_whole_check(self):
+        # The background command keeps the output pipe open, so the check only finishes early if the timeout kills
+        # everything the shell started, not just the shell itself
+        plugin = ParallelPreReleaseChecksPlugin(('slow', 'sleep 30 & sleep 30'), timeout=1)
+
+        started = time.time()
+        with self.assertRaises(ReleaseFailure) as context:
+            plugin.pre_release(self.directory, '1.0.0')
+
+        self.assertIn('slow: timed out after 1 seconds', str(context.exception))
+        self.assertLess(time.time() - started, 15)
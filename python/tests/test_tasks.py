@@ -1,7 +1,17 @@
 from __future__ import absolute_import, unicode_literals
 
+import hashlib
+import json
+import os
+import pstats
+import shutil
+import subprocess
+import sys
+import tempfile
 from unittest import TestCase
 
+import six
+
 from invoke_release import tasks
 
 
@@ -15,3 +25,911 @@ class TestTasks(TestCase):
         self.assertTrue(tasks._case_sensitive_regular_file_exists(__file__))
         self.assertFalse(tasks._case_sensitive_regular_file_exists(__file__.upper()))
         self.assertFalse(tasks._case_sensitive_regular_file_exists(__file__ + '.bogus'))
+
+    def test_case_sensitive_regular_file_exists_cache(self):
+        directory = tempfile.mkdtemp()
+        try:
+            file_name = os.path.join(directory, 'CHANGELOG.txt')
+            os.mkdir(os.path.join(directory, 'CHANGELOG.md'))
+
+            tasks._invalidate_directory_entries()
+            self.assertFalse(tasks._case_sensitive_regular_file_exists(file_name))
+            self.assertFalse(tasks._case_sensitive_regular_file_exists(os.path.join(directory, 'CHANGELOG.md')))
+
+            with open(file_name, 'w'):
+                pass
+            self.assertFalse(tasks._case_sensitive_regular_file_exists(file_name))
+
+            tasks._invalidate_directory_entries(file_name)
+            self.assertTrue(tasks._case_sensitive_regular_file_exists(file_name))
+            self.assertFalse(tasks._case_sensitive_regular_file_exists(os.path.join(directory, 'changelog.txt')))
+        finally:
+            tasks._invalidate_directory_entries()
+            shutil.rmtree(directory)
+
+    def test_probe_environment_cache(self):
+        directory = tempfile.mkdtemp()
+        original_cache_home = os.environ.get('XDG_CACHE_HOME')
+        os.environ['XDG_CACHE_HOME'] = directory
+        try:
+            environment = tasks._probe_environment(False)
+            self.assertIn('gpg', environment)
+            self.assertIn('tty', environment)
+            self.assertTrue(os.path.isfile(os.path.join(directory, 'invoke-release', 'environment.json')))
+
+            with open(os.path.join(directory, 'invoke-release', 'environment.json'), 'w') as cache_write:
+                json.dump(dict(environment, gpg=sys.executable), cache_write)
+            self.assertEqual(sys.executable, tasks._probe_environment(False)['gpg'])
+
+            # A cached failure to find GPG is probed again
+            with open(os.path.join(directory, 'invoke-release', 'environment.json'), 'w') as cache_write:
+                json.dump(dict(environment, gpg=None), cache_write)
+            self.assertEqual(environment['gpg'], tasks._probe_environment(False)['gpg'])
+        finally:
+            if original_cache_home is None:
+                del os.environ['XDG_CACHE_HOME']
+            else:
+                os.environ['XDG_CACHE_HOME'] = original_cache_home
+            shutil.rmtree(directory)
+
+    def test_read_metrics_durations(self):
+        directory = tempfile.mkdtemp()
+        try:
+            file_name = os.path.join(directory, 'metrics.jsonl')
+            with open(file_name, 'w') as metrics_write:
+                for duration in (3.0, 1.0, 2.0):
+                    metrics_write.write(json.dumps({
+                        'module': 'demo',
+                        'task': 'release',
+                        'duration': duration,
+                        'phases': {'push': duration / 2},
+                        'plugins': {'Plugin.pre_commit': 0.5},
+                    }) + '\n')
+                metrics_write.write('{"truncated')
+
+            durations = tasks._read_metrics_durations(file_name)
+            total = durations[('demo', 'release', 'total')]
+            self.assertEqual((3, 6.0, 3.0), (total.count, total.total, total.maximum))
+            self.assertEqual((3, 3.0, 1.5), (
+                durations[('demo', 'release', 'push')].count,
+                durations[('demo', 'release', 'push')].total,
+                durations[('demo', 'release', 'push')].maximum,
+            ))
+            self.assertEqual(0.5, durations[('demo', 'release', 'plugin:Plugin.pre_commit')].percentile(0.5))
+
+            self.assertAlmostEqual(2.0, total.percentile(0.5), delta=2.0 * 0.005)
+            self.assertEqual(3.0, total.percentile(0.95))
+            self.assertAlmostEqual(1.0, total.percentile(0.01), delta=1.0 * 0.005)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_version(self):
+        ordered = ['1.2.0-dev1', '1.2.0-alpha1', '1.2.0-beta2', '1.2.0-rc1', '1.2.0-rc10', '1.2.0', '1.2.1', '1.10.0']
+        self.assertEqual(ordered, [str(v) for v in sorted(tasks.Version.parse(v) for v in reversed(ordered))])
+
+        version = tasks.Version.parse('2.3.4rc1')
+        self.assertIs(version, tasks.Version.parse('2.3.4rc1'))
+        self.assertEqual(tasks.Version.parse('2.3.4-rc1'), version)
+        self.assertEqual('2.3.4-rc1', str(version))
+        self.assertEqual([2, 3, 4, 'rc1'], version.version_info)
+        self.assertEqual('2.3.x', version.minor_branch)
+        self.assertEqual('2.x.x', version.major_branch)
+        self.assertTrue(version.is_on_branch('2.x.x'))
+        self.assertFalse(version.is_on_branch('2.4.x'))
+
+        self.assertNotEqual('2.3.4-rc1', version)
+        self.assertFalse(version == '2.3.4-rc1')
+        self.assertTrue(version != (2, 3, 4))
+        self.assertIs(NotImplemented, version.__lt__('2.3.5'))
+        self.assertIs(NotImplemented, version.__ge__(None))
+
+        with self.assertRaises(ValueError):
+            tasks.Version.parse('2.3')
+
+    def test_append_index_link(self):
+        directory = tempfile.mkdtemp()
+        try:
+            page_name = os.path.join(directory, 'index.html')
+            tasks._append_index_link(page_name, 'Simple Index', 'alpha/', 'alpha')
+            tasks._append_index_link(page_name, 'Simple Index', 'beta/', 'beta')
+
+            with open(page_name) as page_read:
+                self.assertEqual(
+                    tasks.INDEX_PAGE_HEADER_TEMPLATE.format(title='Simple Index') +
+                    '    <a href="alpha/">alpha</a><br>\n'
+                    '    <a href="beta/">beta</a><br>\n' +
+                    tasks.INDEX_PAGE_FOOTER,
+                    page_read.read(),
+                )
+
+            other_page_name = os.path.join(directory, 'other.html')
+            with open(other_page_name, 'w') as page_write:
+                page_write.write('<html><body></body></html>\n')
+            with self.assertRaises(tasks.ReleaseFailure):
+                tasks._append_index_link(other_page_name, 'Other', 'alpha/', 'alpha')
+        finally:
+            shutil.rmtree(directory)
+
+    def test_resolve_head(self):
+        directory = os.path.realpath(tempfile.mkdtemp())
+        original_directory = os.getcwd()
+        commit = 'a' * 40
+        try:
+            os.makedirs(os.path.join(directory, 'main', '.git', 'refs', 'tags'))
+            os.makedirs(os.path.join(directory, 'main', '.git', 'worktrees', 'linked'))
+            os.makedirs(os.path.join(directory, 'linked'))
+            with open(os.path.join(directory, 'main', '.git', 'HEAD'), 'w') as head_write:
+                head_write.write('ref: refs/heads/master\n')
+            with open(os.path.join(directory, 'main', '.git', 'packed-refs'), 'w') as packed_refs_write:
+                packed_refs_write.write('# pack-refs with: peeled fully-peeled sorted \n')
+                packed_refs_write.write('{} refs/heads/master\n'.format(commit))
+                packed_refs_write.write('{} refs/tags/1.0.0\n^{}\n'.format('b' * 40, commit))
+                packed_refs_write.write('\n')  # Blank lines, as left by hand edits or other tools, are skipped
+            with open(os.path.join(directory, 'main', '.git', 'worktrees', 'linked', 'HEAD'), 'w') as head_write:
+                head_write.write('{}\n'.format('c' * 40))
+            with open(os.path.join(directory, 'main', '.git', 'worktrees', 'linked', 'commondir'), 'w') as common_write:
+                common_write.write('../..\n')
+            with open(os.path.join(directory, 'linked', '.git'), 'w') as dot_git_write:
+                dot_git_write.write('gitdir: ../main/.git/worktrees/linked\n')
+
+            os.chdir(os.path.join(directory, 'main'))
+            self.assertEqual(('refs/heads/master', commit), tasks._resolve_head())
+            self.assertEqual('master', tasks._get_branch_name(False))
+            self.assertTrue(tasks._does_tag_exist_locally('1.0.0', False))
+            self.assertFalse(tasks._does_tag_exist_locally('1.0', False))
+
+            os.chdir(os.path.join(directory, 'linked'))
+            self.assertEqual(('HEAD', 'c' * 40), tasks._resolve_head())
+            self.assertEqual(os.path.join(directory, 'main', '.git'), tasks._get_git_common_directory())
+            self.assertTrue(tasks._does_tag_exist_locally('1.0.0', False))
+        finally:
+            os.chdir(original_directory)
+            shutil.rmtree(directory)
+
+    def test_get_tag_list_cache(self):
+        directory = os.path.realpath(tempfile.mkdtemp())
+        original_directory = os.getcwd()
+        original_check_output = tasks._check_output
+
+        def age_tags():
+            # Make the tag directory old enough for its modification time to be trusted
+            old = os.path.getmtime(os.path.join(directory, '.git', 'refs', 'tags')) - 10
+            os.utime(os.path.join(directory, '.git', 'refs', 'tags'), (old, old))
+
+        def git(*args):
+            subprocess.check_call(('git', '-c', 'user.name=Tester', '-c', 'user.email=t@example.com') + args,
+                                  cwd=directory)
+
+        try:
+            git('init', '-q')
+            git('commit', '-q', '--allow-empty', '-m', 'Initial commit')
+            git('tag', '1.0.0')
+            age_tags()
+            os.chdir(directory)
+            self.assertEqual(['1.0.0'], tasks._get_tag_list(False))
+
+            def check_output(command, **_):
+                raise AssertionError('Unexpected command {}'.format(command))
+
+            tasks._check_output = check_output
+            self.assertEqual(['1.0.0'], tasks._get_tag_list(False))
+            tasks._check_output = original_check_output
+
+            git('tag', '1.1.0')
+            self.assertEqual(['1.0.0', '1.1.0'], tasks._get_tag_list(False))
+            git('tag', '-d', '1.0.0')
+            age_tags()
+            self.assertEqual(['1.1.0'], tasks._get_tag_list(False))
+        finally:
+            tasks._check_output = original_check_output
+            os.chdir(original_directory)
+            shutil.rmtree(directory)
+
+    def test_release_lock_is_exclusive(self):
+        directory = os.path.realpath(tempfile.mkdtemp())
+        log_name = os.path.join(directory, 'log')
+        start_name = os.path.join(directory, 'start')
+        script = (
+            'import os, sys, time\n'
+            'from invoke_release import tasks\n'
+            'while not os.path.exists(sys.argv[2]):\n'
+            '    time.sleep(0.001)\n'
+            'tasks._acquire_release_lock(False)\n'
+            'for event in ("enter", "exit"):\n'
+            '    with open(sys.argv[1], "a") as log:\n'
+            '        log.write(event + "\\n")\n'
+            '    time.sleep(0.02)\n'
+            'tasks._release_release_lock()\n'
+        )
+        try:
+            subprocess.check_call(['git', 'init', '-q', directory])
+            processes = [
+                subprocess.Popen(
+                    [sys.executable, '-c', script, log_name, start_name],
+                    cwd=directory,
+                    env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path)),
+                    stdout=subprocess.PIPE,
+                )
+                for _ in range(6)
+            ]
+            open(start_name, 'w').close()
+            for process in processes:
+                process.communicate()
+                self.assertEqual(0, process.returncode)
+
+            with open(log_name) as log:
+                self.assertEqual(['enter', 'exit'] * 6, log.read().split())
+            self.assertEqual(
+                ['counter'],
+                os.listdir(os.path.join(directory, '.git', 'invoke-release', 'locks')),
+            )
+        finally:
+            shutil.rmtree(directory)
+
+    def test_verify_tag_signature(self):
+        outputs = {
+            'good': b'[GNUPG:] GOODSIG 0123 Release <r@x>\n[GNUPG:] VALIDSIG 0123\n',
+            'bad': b'[GNUPG:] BADSIG 0123 Release <r@x>\n',
+            'unknown': b'[GNUPG:] ERRSIG 0123 22 10 00 1 9\n[GNUPG:] NO_PUBKEY 0123\n',
+            'unsigned': b'error: no signature found\n',
+        }
+
+        def check_output(command, **_):
+            if command[-1] != 'good':
+                raise subprocess.CalledProcessError(1, command, outputs[command[-1]])
+            return outputs['good']
+
+        original_check_output = tasks._check_output
+        tasks._check_output = check_output
+        try:
+            self.assertEqual(tasks.TAG_SIGNATURE_GOOD, tasks._verify_tag_signature(['git'], 'good', 'tag'))
+            self.assertEqual(tasks.TAG_SIGNATURE_BAD, tasks._verify_tag_signature(['git'], 'bad', 'tag'))
+            self.assertEqual(tasks.TAG_SIGNATURE_UNKNOWN_KEY, tasks._verify_tag_signature(['git'], 'unknown', 'tag'))
+            self.assertEqual(tasks.TAG_SIGNATURE_UNSIGNED, tasks._verify_tag_signature(['git'], 'unsigned', 'tag'))
+            self.assertEqual(tasks.TAG_SIGNATURE_UNSIGNED, tasks._verify_tag_signature(['git'], 'good', 'commit'))
+        finally:
+            tasks._check_output = original_check_output
+
+
+class TestReleaseTasks(TestCase):
+    """
+    Runs the tasks in scratch Git repositories. Each task runs in its own process, because a process can only configure
+    the release parameters once.
+    """
+
+    def setUp(self):
+        self.directory = os.path.realpath(tempfile.mkdtemp())
+        self.origin = os.path.join(self.directory, 'origin.git')
+        self.project = os.path.join(self.directory, 'project')
+        self.environment = dict(
+            os.environ,
+            PYTHONPATH=os.pathsep.join(sys.path),
+            XDG_CACHE_HOME=os.path.join(self.directory, 'cache'),
+            GIT_CONFIG_NOSYSTEM='1',
+        )
+        self.environment.pop('INVOKE_RELEASE_OUTPUT', None)
+
+        subprocess.check_call(['git', 'init', '-q', '--bare', self.origin])
+        subprocess.check_call(['git', 'init', '-q', self.project])
+        self._git('config', 'user.name', 'Release Tester')
+        self._git('config', 'user.email', 'release@example.com')
+        self._git('checkout', '-q', '-b', 'master')
+        self._git('remote', 'add', 'origin', self.origin)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _git(self, *args):
+        return subprocess.check_output(('git',) + args, cwd=self.project).decode('utf8').strip()
+
+    def _write(self, file_name, contents):
+        file_name = os.path.join(self.project, file_name)
+        if not os.path.isdir(os.path.dirname(file_name)):
+            os.makedirs(os.path.dirname(file_name))
+        with open(file_name, 'w') as file_write:
+            file_write.write(contents)
+
+    def _read(self, file_name):
+        with open(os.path.join(self.project, file_name)) as file_read:
+            return file_read.read()
+
+    def _create_project(self, version_txt=False, configuration='', plugin_arguments=''):
+        if version_txt:
+            self._write('python/demo/version.txt', '1.0.0')
+        else:
+            self._write('python/demo/version.py', '__version_info__ = (1, 0, 0)\n__version__ = \'1.0.0\'\n')
+        self._write('python/demo/__init__.py', '')
+        self._write('CHANGELOG.txt', 'Changelog\n=========\n\n1.0.0 (2018-01-01)\n------------------\n- Initial\n')
+        self._write('README.md', 'Demo 1.0.0\n')
+        self._write('tasks.py', (
+            'from invoke_release.plugins import PatternReplaceVersionInFilesPlugin\n'
+            'from invoke_release.tasks import *  # noqa\n'
+            'configure_release_parameters(\n'
+            '    module_name=\'demo\', display_name=\'Demo\', python_directory=\'python\',\n'
+            '    plugins=[PatternReplaceVersionInFilesPlugin(\'README.md\'{})],\n'
+            '    {}\n'
+            ')\n'
+        ).format(plugin_arguments, configuration))
+        self._git('add', '.')
+        self._git('commit', '-q', '-m', 'Initial commit')
+        self._git('push', '-q', 'origin', 'master')
+
+    def _start_task(self, task_name, subdirectory='', stderr=subprocess.STDOUT, **kwargs):
+        """
+        Starts the task from the project's `tasks.py` as Invoke would (from the given subdirectory of the project), and
+        returns its process.
+        """
+        script = (
+            'import json, runpy, sys\n'
+            'task = runpy.run_path(sys.argv[3])[sys.argv[1]]\n'
+            'task.body(None, **json.loads(sys.argv[2]))\n'
+        )
+        return subprocess.Popen(
+            [sys.executable, '-c', script, task_name, json.dumps(kwargs), os.path.join(self.project, 'tasks.py')],
+            cwd=os.path.join(self.project, subdirectory),
+            env=self.environment,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=stderr,
+        )
+
+    def _run_task(self, task_name, answers=None, subdirectory='', **kwargs):
+        """
+        Runs the task from the project's `tasks.py` as Invoke would (from the given subdirectory of the project), with
+        the given answers (one per line) to its prompts, and returns its exit status and output.
+        """
+        process = self._start_task(task_name, subdirectory=subdirectory, **kwargs)
+        answers = ''.join(answer + '\n' for answer in answers or [])
+        output = process.communicate(answers.encode('utf8'))[0].decode('utf8')
+        return process.returncode, output
+
+    def _run_script(self, source):
+        """
+        Runs the source in the project, with its `tasks.py` configured and resolved and the release tasks module
+        available as `tasks`, and returns its output.
+        """
+        script = (
+            'import json, runpy\n'
+            'runpy.run_path(\'tasks.py\')\n'
+            'from invoke_release import tasks\n'
+            'tasks._resolve_configuration()\n'
+        ) + source
+        return subprocess.check_output(
+            [sys.executable, '-c', script],
+            cwd=self.project,
+            env=self.environment,
+            stderr=subprocess.STDOUT,
+        ).decode('utf8')
+
+    def _release(self, version, **kwargs):
+        status, output = self._run_task('release', release_version=version, changelog='- Changes', yes=True, **kwargs)
+        self.assertEqual(0, status, output)
+        self.assertIn('Release process is complete.', output)
+        return output
+
+    def test_release_worktree(self):
+        self._create_project()
+        self._write('python/demo/__init__.py', 'raise RuntimeError(\'uncommitted\')\n')
+        self._write('notes.txt', 'untracked\n')
+
+        self._release('1.1.0', worktree=True)
+
+        self.assertEqual('Released Demo version 1.1.0', self._git('log', '-1', '--format=%s'))
+        self.assertEqual('1.1.0', self._git('describe', '--tags'))
+        self.assertEqual(self._git('rev-parse', 'master'), self._git('--git-dir', self.origin, 'rev-parse', 'master'))
+        self.assertIn('__version_info__ = (1, 1, 0)', self._git('show', 'HEAD:python/demo/version.py'))
+        # The released files are brought up to date, and the uncommitted changes are left alone
+        self.assertEqual('Demo 1.1.0\n', self._read('README.md'))
+        self.assertEqual('python/demo/__init__.py', self._git('diff', '--name-only'))
+        self.assertEqual('', self._git('diff', '--cached', '--name-only'))
+        self.assertTrue(os.path.isfile(os.path.join(self.project, 'notes.txt')))
+        self.assertEqual('', self._git('stash', 'list'))
+        self.assertEqual(1, len(self._git('worktree', 'list').splitlines()))
+
+    def test_release_sparse_worktree(self):
+        self._create_project()
+        self._write('python/demo/__init__.py', 'raise RuntimeError(\'uncommitted\')\n')
+
+        self._release('1.1.0', sparse_worktree=True)
+
+        self.assertEqual('Released Demo version 1.1.0', self._git('log', '-1', '--format=%s'))
+        self.assertEqual(
+            ['CHANGELOG.txt', 'README.md', 'python/demo/version.py'],
+            sorted(self._git('show', '--format=', '--name-only', 'HEAD').splitlines()),
+        )
+        self.assertEqual('Demo 1.1.0\n', self._read('README.md'))
+        self.assertEqual('python/demo/__init__.py', self._git('diff', '--name-only'))
+        self.assertEqual(1, len(self._git('worktree', 'list').splitlines()))
+
+    def test_release_stashes_all_changes_by_default(self):
+        self._create_project()
+        self._write('python/demo/__init__.py', '# Work in progress\n')
+
+        output = self._release('1.1.0', verbose=True)
+
+        # The plugin hooks run against a clean checkout, and the changes come back afterwards
+        self.assertIn('Stashing changes...', output)
+        self.assertIn('Un-stashing changes...', output)
+        self.assertEqual('# Work in progress\n', self._read('python/demo/__init__.py'))
+        self.assertEqual('', self._git('stash', 'list'))
+
+    def test_release_from_subdirectory_restores_stash(self):
+        self._create_project()
+        self._write('python/demo/__init__.py', '# Work in progress\n')
+
+        status, output = self._run_task('release', subdirectory='python/demo', release_version='1.1.0',
+                                        changelog='- Changes', yes=True, verbose=True)
+
+        self.assertEqual(0, status, output)
+        self.assertIn('Un-stashing changes...', output)
+        self.assertIn('Release process is complete.', output)
+        self.assertEqual('# Work in progress\n', self._read('python/demo/__init__.py'))
+        self.assertEqual('', self._git('stash', 'list'))
+
+    def test_release_partial_stash(self):
+        self._create_project()
+        self._write('python/demo/__init__.py', '# Work in progress\n')
+
+        output = self._release('1.1.0', verbose=True, partial_stash=True)
+
+        self.assertIn('None of the files modified by the release have changes to stash.', output)
+        self.assertNotIn('Stashing changes...', output)
+        self.assertEqual(
+            ['CHANGELOG.txt', 'README.md', 'python/demo/version.py'],
+            sorted(self._git('show', '--format=', '--name-only', 'HEAD').splitlines()),
+        )
+        self.assertEqual('python/demo/__init__.py', self._git('diff', '--name-only'))
+
+    def test_release_discovers_files_with_version_txt(self):
+        # The version file is rewritten before the pre-commit hooks run, so discovery must search for the old version
+        self._write('docs/install.md', 'pip install demo==1.0.0\n')
+        self._create_project(version_txt=True, plugin_arguments=', discover=\'update\'')
+
+        self._release('1.1.0')
+
+        self.assertEqual('1.1.0', self._read('python/demo/version.txt').strip())
+        self.assertEqual('Demo 1.1.0\n', self._read('README.md'))
+        self.assertEqual('pip install demo==1.1.0\n', self._read('docs/install.md'))
+        self.assertEqual(
+            ['CHANGELOG.txt', 'README.md', 'docs/install.md', 'python/demo/version.txt'],
+            sorted(self._git('show', '--format=', '--name-only', 'HEAD').splitlines()),
+        )
+
+    def test_rollback_release_deletes_tag_from_every_remote(self):
+        mirror = os.path.join(self.directory, 'mirror.git')
+        subprocess.check_call(['git', 'init', '-q', '--bare', mirror])
+        self._git('remote', 'add', 'mirror', mirror)
+        self._create_project(configuration='remotes=[\'origin\', \'mirror\'],')
+        self._git('push', '-q', 'mirror', 'master')
+        self._release('1.1.0')
+        # The primary remote lost the tag, but the mirror still has it
+        self._git('--git-dir', self.origin, 'tag', '-d', '1.1.0')
+
+        status, output = self._run_task('rollback_release', answers=['y', 'y'])
+
+        self.assertEqual(0, status, output)
+        self.assertIn('Release rollback is complete.', output)
+        self.assertEqual('', self._git('--git-dir', mirror, 'tag', '--list'))
+        self.assertEqual('', self._git('tag', '--list', '1.1.0'))
+
+    def test_release_fast_commit(self):
+        self._create_project(configuration='fast_commit=True,')
+        initial_commit = self._git('rev-parse', 'HEAD')
+        self._write('python/demo/__init__.py', '# Work in progress\n')
+
+        output = self._release('1.1.0', no_stash=True)
+
+        self.assertIn('Created release commit', output)
+        self.assertEqual('Released Demo version 1.1.0', self._git('log', '-1', '--format=%s'))
+        self.assertIn('- Changes', self._git('log', '-1', '--format=%b'))
+        self.assertEqual(initial_commit, self._git('rev-parse', 'HEAD~1'))
+        self.assertEqual(
+            ['CHANGELOG.txt', 'README.md', 'python/demo/version.py'],
+            sorted(self._git('show', '--format=', '--name-only', 'HEAD').splitlines()),
+        )
+        self.assertIn('__version_info__ = (1, 1, 0)', self._git('show', 'HEAD:python/demo/version.py'))
+        self.assertEqual('', self._git('show', 'HEAD:python/demo/__init__.py'))
+        # Only the released files' index entries were updated, and the other change is still unstaged
+        self.assertEqual('', self._git('diff', '--cached', '--name-only'))
+        self.assertEqual('python/demo/__init__.py', self._git('diff', '--name-only'))
+        self.assertEqual('', self._git('fsck', '--no-dangling'))
+        self.assertEqual(self._git('rev-parse', 'master'), self._git('--git-dir', self.origin, 'rev-parse', 'master'))
+
+    def test_commit_files_with_plumbing_from_subdirectory(self):
+        self._create_project()
+        # A file name that is not valid UTF-8 must survive the rebuilt tree unchanged
+        odd_name = os.path.join(self.project.encode('utf8'), b'python', b'demo', b'data-\xff.bin')
+        with open(odd_name, 'wb') as odd_write:
+            odd_write.write(b'data')
+        subprocess.check_call(['git', 'add', '-A'], cwd=self.project)
+        self._git('commit', '-q', '-m', 'Add data')
+        self._write('python/demo/version.py', '__version_info__ = (1, 1, 0)\n__version__ = \'1.1.0\'\n')
+
+        self._run_script(
+            'import os\n'
+            'os.chdir(\'python\')\n'
+            'tasks._commit_files_with_plumbing([tasks.VERSION_FILENAME], \'Plumbing commit\', False)\n'
+        )
+
+        self.assertEqual('Plumbing commit', self._git('log', '-1', '--format=%s'))
+        self.assertEqual(['python/demo/version.py'], self._git('show', '--format=', '--name-only', 'HEAD').splitlines())
+
+        def list_data_entry(revision):
+            output = subprocess.check_output(['git', 'ls-tree', '-z', revision, 'python/demo/'], cwd=self.project)
+            return [entry for entry in output.split(b'\0') if b'data-' in entry]
+
+        self.assertEqual(1, len(list_data_entry('HEAD')))
+        self.assertEqual(list_data_entry('HEAD~1'), list_data_entry('HEAD'))
+        self.assertEqual('', self._git('status', '--porcelain'))
+        self.assertEqual('', self._git('fsck', '--no-dangling'))
+
+    def test_read_trees(self):
+        self._create_project()
+        original_root_directory = tasks.ROOT_DIRECTORY
+        tasks.ROOT_DIRECTORY = self.project
+        try:
+            trees = tasks._read_trees('HEAD', ['python/demo', 'python', '', 'README.md', 'docs'])
+        finally:
+            tasks.ROOT_DIRECTORY = original_root_directory
+
+        self.assertEqual([b'__init__.py', b'version.py'], sorted(trees['python/demo']))
+        self.assertEqual(
+            ('100644', self._git('rev-parse', 'HEAD:python/demo/version.py')),
+            trees['python/demo'][b'version.py'],
+        )
+        self.assertEqual({b'demo': ('40000', self._git('rev-parse', 'HEAD:python/demo'))}, trees['python'])
+        self.assertEqual([b'CHANGELOG.txt', b'README.md', b'python', b'tasks.py'], sorted(trees['']))
+        # A file and a missing path are not trees
+        self.assertIsNone(trees['README.md'])
+        self.assertIsNone(trees['docs'])
+
+    def test_publish(self):
+        self._create_project(configuration='index_directory=\'index\',')
+        self._write('dist/demo-1.0.0-py2.py3-none-any.whl', 'wheel')
+        self._write('dist/demo-1.0.0.tar.gz', 'source')
+
+        status, output = self._run_task('publish')
+        self.assertEqual(0, status, output)
+
+        self._write('dist/demo-1.1.0-py2.py3-none-any.whl', 'new wheel')
+        status, output = self._run_task('publish')
+        self.assertEqual(0, status, output)
+        self.assertIn('demo-1.0.0.tar.gz was already published. Skipping.', output)
+
+        # The root index links the project once, and the project page gains a link per artifact, in publish order
+        index = self._read('index/index.html')
+        self.assertEqual(1, index.count('<a href="demo/">demo</a>'))
+        page = self._read('index/demo/index.html')
+        self.assertEqual(3, page.count('<a href='))
+        self.assertLess(page.index('demo-1.0.0.tar.gz#'), page.index('demo-1.1.0-py2.py3-none-any.whl#'))
+        self.assertIn(
+            'demo-1.1.0-py2.py3-none-any.whl#sha256={}'.format(hashlib.sha256(b'new wheel').hexdigest()),
+            page,
+        )
+        self.assertTrue(page.endswith('</html>\n'))
+        self.assertEqual('new wheel', self._read('index/demo/demo-1.1.0-py2.py3-none-any.whl'))
+
+    def test_publish_lists_artifacts_left_unlisted(self):
+        self._create_project(configuration='index_directory=\'index\',')
+        self._write('dist/demo-1.0.0.tar.gz', 'source')
+        status, output = self._run_task('publish')
+        self.assertEqual(0, status, output)
+
+        # Publishers interrupted after copying artifacts, but before listing them
+        self._write('index/demo/demo-1.1.0.tar.gz', 'new source')
+        self._write('index/other/other-1.0.0.tar.gz', 'other source')
+        self._write('dist/demo-1.1.0.tar.gz', 'new source')
+        self._write('dist/other-1.0.0.tar.gz', 'other source')
+
+        status, output = self._run_task('publish')
+
+        self.assertEqual(0, status, output)
+        self.assertIn('demo-1.0.0.tar.gz was already published. Skipping.', output)
+        self.assertIn('demo-1.1.0.tar.gz was copied before, but not listed. Listing it now.', output)
+        self.assertIn('other-1.0.0.tar.gz was copied before, but not listed. Listing it now.', output)
+        self.assertIn(
+            'demo-1.1.0.tar.gz#sha256={}'.format(hashlib.sha256(b'new source').hexdigest()),
+            self._read('index/demo/index.html'),
+        )
+        self.assertIn('other-1.0.0.tar.gz#sha256=', self._read('index/other/index.html'))
+        index = self._read('index/index.html')
+        self.assertEqual(1, index.count('<a href="demo/">'))
+        self.assertEqual(1, index.count('<a href="other/">'))
+
+    def _reject_pushes(self, reject=True):
+        hook_name = os.path.join(self.origin, 'hooks', 'pre-receive')
+        if reject:
+            with open(hook_name, 'w') as hook_write:
+                hook_write.write('#!/bin/sh\necho Pushes are closed >&2\nexit 1\n')
+            os.chmod(hook_name, 0o755)
+        else:
+            os.unlink(hook_name)
+
+    def test_release_resume_after_failed_push(self):
+        self._create_project()
+        self._reject_pushes()
+
+        status, output = self._run_task('release', release_version='1.1.0', changelog='- Changes', yes=True)
+
+        self.assertIn('Run `invoke release --resume` to continue it from there.', output)
+        self.assertTrue(os.path.isfile(os.path.join(self.project, '.git', 'invoke-release', 'journal-demo.json')))
+        release_commit = self._git('rev-parse', 'HEAD')
+        self.assertEqual('Released Demo version 1.1.0', self._git('log', '-1', '--format=%s'))
+        self.assertEqual(release_commit, self._git('rev-parse', '1.1.0^{commit}'))
+
+        self._reject_pushes(False)
+        status, output = self._run_task('release', resume=True, yes=True)
+
+        self.assertEqual(0, status, output)
+        self.assertIn('Resuming the release of Demo version 1.1.0 after phase "tag"...', output)
+        self.assertIn('Release process is complete.', output)
+        # Nothing was committed or tagged again
+        self.assertEqual(release_commit, self._git('rev-parse', 'HEAD'))
+        self.assertEqual('Initial commit', self._git('log', '-1', '--format=%s', 'HEAD~1'))
+        self.assertEqual(release_commit, self._git('--git-dir', self.origin, 'rev-parse', 'master'))
+        self.assertEqual('1.1.0', self._git('--git-dir', self.origin, 'tag', '--list'))
+        self.assertFalse(os.path.exists(os.path.join(self.project, '.git', 'invoke-release', 'journal-demo.json')))
+
+        status, output = self._run_task('release', resume=True, yes=True)
+        self.assertEqual(1, status, output)
+        self.assertIn('There is no interrupted release of Demo to resume.', output)
+
+    def test_release_resume_refuses_moved_branch(self):
+        self._create_project()
+        self._reject_pushes()
+        self._run_task('release', release_version='1.1.0', changelog='- Changes', yes=True)
+        self._write('notes.txt', 'Committed after the interruption\n')
+        self._git('add', 'notes.txt')
+        self._git('commit', '-q', '-m', 'Unrelated commit')
+
+        status, output = self._run_task('release', resume=True, yes=True)
+
+        self.assertIn('Cannot resume the release because branch "master" no longer points to', output)
+        self.assertNotIn('Release process is complete.', output)
+        self.assertEqual('Unrelated commit', self._git('log', '-1', '--format=%s'))
+
+    def test_configuration_is_resolved_lazily(self):
+        self._create_project(configuration='scoped_history=True,')
+        script = (
+            'import json, runpy, subprocess, sys\n'
+            'commands = []\n'
+            'class RecordingPopen(subprocess.Popen):\n'
+            '    def __init__(self, command, *args, **kwargs):\n'
+            '        commands.append(command)\n'
+            '        super(RecordingPopen, self).__init__(command, *args, **kwargs)\n'
+            'subprocess.Popen = RecordingPopen\n'
+            'runpy.run_path(\'tasks.py\')\n'
+            'from invoke_release import tasks\n'
+            'def state():\n'
+            '    return {\n'
+            '        \'commands\': len(commands), \'root\': tasks.ROOT_DIRECTORY,\n'
+            '        \'version\': tasks.VERSION_FILENAME, \'history\': tasks.HISTORY_PATHS,\n'
+            '        \'path\': sys.path[0],\n'
+            '    }\n'
+            'imported = state()\n'
+            'tasks._resolve_configuration()\n'
+            'resolved = state()\n'
+            'tasks._resolve_configuration()\n'
+            'print(json.dumps([imported, resolved, state()]))\n'
+        )
+        imported, resolved, resolved_again = json.loads(subprocess.check_output(
+            [sys.executable, '-c', script],
+            cwd=self.project,
+            env=self.environment,
+        ).decode('utf8'))
+
+        # Importing tasks.py (as `invoke --list` and shell completion do) runs nothing
+        self.assertEqual(0, imported['commands'])
+        self.assertEqual('', imported['root'])
+        self.assertIsNone(imported['history'])
+
+        self.assertEqual(self.project, resolved['root'])
+        self.assertEqual(os.path.join(self.project, 'python', 'demo', 'version.py'), resolved['version'])
+        self.assertEqual(['python'], resolved['history'])
+        self.assertEqual(os.path.join(self.project, 'python'), resolved['path'])
+        self.assertGreater(resolved['commands'], 0)
+        # Only the first call does any work
+        self.assertEqual(resolved, resolved_again)
+
+    def test_bulk_tags(self):
+        self._create_project()
+        initial_commit = self._git('rev-parse', 'HEAD')
+        self._write('notes.txt', 'Second\n')
+        self._git('add', 'notes.txt')
+        self._git('commit', '-q', '-m', 'Second commit')
+        second_commit = self._git('rev-parse', 'HEAD')
+
+        self._run_script(
+            'tasks._create_tags([(\'1.0.0\', \'HEAD~1\', \'First\'), (\'1.1.0\', \'HEAD\', \'Second\')], False)\n'
+        )
+        self.assertEqual(initial_commit, self._git('rev-parse', '1.0.0^{commit}'))
+        self.assertEqual(second_commit, self._git('rev-parse', '1.1.0^{commit}'))
+        self.assertEqual('tag', self._git('cat-file', '-t', '1.1.0'))
+        self.assertEqual('Second', self._git('tag', '--list', '--format=%(contents:subject)', '1.1.0'))
+        self.assertEqual('', self._git('fsck', '--no-dangling'))
+
+        # Creating an existing tag changes nothing, not even the other tags, unless overwriting
+        with self.assertRaises(subprocess.CalledProcessError) as context:
+            self._run_script(
+                'tasks._create_tags([(\'1.2.0\', \'HEAD\', \'New\'), (\'1.0.0\', \'HEAD\', \'Again\')], False)\n'
+            )
+        self.assertIn('no tags were changed', context.exception.output.decode('utf8'))
+        self.assertEqual('', self._git('tag', '--list', '1.2.0'))
+        self._run_script('tasks._create_tags([(\'1.0.0\', \'HEAD\', \'Moved\')], False, overwrite=True)\n')
+        self.assertEqual(second_commit, self._git('rev-parse', '1.0.0^{commit}'))
+        self.assertEqual('Moved', self._git('tag', '--list', '--format=%(contents:subject)', '1.0.0'))
+
+        # The push is atomic: when the remote rejects one tag, it accepts none of them
+        hook_name = os.path.join(self.origin, 'hooks', 'update')
+        with open(hook_name, 'w') as hook_write:
+            hook_write.write('#!/bin/sh\ntest "$1" != refs/tags/1.0.0\n')
+        os.chmod(hook_name, 0o755)
+        with self.assertRaises(subprocess.CalledProcessError):
+            self._run_script('tasks._push_tags([\'1.0.0\', \'1.1.0\'], False)\n')
+        self.assertEqual('', self._git('--git-dir', self.origin, 'tag', '--list'))
+        os.unlink(hook_name)
+        self._run_script('tasks._push_tags([\'1.0.0\', \'1.1.0\'], False)\n')
+        self.assertEqual(['1.0.0', '1.1.0'], self._git('--git-dir', self.origin, 'tag', '--list').splitlines())
+
+        self._run_script(
+            'tasks._delete_local_tags([\'1.0.0\', \'1.1.0\'], False)\n'
+            'tasks._delete_remote_tags([\'1.0.0\', \'1.1.0\'], False)\n'
+        )
+        self.assertEqual('', self._git('tag', '--list'))
+        self.assertEqual('', self._git('--git-dir', self.origin, 'tag', '--list'))
+
+    def test_release_tags_and_pushes_atomically(self):
+        self._create_project()
+
+        self._release('1.1.0')
+
+        self.assertEqual('tag', self._git('cat-file', '-t', '1.1.0'))
+        self.assertEqual('Released Demo version 1.1.0', self._git('tag', '--list', '--format=%(contents:subject)'))
+        self.assertIn('- Changes', self._git('tag', '--list', '--format=%(contents:body)'))
+        self.assertEqual(self._git('rev-parse', '1.1.0'), self._git('--git-dir', self.origin, 'rev-parse', '1.1.0'))
+
+    def test_delete_remote_tags_only_on_failing_best_effort_remote(self):
+        mirror = os.path.join(self.directory, 'mirror.git')
+        subprocess.check_call(['git', 'init', '-q', '--bare', mirror])
+        self._git('remote', 'add', 'mirror', mirror)
+        self._create_project(configuration='best_effort_remotes=[\'mirror\'],')
+        self._git('tag', '1.0.0')
+        self._git('push', '-q', 'mirror', 'master', '1.0.0')
+        hook_name = os.path.join(mirror, 'hooks', 'pre-receive')
+        with open(hook_name, 'w') as hook_write:
+            hook_write.write('#!/bin/sh\necho Pushes are closed >&2\nexit 1\n')
+        os.chmod(hook_name, 0o755)
+
+        # The only remote with the tag is best-effort, so its failure is reported instead of failing the task
+        output = self._run_script('tasks._delete_remote_tags([\'1.0.0\'], False)\n')
+
+        self.assertIn('Failed pushing to best-effort remote mirror (continuing anyway)', output)
+        self.assertEqual('1.0.0', self._git('--git-dir', mirror, 'tag', '--list'))
+
+    def test_release_json_output(self):
+        self._create_project()
+
+        process = self._start_task(
+            'release',
+            stderr=subprocess.PIPE,
+            release_version='1.1.0',
+            changelog='- Changes',
+            yes=True,
+            output='json',
+        )
+        output, errors = process.communicate()
+
+        self.assertEqual(0, process.returncode, errors)
+        # Every line of standard output is an event, and the output of Git (here, `git commit`) goes to standard error
+        events = [json.loads(line) for line in output.decode('utf8').splitlines()]
+        self.assertIn('[master ', errors.decode('utf8'))
+        self.assertNotIn('[master ', output.decode('utf8'))
+        self.assertEqual({'command', 'message', 'phase', 'prompt', 'result'}, {event['event'] for event in events})
+        self.assertIn(
+            {'level': 'info', 'message': 'Current version: 1.0.0'},
+            [{'level': event['level'], 'message': event['message']} for event in events if event['event'] == 'message'],
+        )
+        self.assertIn(
+            ('version', '1.1.0'),
+            [(event['key'], event['answer']) for event in events if event['event'] == 'prompt'],
+        )
+        self.assertIn(
+            ['git', 'push', '--atomic', 'origin', 'master:master', 'refs/tags/1.1.0:refs/tags/1.1.0'],
+            [event['command'] for event in events if event['event'] == 'command' and event['exit_code'] == 0],
+        )
+        self.assertEqual({'event': 'result', 'task': 'release', 'result': 'success'},
+                         {key: value for key, value in events[-1].items() if key != 'time'})
+
+    def test_version_profile(self):
+        self._create_project()
+
+        status, output = self._run_task('version', profile='version.pstats')
+
+        self.assertEqual(0, status, output)
+        profile_name = os.path.join(self.project, 'version.pstats')
+        self.assertIn('Wrote CPU profile to {}.'.format(profile_name), output)
+        self.assertNotIn('memory allocation report', output)
+        self.assertFalse(os.path.exists(profile_name + '.allocations.txt'))
+        functions = {function_name for _, _, function_name in pstats.Stats(profile_name).stats}
+        self.assertIn('_print_version_information', functions)
+        self.assertIn('_get_repository_maintenance_status', functions)
+
+    def test_version_profile_memory(self):
+        self._create_project()
+
+        status, output = self._run_task('version', profile='version.pstats', profile_memory=3)
+
+        self.assertEqual(0, status, output)
+        allocations_name = os.path.join(self.project, 'version.pstats.allocations.txt')
+        self.assertIn('Wrote CPU profile to {}.pstats.'.format(os.path.join(self.project, 'version')), output)
+        self.assertIn('Wrote memory allocation report to {}.'.format(allocations_name), output)
+        lines = self._read('version.pstats.allocations.txt').splitlines()
+        six.assertRegex(self, lines[0], r'^Traced memory: [0-9.]+ KiB at exit, [0-9.]+ KiB at peak$')
+        self.assertEqual('Top 3 allocating source lines:', lines[1])
+        self.assertEqual(3, len(lines[2:]))
+        for line in lines[2:]:
+            six.assertRegex(self, line, r':[0-9]+: size=')
+
+        # Tracing memory only makes sense together with the CPU profile
+        status, output = self._run_task('version', profile_memory=3)
+        self.assertIn('--profile-memory requires --profile.', output)
+
+    def test_gather_commit_messages_scoped_history(self):
+        self._create_project(configuration='scoped_history=True,')
+        self._release('1.1.0')
+        for file_name, message in (
+            ('python/demo/__init__.py', 'Change the module'),
+            ('notes.txt', 'Update the notes'),
+            ('docs/guide.txt', 'Update the guide'),
+            ('python/demo/util.py', 'Add a utility'),
+        ):
+            self._write(file_name, message + '\n')
+            self._git('add', file_name)
+            self._git('commit', '-q', '-m', message)
+
+        # Only the commits that touched the module's paths (here, the Python directory) are gathered
+        self.assertEqual(
+            ['- Add a utility', '- Change the module'],
+            json.loads(self._run_script('print(json.dumps(tasks._gather_commit_messages(False)))\n')),
+        )
+
+    def test_maintain_repository(self):
+        self._create_project(configuration='maintain_repository=True,')
+        status_script = 'print(json.dumps(tasks._get_repository_maintenance_status()))\n'
+
+        status, loose_refs = json.loads(self._run_script(status_script))
+        self.assertEqual('missing', status)
+        self.assertGreater(loose_refs, 0)
+
+        # The release writes the commit-graph and packs the refs after it is complete
+        self._release('1.1.0')
+
+        common_directory = os.path.join(self.project, '.git')
+        self.assertTrue(os.path.isfile(os.path.join(common_directory, 'objects', 'info', 'commit-graphs',
+                                                    'commit-graph-chain')))
+        with open(os.path.join(common_directory, 'packed-refs')) as packed_refs_read:
+            packed_refs = packed_refs_read.read()
+        self.assertIn('refs/tags/1.1.0', packed_refs)
+        self.assertIn('refs/heads/master', packed_refs)
+        self.assertEqual(['current', 0], json.loads(self._run_script(status_script)))
+        self.assertEqual(
+            self._git('log', '--format=%H'),
+            self._git('-c', 'core.commitGraph=true', 'log', '--format=%H'),
+        )
+
+        # A new commit is not in the commit-graph, and moves its branch back to a loose ref
+        self._write('notes.txt', 'Notes\n')
+        self._git('add', 'notes.txt')
+        self._git('commit', '-q', '-m', 'Add notes')
+        self.assertEqual(['stale', 1], json.loads(self._run_script(status_script)))
+
+    def test_release_worktree_refuses_modified_release_files(self):
+        self._create_project()
+        self._write('README.md', 'Demo 1.0.0, modified\n')
+
+        status, output = self._run_task('release', release_version='1.1.0', changelog='- Changes', yes=True,
+                                        worktree=True)
+
+        self.assertEqual(1, status)
+        self.assertIn('uncommitted changes', output)
+        self.assertEqual('Initial commit', self._git('log', '-1', '--format=%s'))
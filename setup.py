@@ -47,6 +47,11 @@ releases like so:
         str(''): str('python'),  # In Python 2, these can't be unicode; in Python 3, they must be
     },
     install_requires=install_requires,
+    entry_points={
+        'console_scripts': [
+            'invoke-release = invoke_release.cli:main',
+        ],
+    },
     # Invalid classifier prevents accidental upload to PyPI
     setup_requires=['pytest-runner'],
     tests_require=tests_require,